@@ -0,0 +1,221 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+benchmark.py: Time solvers and baselines over a grid of problem sizes.
+
+Run from the root of the repository, for instance with
+
+    python scripts/benchmark.py --positions 50 100 --anchors 4 --complexities 3 --outfile results/benchmark.json
+
+Each call appends one run (parameters, timings and some information about the machine) to the output file,
+so that performance regressions are visible from run to run.
+"""
+
+import sys
+from os.path import abspath, dirname
+
+sys.path.append(dirname(abspath(__file__)) + '/../source')
+
+import json
+import os
+import platform
+import subprocess
+import time
+
+import cvxpy as cp
+import numpy as np
+import pandas as pd
+
+from evaluate_dataset import compute_distance_matrix
+import hypothesis as h
+from measurements import get_measurements, create_anchors, create_mask
+from other_algorithms import least_squares_lm, pointwise_srls, pointwise_rls, get_grid
+from solvers import semidef_relaxation, trajectory_recovery
+from trajectory import Trajectory
+
+METHODS = [
+    'trajectory_recovery', 'semidef_relaxation', 'least_squares_lm', 'pointwise_srls', 'pointwise_rls',
+    'compute_distance_matrix', 'create_mask'
+]
+
+SOLVERS = {'CVXOPT': cp.CVXOPT, 'SCS': cp.SCS}
+
+
+def time_function(function, *args, n_repeat=3, **kwargs):
+    """ Time a function call.
+
+    :param function: function to time.
+    :param n_repeat: number of calls.
+    :param args, kwargs: arguments passed to the function.
+
+    :return: dict with the minimum, mean and maximum wall time (in seconds), the number of repetitions, and the
+    output of the last call.
+    """
+    timings = []
+    output = None
+    for _ in range(n_repeat):
+        start = time.perf_counter()
+        output = function(*args, **kwargs)
+        timings.append(time.perf_counter() - start)
+    return dict(min=min(timings), mean=float(np.mean(timings)), max=max(timings), n_repeat=n_repeat), output
+
+
+def create_dataframes(D_topright, times, anchors):
+    """ Create the data_df and anchors_df needed by :func:`evaluate_dataset.compute_distance_matrix`.
+
+    :param D_topright: squared distance matrix (N x M), zeros for missing measurements.
+    :param times: measurement times (length N).
+    :param anchors: anchor coordinates (dim x M).
+
+    :return: data_df, anchors_df
+    """
+    anchor_names = ['anchor {}'.format(m) for m in range(anchors.shape[1])]
+    anchors_df = pd.DataFrame({'anchor_name': anchor_names, 'px': anchors[0], 'py': anchors[1], 'pz': 0.0})
+
+    ns, ms = np.where(D_topright > 0)
+    data_df = pd.DataFrame({
+        'timestamp': np.array(times)[ns],
+        'anchor_name': np.array(anchor_names)[ms],
+        'distance': np.sqrt(D_topright[ns, ms]),
+    })
+    return data_df, anchors_df
+
+
+def run_benchmark(traj, anchors, n_positions, n_missing, methods=METHODS, n_repeat=3, sdp_solver=cp.CVXOPT):
+    """ Time all methods on one randomly generated setup.
+
+    :return: list of dicts, one per method, with the timings or the error message if the method failed.
+    """
+    n_anchors = anchors.shape[1]
+    times = traj.get_times(n_samples=n_positions)
+    basis, D_topright = get_measurements(traj, anchors, times=times)
+    mask = create_mask(n_positions, n_anchors, strategy='uniform', n_missing=n_missing)
+    D_topright = np.multiply(D_topright, mask)
+
+    indices = range(n_positions)[traj.dim + 2::3]
+    grid = get_grid(anchors, grid_size=0.1)
+    x0 = traj.coeffs.reshape((-1, )) + 0.1 * np.random.normal(size=traj.coeffs.size)
+    data_df, anchors_df = create_dataframes(D_topright, times, anchors)
+
+    calls = {
+        'trajectory_recovery': (trajectory_recovery, (D_topright, anchors, basis), {
+            'model': traj.model
+        }),
+        'semidef_relaxation': (semidef_relaxation, (D_topright, anchors, basis), {
+            'chosen_solver': sdp_solver
+        }),
+        'least_squares_lm': (least_squares_lm, (D_topright, anchors, basis, x0), {}),
+        'pointwise_srls': (pointwise_srls, (D_topright, anchors, traj, indices), {}),
+        'pointwise_rls': (pointwise_rls, (D_topright, anchors, traj, indices, grid), {}),
+        'compute_distance_matrix': (compute_distance_matrix, (data_df, anchors_df), {}),
+        'create_mask': (create_mask, (n_positions, n_anchors, 'limit_condition'), {
+            'n_missing': n_missing,
+            'dim': traj.dim,
+            'n_complexity': traj.n_complexity
+        }),
+    }
+
+    rank_ok = h.limit_condition(np.sort(np.sum(mask, axis=0))[::-1], traj.dim + 1, traj.n_complexity)
+
+    results = []
+    for method in methods:
+        function, args, kwargs = calls[method]
+        result = dict(method=method,
+                      n_positions=n_positions,
+                      n_anchors=n_anchors,
+                      n_complexity=traj.n_complexity,
+                      n_measurements=int(np.sum(mask)),
+                      rank_condition=bool(rank_ok))
+        try:
+            timings, _ = time_function(function, *args, n_repeat=n_repeat, **kwargs)
+            result.update(timings)
+        except Exception as e:
+            result['error'] = '{}: {}'.format(type(e).__name__, e)
+        results.append(result)
+    return results
+
+
+def get_commit():
+    """ Return the current git commit, or None if it cannot be determined. """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                       cwd=dirname(abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (subprocess.CalledProcessError, OSError):
+        return None
+
+
+def save_run(outfile, run):
+    """ Append run to the list of runs stored in outfile. """
+    runs = []
+    if os.path.exists(outfile):
+        with open(outfile, 'r') as fp:
+            runs = json.load(fp)
+    runs.append(run)
+    dirname_out = os.path.dirname(outfile)
+    if dirname_out != '' and not os.path.exists(dirname_out):
+        os.makedirs(dirname_out)
+    with open(outfile, 'w') as fp:
+        json.dump(runs, fp, indent=4)
+    print('saved as', outfile)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Time solvers and baselines over a grid of problem sizes.')
+    parser.add_argument('--positions', type=int, nargs='+', default=[50, 100, 200], help='numbers of positions N.')
+    parser.add_argument('--anchors', type=int, nargs='+', default=[4, 8], help='numbers of anchors M.')
+    parser.add_argument('--complexities', type=int, nargs='+', default=[3, 5], help='trajectory complexities K.')
+    parser.add_argument('--missing',
+                        type=float,
+                        nargs='+',
+                        default=[0.0, 0.5, 0.9],
+                        help='ratios of missing measurements (between 0 and 1).')
+    parser.add_argument('--methods', type=str, nargs='+', default=METHODS, choices=METHODS, help='methods to time.')
+    parser.add_argument('--sdp_solver',
+                        type=str,
+                        default='CVXOPT',
+                        choices=list(SOLVERS.keys()),
+                        help='solver used for semidef_relaxation.')
+    parser.add_argument('--n_repeat', type=int, default=3, help='number of calls per timing.')
+    parser.add_argument('--seed', type=int, default=1, help='random seed.')
+    parser.add_argument('--outfile', type=str, default='results/benchmark.json', help='json file to append to.')
+    args = parser.parse_args()
+
+    np.random.seed(args.seed)
+
+    timings = []
+    for n_complexity in args.complexities:
+        for n_anchors in args.anchors:
+            traj = Trajectory(n_complexity=n_complexity)
+            anchors = create_anchors(traj.dim, n_anchors, check=True)
+            for n_positions in args.positions:
+                for ratio in args.missing:
+                    n_missing = int(ratio * n_positions * n_anchors)
+                    print('N={}, M={}, K={}, missing={}'.format(n_positions, n_anchors, n_complexity, n_missing))
+                    results = run_benchmark(traj,
+                                            anchors,
+                                            n_positions,
+                                            n_missing,
+                                            methods=args.methods,
+                                            n_repeat=args.n_repeat,
+                                            sdp_solver=SOLVERS[args.sdp_solver])
+                    for result in results:
+                        result['missing_ratio'] = ratio
+                        if 'error' in result:
+                            print('  {:<25} failed: {}'.format(result['method'], result['error']))
+                        else:
+                            print('  {:<25} {:.2e}s'.format(result['method'], result['min']))
+                    timings.extend(results)
+
+    run = {
+        'time': time.time(),
+        'commit': get_commit(),
+        'machine': platform.platform(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'parameters': vars(args),
+        'timings': timings
+    }
+    save_run(args.outfile, run)
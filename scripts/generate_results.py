@@ -7,17 +7,31 @@ sys.path.append('../source')
 import matplotlib.pyplot as plt
 import matplotlib
 import numpy as np
-import pandas as pd
 from scipy.io import loadmat
 import seaborn as sns
 
 from coordinate_fitting import fit_trajectory
+from measurements import choose_suitable_measurements
 from other_algorithms import apply_algorithm, error_measure, cost_function
+from profiling import PROFILER, stage
+from result_table import ResultTable
 
 METHODS = ['ours-weighted', 'ours', 'lm-ellipse', 'lm-ours-weighted', 'srls', 'rls']
 
 
 def generate_suitable_mask(D, dim, K, n_measurements):
+    """ Choose n_measurements rows of D such that the limit condition is satisfied.
+
+    If each row contains exactly one measurement, the rows are drawn directly (uniformly) from the suitable subsets,
+    see :func:`measurements.choose_suitable_measurements`. Otherwise, random subsets are tried until one is suitable.
+
+    :return: sorted list of row indices.
+    """
+    n_per_row = np.sum(D > 0, axis=1)
+    if np.all(n_per_row == 1):
+        anchor_indices = np.argmax(D > 0, axis=1)
+        return list(choose_suitable_measurements(anchor_indices, n_measurements, dim, K, n_anchors=D.shape[1]))
+
     counter = 0
     while counter < 100:
         indices = sorted(np.random.choice(D.shape[0], n_measurements, replace=False))
@@ -30,59 +44,97 @@ def generate_suitable_mask(D, dim, K, n_measurements):
 
 def test_hypothesis(D, dim, K):
     import hypothesis as h
-    mask = (D)
+    mask = (D > 0)
     p = np.sort(np.sum(mask, axis=0))[::-1]
     return h.limit_condition(list(p), dim + 1, K)
 
 
-def generate_results(traj, D_small, times_small, anchors, points_small, methods=METHODS, n_it=0):
+def generate_results(traj,
+                     D_small,
+                     times_small,
+                     anchors,
+                     points_small,
+                     methods=METHODS,
+                     n_it=0,
+                     profile=True,
+                     profile_memory=False,
+                     table=None):
+    """ Apply all methods and add their errors to a table.
+
+    The estimated coefficients and points of each method are stored as arrays of the table (keys 'coeffs' and
+    'points'), and the column 'plotting' contains their id.
+
+    :param table: :class:`result_table.ResultTable` to add the results to. If None, a new table is created.
+    :param profile: if True, add columns with wall time per stage (time_total, time_constraints, time_svd, ...) and
+    number of cost evaluations (n_cost_evaluations) for each method. See :mod:`profiling`.
+    :param profile_memory: if True, also add columns with peak memory per stage (memory_total, ...). This slows down
+    all methods.
+
+    :return: the table.
+    """
+    if table is None:
+        table = ResultTable()
     n_complexity = traj.n_complexity
     n_measurements = np.sum(D_small > 0)
-    current_results = pd.DataFrame(
-        columns=['n_it', 'n_complexity', 'n_measurements', 'mae', 'mse', 'method', 'plotting', 'cost_rls', 'cost_srls'])
-
-    basis_small = traj.get_basis(times=times_small)
-
-    for method in methods:
-        C_hat, p_hat, lat_idx = apply_algorithm(traj, D_small, times_small, anchors, method=method)
-        plotting = (C_hat, p_hat)
-        mae = mse = cost_rls = cost_slrs = None
-        if C_hat is not None:
-            traj.set_coeffs(coeffs=C_hat)
-            p_fitted = traj.get_sampling_points(times=times_small).T
-            mae = error_measure(p_fitted, points_small, 'mae')
-            mse = error_measure(p_fitted, points_small, 'mse')
-            cost_rls = np.sum(cost_function(C_hat.reshape((-1, )), D_small, anchors, basis_small, squared=False))
-            cost_srls = np.sum(cost_function(C_hat.reshape((-1, )), D_small, anchors, basis_small, squared=True))
-        current_results.loc[len(current_results)] = dict(plotting=plotting,
-                                                         n_complexity=n_complexity,
-                                                         n_measurements=n_measurements,
-                                                         method=method,
-                                                         n_it=n_it,
-                                                         mae=mae,
-                                                         mse=mse,
-                                                         cost_rls=cost_rls,
-                                                         cost_srls=cost_srls)
-
-        # do raw version if applicable
-        if method in ['rls', 'srls']:
-            points_small_lat = points_small[lat_idx]
-            mae = error_measure(p_hat, points_small_lat, 'mae')
-            mse = error_measure(p_hat, points_small_lat, 'mse')
-            current_results.loc[len(current_results)] = dict(plotting=(None, None),
-                                                             n_complexity=n_complexity,
-                                                             n_measurements=n_measurements,
-                                                             method=method + ' raw',
-                                                             n_it=n_it,
-                                                             mae=mae,
-                                                             mse=mse,
-                                                             cost_rls=cost_rls,
-                                                             cost_srls=cost_srls)
-    return current_results
-
-
-def add_gt_fitting(traj, times_small, points_small, current_results, n_it=0):
-    # fit ground truth to chosen points.
+
+    if profile:
+        PROFILER.enable(memory=profile_memory)
+        PROFILER.reset()
+
+    try:
+        basis_small = traj.get_basis(times=times_small)
+
+        for method in methods:
+            PROFILER.reset()
+            with stage('total'):
+                C_hat, p_hat, lat_idx = apply_algorithm(traj, D_small, times_small, anchors, method=method)
+            profiling_results = PROFILER.get_results() if profile else {}
+
+            plotting = table.add_arrays(coeffs=C_hat, points=p_hat)
+            mae = mse = cost_rls = cost_slrs = None
+            if C_hat is not None:
+                traj.set_coeffs(coeffs=C_hat)
+                p_fitted = traj.get_sampling_points(times=times_small).T
+                mae = error_measure(p_fitted, points_small, 'mae')
+                mse = error_measure(p_fitted, points_small, 'mse')
+                cost_rls = np.sum(cost_function(C_hat.reshape((-1, )), D_small, anchors, basis_small, squared=False))
+                cost_srls = np.sum(cost_function(C_hat.reshape((-1, )), D_small, anchors, basis_small, squared=True))
+            table.append(
+                dict(plotting=plotting,
+                     n_complexity=n_complexity,
+                     n_measurements=n_measurements,
+                     method=method,
+                     n_it=n_it,
+                     mae=mae,
+                     mse=mse,
+                     cost_rls=cost_rls,
+                     cost_srls=cost_srls,
+                     **profiling_results))
+
+            # do raw version if applicable
+            if method in ['rls', 'srls']:
+                points_small_lat = points_small[lat_idx]
+                mae = error_measure(p_hat, points_small_lat, 'mae')
+                mse = error_measure(p_hat, points_small_lat, 'mse')
+                table.append(
+                    dict(plotting=table.add_arrays(coeffs=None, points=None),
+                         n_complexity=n_complexity,
+                         n_measurements=n_measurements,
+                         method=method + ' raw',
+                         n_it=n_it,
+                         mae=mae,
+                         mse=mse,
+                         cost_rls=cost_rls,
+                         cost_srls=cost_srls,
+                         **profiling_results))
+    finally:
+        if profile:
+            PROFILER.disable()
+    return table
+
+
+def add_gt_fitting(traj, times_small, points_small, table, n_it=0):
+    """ Fit the trajectory to the ground truth points and add the result (method 'gt') to the table. """
     n_complexity = traj.n_complexity
     n_measurements = len(times_small)
 
@@ -94,15 +146,16 @@ def add_gt_fitting(traj, times_small, points_small, current_results, n_it=0):
     mse = error_measure(points_fitted, points_small, 'mse')
     mae = error_measure(points_fitted, points_small, 'mae')
 
-    current_results.loc[len(current_results)] = dict(plotting=(coeffs, points_fitted),
-                                                     n_complexity=n_complexity,
-                                                     n_measurements=n_measurements,
-                                                     method='gt',
-                                                     n_it=n_it,
-                                                     mae=mae,
-                                                     mse=mse,
-                                                     cost_rls=None,
-                                                     cost_srls=None)
+    table.append(
+        dict(plotting=table.add_arrays(coeffs=coeffs, points=points_fitted),
+             n_complexity=n_complexity,
+             n_measurements=n_measurements,
+             method='gt',
+             n_it=n_it,
+             mae=mae,
+             mse=mse,
+             cost_rls=None,
+             cost_srls=None))
     return points_fitted
 
 
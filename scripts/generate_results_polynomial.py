@@ -4,17 +4,18 @@
 generate_results_polynomial.py: Generate polynomial results (average over many linear movements).
 """
 
+import os
 import sys
 sys.path.append('../source/')
 
 import matplotlib.pyplot as plt
 import matplotlib
 import numpy as np
-import pandas as pd
 
 from public_data_utils import read_dataset, get_plotting_params, get_ground_truth, TIME_RANGES
-from evaluate_dataset import compute_distance_matrix, compute_anchors
-from generate_results import generate_results, generate_suitable_mask, calibrate, add_gt_fitting
+from evaluate_dataset import compute_distance_matrix, compute_anchors, calibrate
+from generate_results import generate_results, generate_suitable_mask, add_gt_fitting
+from result_table import ResultTable
 
 METHODS = ['ours-weighted', 'ours', 'lm-ours-weighted', 'lm-line', 'srls', 'rls']
 
@@ -81,7 +82,11 @@ if __name__ == "__main__":
     ## Construct anchors.
     anchors = compute_anchors(anchors_df, anchor_names)
 
-    result_df = pd.DataFrame()
+    # results are flushed to chunkname during the experiments, and saved as a DataFrame in resultname at the end.
+    result_table = ResultTable()
+    chunkname = resultname.replace('.pkl', '.chunks')
+    if resultname != '' and os.path.exists(chunkname):
+        os.remove(chunkname)
 
     if plotting:
         fig, axs = plt.subplots(1, len(time_ranges), sharex=True, sharey=True)
@@ -134,25 +139,36 @@ if __name__ == "__main__":
                     times_small = np.array(times)[indices]
                     points_small = points_gt[indices, :]
 
-                    df = generate_results(traj, D_small, times_small, anchors, points_small, methods=METHODS, n_it=k)
-                    points_fitted = add_gt_fitting(traj, times_small, points_small, df, n_it=k)
-
-                    result_df = pd.concat((result_df, df), ignore_index=True, sort=False)
+                    last_start = len(result_table)
+                    generate_results(traj,
+                                     D_small,
+                                     times_small,
+                                     anchors,
+                                     points_small,
+                                     methods=METHODS,
+                                     n_it=k,
+                                     table=result_table)
+                    points_fitted = add_gt_fitting(traj, times_small, points_small, result_table, n_it=k)
                 if resultname != '':
-                    result_df.to_pickle(resultname)
-                    print('saved as', resultname)
+                    result_table.flush(chunkname)
+                    print('saved as', chunkname)
 
         ## Plot the last one.
         if not plotting:
             continue
 
         traj_plot = traj.copy()
+        df = result_table.to_dataframe(start=last_start, plotting=True)
         for method, df_method in df.groupby('method'):
             coeffs, __ = df_method.loc[:, 'plotting'].values[0]
             if coeffs is not None:
                 traj_plot.set_coeffs(coeffs=coeffs)
                 traj_plot.plot_pretty(ax=ax, times=times, label=method)
 
+    if resultname != '':
+        result_table.to_dataframe(plotting=True).to_pickle(resultname)
+        print('saved as', resultname)
+
     if plotting:
         axs[-1].legend(loc='lower right')
         [ax.set_xlim(*xlim) for ax in axs]
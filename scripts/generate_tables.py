@@ -0,0 +1,152 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+generate_tables.py: Generate the latex tables of results on the public datasets, with cached stages.
+
+The tables are created by a pipeline of named stages (read_dataset, compute_distances, run_methods, aggregate and
+to_latex, see :mod:`pipeline`). The output of each stage is cached, so that rerunning the script only recomputes the
+stages whose inputs or code changed. For instance, changing the methods printed in the table only reruns aggregate
+and to_latex.
+
+Run from the root of the repository, for instance with
+
+    python scripts/generate_tables.py --table polynomial --datasets datasets/Plaza1.mat --processes 4
+
+or, to create the table from existing results,
+
+    python scripts/generate_tables.py --table polynomial --results results/polynomial_tuesday.pkl
+
+"""
+
+import sys
+from os.path import abspath, dirname
+
+sys.path.append(dirname(abspath(__file__)) + '/../source')
+
+import pandas as pd
+
+from pipeline import Pipeline
+from public_data_utils import TIME_RANGES
+import public_data_utils
+import run_experiments
+from table_tools import get_pivot_table, latex_print
+
+# parameters of the tables of the paper, see notebook PublicDatasets.
+TABLE_METHODS = ['gt', 'srls raw', 'srls', 'rls raw', 'rls', 'lm-line', 'lm-ours-weighted', 'ours', 'ours-weighted']
+TABLES = {
+    'polynomial': {
+        'measurements': [10, 20, 30, 50],
+        'complexities': None,
+        'methods': TABLE_METHODS,
+        'latex_kwargs': {
+            'index_names': False,
+            'index': False
+        },
+    },
+    'bandlimited': {
+        'measurements': [100, 300, 499],
+        'complexities': [5, 11, 19],
+        'methods': [m.replace('lm-line', 'lm-ellipse') for m in TABLE_METHODS],
+        'latex_kwargs': {},
+    },
+}
+
+# modules used to run the methods, a change in any of them reruns the methods.
+METHOD_MODULES = [
+    'run_experiments', 'generate_results', 'other_algorithms', 'solvers', 'constraints', 'coordinate_fitting',
+    'measurements', 'trajectory', 'result_table'
+]
+
+PIPELINE = Pipeline('results/cache/', verbose=True)
+
+
+@PIPELINE.stage(depends=['public_data_utils', 'evaluate_dataset', 'trajectory_creator'])
+def read_dataset(filename):
+    return public_data_utils.read_dataset(filename)
+
+
+@PIPELINE.stage(depends=['run_experiments', 'evaluate_dataset'])
+def compute_distances(filename, dataset, time_ranges=TIME_RANGES, chosen_distance='distance_calib'):
+    full_df, anchors_df, traj = dataset
+    return run_experiments.get_segments(filename, full_df, anchors_df, traj, time_ranges, chosen_distance)
+
+
+@PIPELINE.stage(depends=METHOD_MODULES, ignore=['n_processes'])
+def run_methods(segments, list_measurements, list_complexities, n_its, seed=1, n_processes=None):
+    tasks = run_experiments.get_tasks(segments, list_measurements, list_complexities, n_its, seed=seed)
+    result_table = run_experiments.run_experiments(segments, tasks, n_processes=n_processes, verbose=True)
+    return result_table.to_dataframe(plotting=True)
+
+
+@PIPELINE.stage(depends=['table_tools'])
+def aggregate(result_dfs, list_measurements, list_complexities=None, methods=None, value='mse'):
+    result_df = pd.concat(result_dfs, ignore_index=True)
+    # convert all numerical columns to float, ignore non-numeric.
+    for column in result_df.columns:
+        try:
+            result_df[column] = pd.to_numeric(result_df[column])
+        except (ValueError, TypeError):
+            pass
+    print_table = result_df[result_df.n_measurements.isin(list_measurements)]
+    if list_complexities is not None:
+        print_table = print_table[print_table.n_complexity.isin(list_complexities)]
+    return get_pivot_table(print_table, methods=methods, value=value)
+
+
+def format_number(number):
+    if number > 10000:
+        return '{:.2e}'.format(number)
+    else:
+        return '{:.1f}'.format(number)
+
+
+@PIPELINE.stage(depends=['table_tools', format_number])
+def to_latex(pt, methods, latex_kwargs):
+    return latex_print(pt.copy(), methods, float_format=format_number, **latex_kwargs)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Generate the latex tables of results on the public datasets.')
+    parser.add_argument('--table', type=str, default='polynomial', choices=list(TABLES.keys()), help='table to create.')
+    parser.add_argument('--datasets', type=str, nargs='+', default=['datasets/Plaza1.mat'], help='datasets to use.')
+    parser.add_argument('--results',
+                        type=str,
+                        nargs='+',
+                        default=None,
+                        help='pickle files of existing results, used instead of running the methods.')
+    parser.add_argument('--complexities', type=int, nargs='+', default=[2], help='trajectory complexities K to run.')
+    parser.add_argument('--n_its', type=int, default=5, help='number of random subsets per setting.')
+    parser.add_argument('--distance', type=str, default='distance_calib', help='distance column to use.')
+    parser.add_argument('--processes', type=int, default=None, help='number of processes (default: all CPUs).')
+    parser.add_argument('--seed', type=int, default=1, help='random seed.')
+    parser.add_argument('--cache', type=str, default='results/cache/', help='folder of cached stage outputs.')
+    parser.add_argument('--outfile', type=str, default=None, help='latex file (default: results/table_<table>.tex).')
+    args = parser.parse_args()
+
+    PIPELINE.folder = args.cache
+    table = TABLES[args.table]
+
+    if args.results is not None:
+        result_dfs = [pd.read_pickle(filename) for filename in args.results]
+    else:
+        result_dfs = []
+        for filename in args.datasets:
+            dataset = read_dataset(filename)
+            segments = compute_distances(filename, dataset, chosen_distance=args.distance)
+            result_dfs.append(
+                run_methods(segments,
+                            table['measurements'],
+                            args.complexities,
+                            args.n_its,
+                            seed=args.seed,
+                            n_processes=args.processes))
+
+    pt = aggregate(result_dfs, table['measurements'], table['complexities'], table['methods'])
+    latex = to_latex(pt, table['methods'], table['latex_kwargs'])
+
+    outfile = 'results/table_{}.tex'.format(args.table) if args.outfile is None else args.outfile
+    with open(outfile, 'w') as f:
+        f.write(latex)
+    print('wrote as', outfile)
@@ -0,0 +1,221 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+run_experiments.py: Run all methods on the public datasets, in parallel.
+
+The grid of datasets, time ranges (segments), numbers of measurements, complexities and iterations is expanded
+into independent tasks, which are executed on a process pool. The datasets are read and the distance matrices are
+computed only once, in the main process, and shared with the workers. Each task has its own seed (derived from the
+global seed and the position of the task in the grid), so results do not depend on the number of processes.
+
+Run from the root of the repository, for instance with
+
+    python scripts/run_experiments.py --datasets datasets/Plaza1.mat --measurements 8 10 20 --complexities 2 \
+            --n_its 5 --processes 4 --outfile results/polynomial.pkl
+
+"""
+
+import sys
+from os.path import abspath, dirname
+
+sys.path.append(dirname(abspath(__file__)) + '/../source')
+
+from multiprocessing import Pool
+import os
+import time
+
+import numpy as np
+
+from evaluate_dataset import compute_distance_matrix, compute_anchors, calibrate
+from generate_results import generate_results, generate_suitable_mask, add_gt_fitting, METHODS
+from public_data_utils import read_dataset, get_ground_truth, TIME_RANGES
+from result_table import ResultTable
+
+RANGE_SYSTEM_ID = 'Range'
+
+# inputs shared by all tasks of a worker, see init_worker.
+_SEGMENTS = None
+
+
+def prepare_segments(filename, time_ranges=TIME_RANGES, chosen_distance='distance_calib', anchor_names=None):
+    """ Read a dataset and compute the inputs of all its segments.
+
+    :param filename: dataset to read with :func:`public_data_utils.read_dataset`.
+    :param time_ranges: list of (start, end) times of the segments. If None, the whole dataset is one segment.
+    :param chosen_distance: distance column to use.
+    :param anchor_names: anchors to use. Set to None to use all.
+
+    :return: list of dicts, one per segment, with the trajectory model, anchors, distance matrix, times and
+    ground truth points.
+    """
+    full_df, anchors_df, traj = read_dataset(filename)
+    return get_segments(filename, full_df, anchors_df, traj, time_ranges, chosen_distance, anchor_names)
+
+
+def get_segments(filename,
+                 full_df,
+                 anchors_df,
+                 traj,
+                 time_ranges=TIME_RANGES,
+                 chosen_distance='distance_calib',
+                 anchor_names=None):
+    """ Compute the inputs of all segments of a dataset already read. full_df is not modified.
+
+    Parameters are as for :func:`prepare_segments`, full_df, anchors_df and traj are the outputs of
+    :func:`public_data_utils.read_dataset`.
+    """
+    if chosen_distance == 'distance_calib':
+        full_df = full_df.copy()
+        calibrate(full_df)
+    anchors = compute_anchors(anchors_df, anchor_names)[:2, :]
+
+    if time_ranges is None:
+        time_ranges = [(full_df.timestamp.min() - 1, full_df.timestamp.max() + 1)]
+    max_time = full_df.timestamp.max()
+
+    segments = []
+    for time_range in time_ranges:
+        if time_range[0] >= max_time:
+            continue
+        part_df = full_df[(full_df.timestamp < time_range[1]) & (full_df.timestamp > time_range[0])]
+        times = part_df[part_df.system_id == RANGE_SYSTEM_ID].timestamp.unique()
+        if len(times) == 0:
+            continue
+        D, times = compute_distance_matrix(part_df, anchors_df, anchor_names, times, chosen_distance)
+        points_gt = get_ground_truth(part_df, times).loc[:, ['px', 'py']].values
+        segments.append(
+            dict(dataset=filename,
+                 time_range=tuple(time_range),
+                 traj=traj.copy(),
+                 anchors=anchors,
+                 D=D,
+                 times=np.array(times),
+                 points_gt=points_gt))
+    return segments
+
+
+def get_tasks(segments, list_measurements, list_complexities, n_its, methods=METHODS, seed=1):
+    """ Expand the grid of experiments into a list of tasks.
+
+    Combinations with more measurements than available, or less than the minimum (D+2)K-1, are skipped.
+
+    :return: list of dicts, each with a segment index, the experiment parameters and a seed.
+    """
+    tasks = []
+    for segment_idx, segment in enumerate(segments):
+        n_available = segment['D'].shape[0]
+        dim = segment['traj'].dim
+        for n_measurements in list_measurements:
+            if n_measurements > n_available:
+                continue
+            for n_complexity in list_complexities:
+                if n_measurements < n_complexity * (dim + 2) - 1:
+                    continue
+                for n_it in range(n_its):
+                    # the seed only depends on the position of the task in the grid.
+                    entropy = [seed, segment_idx, n_measurements, n_complexity, n_it]
+                    task_seed = int(np.random.SeedSequence(entropy).generate_state(1)[0])
+                    tasks.append(
+                        dict(segment_idx=segment_idx,
+                             n_measurements=n_measurements,
+                             n_complexity=n_complexity,
+                             n_it=n_it,
+                             methods=methods,
+                             seed=task_seed))
+    return tasks
+
+
+def init_worker(segments):
+    """ Make the segments available to the tasks of this worker. """
+    global _SEGMENTS
+    _SEGMENTS = segments
+
+
+def run_task(task):
+    """ Run all methods on one random subset of measurements of a segment.
+
+    :return: :class:`result_table.ResultTable` with the results.
+    """
+    segment = _SEGMENTS[task['segment_idx']]
+    np.random.seed(task['seed'])
+
+    traj = segment['traj'].copy()
+    traj.set_n_complexity(task['n_complexity'])
+    indices = generate_suitable_mask(segment['D'], traj.dim, traj.n_complexity, task['n_measurements'])
+    D_small = segment['D'][indices, :]
+    times_small = segment['times'][indices]
+    points_small = segment['points_gt'][indices, :]
+
+    table = generate_results(traj,
+                             D_small,
+                             times_small,
+                             segment['anchors'],
+                             points_small,
+                             methods=task['methods'],
+                             n_it=task['n_it'],
+                             profile=False)
+    add_gt_fitting(traj, times_small, points_small, table, n_it=task['n_it'])
+    return table
+
+
+def run_experiments(segments, tasks, n_processes=None, verbose=False):
+    """ Run all tasks, in parallel if n_processes is not 1.
+
+    :param n_processes: number of processes. None uses all CPUs.
+
+    :return: :class:`result_table.ResultTable` with the results of all tasks, in the order of the tasks.
+    """
+    result_table = ResultTable()
+
+    def add_results(tables):
+        start = time.time()
+        for i, (task, table) in enumerate(zip(tasks, tables)):
+            segment = segments[task['segment_idx']]
+            result_table.extend(table, dataset=segment['dataset'], time_range=segment['time_range'])
+            if verbose:
+                print('done with {}/{} tasks after {:.1f}s'.format(i + 1, len(tasks), time.time() - start))
+
+    if n_processes == 1:
+        init_worker(segments)
+        add_results(map(run_task, tasks))
+    else:
+        if n_processes is None:
+            n_processes = os.cpu_count()
+        # the pool is terminated when leaving the block, also if a task raises an error.
+        with Pool(n_processes, initializer=init_worker, initargs=(segments, )) as pool:
+            add_results(pool.imap(run_task, tasks, chunksize=max(1, len(tasks) // (8 * n_processes))))
+    return result_table
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Run all methods on the public datasets, in parallel.')
+    parser.add_argument('--datasets', type=str, nargs='+', default=['datasets/Plaza1.mat'], help='datasets to use.')
+    parser.add_argument('--whole',
+                        action='store_true',
+                        help='use each dataset as one segment, instead of the time ranges TIME_RANGES.')
+    parser.add_argument('--measurements',
+                        type=int,
+                        nargs='+',
+                        default=[8, 10, 20, 30, 40, 50, 60],
+                        help='numbers of measurements N.')
+    parser.add_argument('--complexities', type=int, nargs='+', default=[2], help='trajectory complexities K.')
+    parser.add_argument('--n_its', type=int, default=5, help='number of random subsets per setting.')
+    parser.add_argument('--methods', type=str, nargs='+', default=METHODS, help='methods to run.')
+    parser.add_argument('--distance', type=str, default='distance_calib', help='distance column to use.')
+    parser.add_argument('--processes', type=int, default=None, help='number of processes (default: all CPUs).')
+    parser.add_argument('--seed', type=int, default=1, help='random seed.')
+    parser.add_argument('--outfile', type=str, default='results/experiments.pkl', help='pickle file of results.')
+    args = parser.parse_args()
+
+    segments = []
+    for filename in args.datasets:
+        time_ranges = None if args.whole else TIME_RANGES
+        segments += prepare_segments(filename, time_ranges=time_ranges, chosen_distance=args.distance)
+    tasks = get_tasks(segments, args.measurements, args.complexities, args.n_its, methods=args.methods, seed=args.seed)
+    print('running {} tasks on {} segments'.format(len(tasks), len(segments)))
+
+    result_table = run_experiments(segments, tasks, n_processes=args.processes, verbose=True)
+    result_table.to_dataframe(plotting=True).to_pickle(args.outfile)
+    print('saved as', args.outfile)
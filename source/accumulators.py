@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+accumulators.py: Online statistics with bounded memory, to summarize large simulations.
+
+All accumulators can be updated with single values or batches of values, and use memory independent of the number
+of values seen so far.
+"""
+
+import numpy as np
+
+
+class RunningStatistics(object):
+    """ Mean and variance using Welford's algorithm, possibly for an array of independent quantities.
+
+    :member count: number of values seen (per entry).
+    :member mean: running mean (per entry).
+    :member m2: running sum of squared deviations from the mean (per entry).
+    """
+    def __init__(self, shape=()):
+        self.count = np.zeros(shape)
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+
+    def add(self, value, index=Ellipsis):
+        """ Add a single value to the entry at index. """
+        self.count[index] += 1
+        delta = value - self.mean[index]
+        self.mean[index] += delta / self.count[index]
+        self.m2[index] += delta * (value - self.mean[index])
+
+    def update(self, values):
+        """ Add a batch of values, of shape (n_values, ) + shape. """
+        values = np.asarray(values, dtype=float)
+        if values.shape[0] == 0:
+            return
+        self._combine(values.shape[0], np.mean(values, axis=0), np.sum((values - np.mean(values, axis=0))**2, axis=0))
+
+    def merge(self, other):
+        """ Add all values seen by other. """
+        self._combine(other.count, other.mean, other.m2)
+
+    def _combine(self, count, mean, m2):
+        # parallel algorithm by Chan et al.
+        total = self.count + count
+        delta = mean - self.mean
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio = np.where(total > 0, count / total, 0.0)
+        self.mean = self.mean + delta * ratio
+        self.m2 = self.m2 + m2 + delta**2 * self.count * ratio
+        self.count = total
+
+    def get_variance(self):
+        """ Return the (population) variance, nan for entries without values. """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(self.count > 0, self.m2 / self.count, np.nan)
+
+    def get_std(self):
+        return np.sqrt(self.get_variance())
+
+
+class Histogram(object):
+    """ Histogram with fixed bins.
+
+    :member edges: bin edges (increasing).
+    :member counts: number of values per bin, the first and last entries count the values below edges[0] and
+    above edges[-1] respectively.
+    """
+    def __init__(self, edges):
+        self.edges = np.asarray(edges, dtype=float)
+        self.counts = np.zeros(len(self.edges) + 1, dtype=int)
+
+    def update(self, values):
+        """ Add a batch of values. """
+        indices = np.searchsorted(self.edges, np.ravel(values), side='right')
+        self.counts += np.bincount(indices, minlength=len(self.counts))
+
+
+class ReservoirSample(object):
+    """ Uniform random sample of fixed maximum size from a stream of values (reservoir sampling).
+
+    Can be used as a quantile sketch: the quantiles of the sample estimate the quantiles of all values.
+
+    :member size: maximum size of the sample.
+    :member n_seen: number of values seen.
+    """
+    def __init__(self, size=10000, seed=None):
+        """
+        :param size: maximum size of the sample.
+        :param seed: seed of the random generator of this sample. If None, the global numpy random state is used, so
+        that the sample is reproducible with np.random.seed.
+        """
+        self.size = size
+        self.n_seen = 0
+        self._sample = np.empty(size)
+        self._random = np.random if seed is None else np.random.RandomState(seed)
+
+    def update(self, values):
+        """ Add a batch of values. """
+        values = np.ravel(values)
+        # fill the reservoir first.
+        n_fill = min(max(self.size - self.n_seen, 0), len(values))
+        self._sample[self.n_seen:self.n_seen + n_fill] = values[:n_fill]
+
+        # then replace random elements, with probability size / (number of values seen).
+        seen = self.n_seen + n_fill + np.arange(len(values) - n_fill)
+        targets = np.floor(self._random.uniform(size=len(seen)) * (seen + 1)).astype(int)
+        keep = targets < self.size
+        self._sample[targets[keep]] = values[n_fill:][keep]
+        self.n_seen += len(values)
+
+    def get_sample(self):
+        return self._sample[:min(self.n_seen, self.size)]
+
+    def get_quantiles(self, q):
+        """ Estimate the quantiles q (between 0 and 1) of all values seen. """
+        return np.quantile(self.get_sample(), q)
@@ -5,13 +5,17 @@ constraints.py: Generate constraints for trajectory_recovery and semidefinite re
 Note that Z is defined as Z = [I_D coeffs; coeffs^T L]
 """
 
-from global_variables import DIM
+from functools import lru_cache
+
+from global_variables import DIM, BSPLINE_DEGREE
+from measurements import as_measurements
 import numpy as np
+import scipy.sparse as sp
 
 
 def verify_dimensions(D_topright, anchors, basis):
     """
-    :param D_topright: n_positions x n_anchors
+    :param D_topright: n_positions x n_anchors (dense matrix or :class:`measurements.Measurements`)
     :param anchors: dim x n_anchors
     :param basis: n_complexity x n_positions
 
@@ -36,15 +40,17 @@ def get_constraints_D(D_topright, anchors, basis, vectorized=False, A=None, b=No
 
     where :math:`t_{mn} = (a_m^T -f_n^T)^T`
 
-    :param D_topright: squared distsance measurements, shape (n_positions x n_anchors)
+    :param D_topright: squared distsance measurements, shape (n_positions x n_anchors), or
+                       :class:`measurements.Measurements` instance.
     :param anchors: anchor coordinates, shape (dim x n_anchors)
     :param basis: basis vectors, shape (n_complexity x n_positions)
 
     """
     verify_dimensions(D_topright, anchors, basis)
 
+    measurements = as_measurements(D_topright)
     dim = anchors.shape[0]
-    Ns, Ms = np.where(D_topright > 0)
+    Ns, Ms = measurements.time_indices, measurements.anchor_indices
     n_complexity = basis.shape[0]
 
     if not vectorized:
@@ -63,10 +69,10 @@ def get_constraints_D(D_topright, anchors, basis, vectorized=False, A=None, b=No
             t_mn = np.array(t_mn)
             tmp = t_mn @ t_mn.T
             A.append(tmp.flatten())
-            b.append(D_topright[n, m])
+            b.append(measurements.squared_distances[i])
         else:
             t_mns.append(t_mn)
-            D_mns.append(D_topright[n, m])
+            D_mns.append(measurements.squared_distances[i])
 
     if not vectorized:
         return t_mns, D_mns
@@ -150,34 +156,248 @@ def get_constraints_symmetry(n_complexity, dim=DIM, vectorized=True, A=None, b=N
 def get_C_constraints(D_topright, anchors, basis, weighted=False):
     """ Return constraints TA, TB, and vector b as defined in paper.
 
-    :param D_topright: matrix of square distances, of shape n_positions x n_anchors.
+    :param D_topright: matrix of square distances, of shape n_positions x n_anchors, or
+                       :class:`measurements.Measurements` instance. If the latter has weights, each constraint is
+                       multiplied by its weight.
     :param weighted: bool, if true return measurements and constraints divided by the weight depended on the distance, in order to normalise errors. Makes sense only when errors are added to distances
     """
 
     verify_dimensions(D_topright, anchors, basis)
 
-    Ns, Ms = np.where(D_topright > 0)
-    dim = basis.shape[0]
+    measurements = as_measurements(D_topright)
+    squared_distances = measurements.squared_distances
+    a_ms = anchors[:, measurements.anchor_indices]  # dim x n_measurements
+    f_ns = basis[:, measurements.time_indices]  # K x n_measurements
 
-    T_A = []
-    T_B = []
-    b = []
+    weights = 1.0 / np.sqrt(squared_distances + 1e-1) if weighted else np.ones(len(measurements))
+    if measurements.weights is not None:
+        weights = weights * measurements.weights
 
-    for (m, n) in zip(Ms, Ns):
-        weight = 1.0 / np.sqrt((D_topright[n, m]) + 1e-1) if weighted else 1.0
-        a_m = np.reshape(anchors[:, m], (-1, 1))
-        f_n = basis[:, n].reshape(dim, 1)
+    # row i is the flattened outer product of a_m and f_n, respectively f_n and f_n.
+    T_A = weights[:, None] * np.einsum('in,jn->nij', a_ms, f_ns).reshape((len(measurements), -1))
+    T_B = weights[:, None] * np.einsum('in,jn->nij', f_ns, f_ns).reshape((len(measurements), -1))
+    b = weights * (np.sum(a_ms * a_ms, axis=0) - squared_distances) / 2
 
-        tmp = a_m @ f_n.T
-        T_A.append(weight * tmp.flatten())
+    return T_A, T_B, b
 
-        tmp = f_n @ f_n.T
-        T_B.append(weight * tmp.flatten())
 
-        b.append(weight * (np.sum(a_m * a_m) - D_topright[n, m]) / 2)
+def get_C_normal_equations(D_topright, anchors, basis, reduction, weighted=False):
+    """ Return the normal equations :math:`T^T T` and :math:`T^T b` of the linear constraints, without building T.
 
-    T_A = np.array(T_A)
-    T_B = np.array(T_B)
-    b = np.array(b)
+    Here, T is the matrix [T_A, -T_B R / 2] used in :func:`solvers.trajectory_recovery`, with R the given reduction
+    matrix. The rows of T_A are :math:`a_m \otimes f_n`, so for instance
 
-    return T_A, T_B, b
+    .. math::
+        T_A^T T_A = \sum_m a_m a_m^T \otimes \sum_{n \in N_m} f_n f_n^T
+
+    where :math:`N_m` are the measurements of anchor m. All blocks are built from such per-anchor sums, so the size
+    of the normal matrix does not depend on the number of measurements, and the cost is linear in it. The
+    intermediate per-sample terms are not constant in size: the reduced products G of all positions
+    (n_positions x r), and the basis vectors and products of the measurements of one anchor at a time.
+
+    Parameters are as in :func:`.get_C_constraints`, and
+
+    :param reduction: reduction matrix of T_B, of shape K^2 x r, see :func:`.get_reduction_matrix`.
+
+    :return: T^T T of shape (dim*K + r) x (dim*K + r), and T^T b of length dim*K + r. If the basis and reduction
+             matrix are sparse (bspline model), T^T T is a sparse matrix with a banded structure.
+    """
+    verify_dimensions(D_topright, anchors, basis)
+
+    measurements = as_measurements(D_topright)
+    dim = anchors.shape[0]
+    K = basis.shape[0]
+
+    weights = 1.0 / np.sqrt(measurements.squared_distances + 1e-1) if weighted else np.ones(len(measurements))
+    if measurements.weights is not None:
+        weights = weights * measurements.weights
+    weights_sq = weights**2
+
+    sparse = sp.issparse(basis)
+    if sparse:
+        basis = sp.csc_matrix(basis)
+        kron = sp.kron
+    else:
+        kron = np.kron
+
+    # reduced rows of T_B, for each position: g_n = R^T vect(f_n f_n^T).
+    G = _get_basis_products_matrix(basis) @ reduction  # n_positions x r
+    if sp.issparse(G):
+        G = sp.csr_matrix(G)
+
+    TT_AA, TT_AB, TT_BB = [], [], []
+    Tb_A = np.zeros(dim * K)
+    Tb_B = np.zeros(reduction.shape[1])
+
+    order = np.argsort(measurements.anchor_indices, kind='stable')
+    bounds = np.searchsorted(measurements.anchor_indices[order], np.arange(anchors.shape[1] + 1))
+    for m in range(anchors.shape[1]):
+        indices = order[bounds[m]:bounds[m + 1]]
+        if not len(indices):
+            continue
+        a_m = anchors[:, m]
+        f_ns = basis[:, measurements.time_indices[indices]]  # K x n_m
+        g_ns = G[measurements.time_indices[indices]]  # n_m x r
+        b_ns = (a_m.dot(a_m) - measurements.squared_distances[indices]) / 2
+
+        if sparse:
+            f_weighted = f_ns @ sp.diags(weights_sq[indices])
+        else:
+            f_weighted = f_ns * weights_sq[indices]
+        if sp.issparse(g_ns):
+            g_weighted = sp.diags(weights_sq[indices]) @ g_ns
+        else:
+            g_weighted = g_ns * weights_sq[indices, None]
+
+        TT_AA.append(kron(np.outer(a_m, a_m), f_weighted @ f_ns.T))
+        TT_AB.append(-kron(a_m[:, None], f_weighted @ g_ns) / 2)
+        TT_BB.append(g_weighted.T @ g_ns / 4)
+        Tb_A += np.kron(a_m, f_weighted @ b_ns)
+        Tb_B -= g_weighted.T @ b_ns / 2
+
+    TT_AA, TT_AB, TT_BB = sum(TT_AA), sum(TT_AB), sum(TT_BB)
+    if sparse:
+        TT = sp.bmat([[TT_AA, TT_AB], [TT_AB.T, TT_BB]], format='csc')
+    else:
+        TT = np.block([[TT_AA, TT_AB], [TT_AB.T, TT_BB]])
+    return TT, np.r_[Tb_A, Tb_B]
+
+
+def _get_basis_products_matrix(basis):
+    """ Return the matrix with rows :math:`vect(f_n f_n^T)`, of shape n_positions x K^2.
+
+    If basis is sparse, so is the returned matrix, and only the products of non-zero elements are computed.
+    """
+    K, N = basis.shape
+    if not sp.issparse(basis):
+        return np.einsum('in,jn->nij', basis, basis).reshape((N, -1))
+
+    basis_rows = sp.csr_matrix(basis.T)
+    counts = np.diff(basis_rows.indptr)
+    width = np.max(counts) if N else 0
+    if width == 0:
+        return sp.csr_matrix((N, K * K))
+
+    # pad the non-zero elements of each position to the same number, with zero values.
+    positions = np.arange(width)[None, :]
+    valid = positions < counts[:, None]
+    flat_indices = np.minimum(basis_rows.indptr[:-1, None] + positions, basis_rows.nnz - 1)
+    indices = np.where(valid, basis_rows.indices[flat_indices], 0)
+    values = np.where(valid, basis_rows.data[flat_indices], 0.0)
+
+    rows = np.repeat(np.arange(N), width * width)
+    columns = (indices[:, :, None] * K + indices[:, None, :]).reshape(-1)
+    products = (values[:, :, None] * values[:, None, :]).reshape(-1)
+    return sp.csr_matrix((products, (rows, columns)), shape=(N, K * K))
+
+
+def _get_basis_products(model, i, j):
+    """ Express the product of basis functions i and j as combination of the extended basis.
+
+    The extended basis is the basis of the same model with complexity 2K-1, which spans all products of two basis
+    functions of complexity K.
+
+    :return: list of tuples (index of extended basis function, factor).
+    """
+    if model == 'polynomial':
+        return [(i + j, 1.0)]
+    elif model == 'bandlimited':
+        # basis is 1, 2cos(k x), and 2cos(a x) 2cos(b x) = 2cos((a+b) x) + 2cos((a-b) x).
+        if i == 0 or j == 0:
+            return [(i + j, 1.0)]
+        elif i == j:
+            return [(i + j, 1.0), (0, 2.0)]
+        return [(i + j, 1.0), (abs(i - j), 1.0)]
+    elif model == 'full_bandlimited':
+        # basis is 1, 2sin(x), 2cos(x), 2sin(2x), 2cos(2x), ...
+        if i == 0 or j == 0:
+            return [(i + j, 1.0)]
+
+        def index(kind, k):
+            """ Return index and factor of 2sin(k x) or 2cos(k x) in the extended basis. """
+            if k == 0:
+                return (0, 2.0) if kind == 'cos' else (0, 0.0)
+            elif kind == 'cos':
+                return 2 * abs(k), 1.0
+            return 2 * abs(k) - 1, np.sign(k)
+
+        a, kind_a = (i + 1) // 2, 'sin' if i % 2 else 'cos'
+        b, kind_b = (j + 1) // 2, 'sin' if j % 2 else 'cos'
+        if kind_a == 'cos' and kind_b == 'cos':
+            terms = [('cos', a + b, 1.0), ('cos', a - b, 1.0)]
+        elif kind_a == 'sin' and kind_b == 'sin':
+            terms = [('cos', a - b, 1.0), ('cos', a + b, -1.0)]
+        elif kind_a == 'sin' and kind_b == 'cos':
+            terms = [('sin', a + b, 1.0), ('sin', a - b, 1.0)]
+        else:
+            terms = [('sin', a + b, 1.0), ('sin', b - a, 1.0)]
+        products = []
+        for kind, k, factor in terms:
+            idx, sign = index(kind, k)
+            products.append((idx, factor * sign))
+        return products
+    else:
+        raise ValueError(model)
+
+
+@lru_cache(maxsize=None)
+def get_reduction_matrix(model, n_complexity):
+    """ Return matrix reducing T_B to its rank, without SVD.
+
+    Each row of T_B is :math:`vect(f_n f_n^T)`, and the products of basis functions are spanned by the extended
+    basis :math:`g_n` of the same model with complexity 2K-1 (harmonics up to 2K-2 for bandlimited models,
+    monomials up to degree 2K-2 for polynomials). Therefore :math:`vect(f_n f_n^T) = R^T g_n`, and the returned
+    matrix :math:`R^+` satisfies :math:`T_B R^+ = G`, where the rows of G are the :math:`g_n`.
+
+    The matrix only depends on the model and complexity, so it is computed once and cached.
+
+    For the bspline model, see :func:`._get_bspline_reduction_matrix`.
+
+    :param model: trajectory model, see :class:`trajectory.Trajectory`.
+    :param n_complexity: complexity K of the trajectory.
+
+    :return: read-only reduction matrix of shape K^2 x (2K-1), or sparse reduction matrix of shape K^2 x r for the
+             bspline model.
+    """
+    if model == 'bspline':
+        return _get_bspline_reduction_matrix(n_complexity)
+
+    K = n_complexity
+    R = np.zeros((2 * K - 1, K * K))
+    for i in range(K):
+        for j in range(K):
+            for idx, factor in _get_basis_products(model, i, j):
+                R[idx, i * K + j] += factor
+    reduction = np.linalg.pinv(R)
+    reduction.setflags(write=False)
+    return reduction
+
+
+def _get_bspline_reduction_matrix(n_complexity, degree=BSPLINE_DEGREE):
+    """ Return the reduction matrix of T_B for the bspline model.
+
+    The products of B-splines of degree p span the splines of degree 2p with knots of multiplicity p+1, of
+    dimension r = (p+1)K - p^2. Only the (p+1)K - p(p+1)/2 products of overlapping basis functions are non-zero, so
+    p(p-1)/2 of them are linearly dependent on the others. We leave out products :math:`B_i B_{i+p}` at evenly spread
+    positions i, which gives a better conditioned system than leaving out neighbouring products. For K < 2p, we
+    leave out the products :math:`B_i B_j` with :math:`j - i \geq 2` of the first interval instead.
+
+    The reduction then simply selects the corresponding columns of T_B, which keeps it sparse. :math:`T_B R^+` spans
+    the same space as the reduced matrix of the other models.
+
+    :return: sparse selection matrix of shape K^2 x r.
+    """
+    K = n_complexity
+    assert K > degree, f'bspline model requires more than {degree} coefficients'
+    n_dependent = degree * (degree - 1) // 2
+    if K - degree >= n_dependent:
+        positions = [int((k + 0.5) * (K - degree) / n_dependent) for k in range(n_dependent)]
+        left_out = [(i, i + degree) for i in positions]
+    else:
+        left_out = [(i, j) for i in range(degree + 1) for j in range(i + 2, degree + 1)]
+
+    selected = [(i, j) for i in range(K) for j in range(i, min(i + degree + 1, K)) if (i, j) not in left_out]
+    selected = np.array(selected)
+    r = len(selected)
+    assert r == (degree + 1) * K - degree**2
+    return sp.csc_matrix((np.ones(r), (selected[:, 0] * K + selected[:, 1], np.arange(r))), shape=(K * K, r))
@@ -5,45 +5,150 @@ coordinate_fitting.py: Fit the parametric trajectory to given number of coordina
 """
 
 import numpy as np
-import matplotlib.pylab as plt
-from scipy.optimize import minimize
+from scipy.fft import dct
+from scipy.linalg import solve_triangular
+import scipy.sparse as sp
+from scipy.sparse.linalg import spsolve
+from profiling import profiled
 from trajectory import Trajectory
 
+#: minimum complexity for which the DCT is faster than creating the basis in fit_trajectory.
+DCT_MIN_COMPLEXITY = 10
+
+#: maximum number of times a step is halved in solve_for_times.
+MAX_HALVINGS = 10
+
+EPS = 1e-10
+
 
 def solve_for_coeffs(R, F):
-    F_inv = np.linalg.inv(F.dot(F.T))
-    return R.dot(F.T).dot(F_inv)
+    """ Solve least squares problem R = C F for C.
+
+    The problem is solved with a factorization of F, which avoids squaring its condition number.
+    If F is sparse (bspline model), F F^T is banded and solved as sparse system.
+    """
+    if sp.issparse(F):
+        F = sp.csc_matrix(F)
+        return np.atleast_2d(spsolve(F.dot(F.T).tocsc(), F.dot(R.T))).reshape((-1, R.shape[0])).T
+    return np.linalg.lstsq(F.T, R.T, rcond=None)[0].T
+
+
+def get_dct_frequencies(times, trajectory):
+    """ Return the DCT-I frequencies of the basis functions, if the basis evaluated at times is a DCT.
+
+    This is the case for the bandlimited model with uniform times :math:`t_n = t_0 + n \Delta`, where :math:`t_0` is
+    a multiple of the period and :math:`q = 2 \Delta (N-1) / T` is an integer: basis function k is then
+    :math:`2\cos(\pi q k n / (N-1))`.
+
+    :return: array of frequencies m_k (between 0 and N-1) such that basis function k is
+             :math:`c_k \cos(\pi m_k n / (N-1))`, or None if the basis is not a DCT.
+    """
+    if trajectory.model != 'bandlimited' or len(times) < 2:
+        return None
+
+    times = np.asarray(times, dtype=float)
+    N = len(times)
+    step = (times[-1] - times[0]) / (N - 1)
+    if step <= 0 or not np.allclose(np.diff(times), step, rtol=0, atol=1e-6 * step):
+        return None
+
+    q = 2 * step * (N - 1) / trajectory.period
+    offset = times[0] / trajectory.period
+    if abs(q - round(q)) > 1e-8 or abs(offset - round(offset)) > 1e-8:
+        return None
+
+    frequencies = (round(q) * np.arange(trajectory.n_complexity)) % (2 * (N - 1))
+    return np.where(frequencies > N - 1, 2 * (N - 1) - frequencies, frequencies)
+
+
+def solve_for_coeffs_dct(R, frequencies):
+    """ Solve least squares problem R = C F for C, when the rows of F are cosines of the given frequencies.
+
+    This gives the same result as :func:`.solve_for_coeffs`, but :math:`R F^T` is computed with a DCT in
+    :math:`O(N \log N)` and :math:`F F^T` in closed form, so F is never created.
+
+    :param R: coordinates (dim x N)
+    :param frequencies: output of :func:`.get_dct_frequencies`.
+
+    :return: coefficients (dim x K)
+    """
+    N = R.shape[1]
+    m = np.asarray(frequencies)
+    signs = np.where(m % 2 == 0, 1.0, -1.0)
+    factors = np.where(m == 0, 1.0, 2.0)
+
+    # the DCT-I counts the inner samples twice: y_m = R_0 + (-1)^m R_{N-1} + 2 sum_{0<n<N-1} R_n cos(pi m n/(N-1)).
+    y = dct(R, type=1, axis=1)
+    RF = factors * (y[:, m] + R[:, [0]] + signs * R[:, [-1]]) / 2
+
+    def cosine_sum(m):
+        """ Sum of cos(pi m n / (N-1)) over n = 0, ..., N-1, for integer m. """
+        return (N - 1) * (m % (2 * (N - 1)) == 0) + (1 + np.where(m % 2 == 0, 1.0, -1.0)) / 2
+
+    FF = factors[:, None] * factors[None, :] * (cosine_sum(m[:, None] + m[None, :]) +
+                                                cosine_sum(m[:, None] - m[None, :])) / 2
+    return np.linalg.solve(FF, RF.T).T
+
+
+def solve_for_times(times, R, C, trajectory, max_iter=20, tol=1e-10):
+    """ Find for each point the time that minimizes its distance to the trajectory.
+
+    The loss :math:`\sum_n \|r_n - C f(t_n)\|^2` separates over the points, so all times are updated simultaneously
+    with 1-D Gauss-Newton steps using the basis derivatives. Steps that do not decrease the loss of a point are
+    halved, so that the loss of each point never increases.
 
+    :param times: initial times (length N)
+    :param R: coordinates (dim x N)
+    :param C: trajectory coefficients (dim x K)
+    :param trajectory: Trajectory instance, of the model to be fitted.
+    :param max_iter: maximum number of Gauss-Newton iterations.
+    :param tol: stop when all time updates are smaller than this.
 
-def solve_for_times(times, R, C, trajectory):
-    def loss(times, R, C):
-        F = trajectory.get_basis(times=times)
-        return np.linalg.norm(R - C.dot(F))**2
+    :return: new times (length N)
+    """
+    times = np.array(times, dtype=float)
+    errors = C.dot(trajectory.get_basis(times=times)) - R
+    losses = np.sum(errors**2, axis=0)
+
+    for i in range(max_iter):
+        velocities = C.dot(trajectory.get_basis_prime(times=times))
+        speeds_squared = np.sum(velocities**2, axis=0)
+        steps = -np.sum(errors * velocities, axis=0) / np.maximum(speeds_squared, EPS)
+
+        indices = np.where(np.abs(steps) > tol)[0]
+        if not len(indices):
+            break
 
-    def grad_loss(times, R, C):
-        F = trajectory.get_basis(times=times)
-        F_prime = trajectory.get_basis_prime(times)
+        for j in range(MAX_HALVINGS):
+            new_times = times[indices] + steps[indices]
+            new_errors = C.dot(trajectory.get_basis(times=new_times)) - R[:, indices]
+            new_losses = np.sum(new_errors**2, axis=0)
 
-        grad_L_F = C.T.dot(R - C.dot(F))
-        grad = np.diag(grad_L_F.T.dot(F_prime))
-        return grad
+            better = new_losses <= losses[indices]
+            accepted = indices[better]
+            times[accepted] = new_times[better]
+            errors[:, accepted] = new_errors[:, better]
+            losses[accepted] = new_losses[better]
 
-    # Nelder-Mead seems to work better than BFGS, BFGS often gives a warning.
-    res = minimize(loss, x0=times, args=(R, C), method='Nelder-Mead', options=dict(maxiter=200))
-    #options=dict(xatol=1e-10, fatol=1e-10, maxiter=200))
-    #res = minimize(loss, x0=times, args=(coordinates, coeffs), jac=grad_loss, method='BFGS')
-    if not res.success:
-        print('Warning: optimization did not succeed. Message of scipy.optimize.minimize:', res.message)
-    return res.x
+            indices = indices[~better]
+            if not len(indices):
+                break
+            steps[indices] /= 2
+    return times
 
 
-def fit_trajectory_and_times(coordinates, trajectory, max_iter=100, times=None):
+def fit_trajectory_and_times(coordinates, trajectory, max_iter=100, times=None, tol=1e-10):
     """ Fit a trajectory to positions (times and coefficients).
 
-    :param coordinates: matrix of coordinates to fit trajectory to. Nxdim
+    Alternates between fitting the coefficients for fixed times and the times for fixed coefficients.
+
+    :param coordinates: matrix of coordinates to fit trajectory to. dimxN
     :param trajectory: Trajectory object.
     :param max_iter: max iterations.
+    :param times: initial times. If not given, the default times of the trajectory are used.
+    :param tol: stop when all times change by less than this.
 
+    :return: coefficients (dim x K) and times (length N)
     """
     N = coordinates.shape[1]
     if times is None:
@@ -59,10 +164,15 @@ def fit_trajectory_and_times(coordinates, trajectory, max_iter=100, times=None):
         assert coeffs.shape[0] == d
         assert coeffs.shape[1] == K
 
-        times = solve_for_times(times, coordinates, coeffs, trajectory)
+        new_times = solve_for_times(times, coordinates, coeffs, trajectory)
+        converged = np.max(np.abs(new_times - times)) < tol
+        times = new_times
+        if converged:
+            break
     return coeffs, times
 
 
+@profiled('fitting')
 def fit_trajectory(coordinates, times, traj):
     """ Fit trajectory to positions (coefficients only). 
     
@@ -72,9 +182,93 @@ def fit_trajectory(coordinates, times, traj):
 
     :return: fitted trajectory coefficients (dim x K)
     """
-    basis = traj.get_basis(times=times)
+    assert coordinates.shape[0] == traj.dim, coordinates.shape
+    assert len(times) == coordinates.shape[1], f'{len(times), coordinates.shape}'
+
+    # fast path for uniformly sampled bandlimited trajectories.
+    frequencies = get_dct_frequencies(times, traj) if traj.n_complexity >= DCT_MIN_COMPLEXITY else None
+    if frequencies is not None:
+        coeffs_hat = solve_for_coeffs_dct(coordinates, frequencies)
+        return np.array(coeffs_hat, dtype=np.float32)
+
+    basis = traj.get_basis(times=times, sparse=(traj.model == 'bspline'))
     assert coordinates.shape[0] == traj.dim, coordinates.shape
     assert basis.shape[0] == traj.n_complexity
     assert basis.shape[1] == coordinates.shape[1], f'{basis.shape, coordinates.shape}'
     coeffs_hat = solve_for_coeffs(coordinates, basis)
     return np.array(coeffs_hat, dtype=np.float32)
+
+
+@profiled('fitting')
+def fit_trajectory_orders(coordinates, times, traj, max_complexity=None):
+    """ Fit trajectories of all complexities up to max_complexity to positions.
+
+    The basis functions of the polynomial and bandlimited models are nested: the basis of complexity K is made of the
+    first K basis functions of any larger complexity (for the full_bandlimited model, only odd K are valid). One QR
+    decomposition of the largest basis therefore contains the fits of all complexities: the first K columns of Q span
+    the basis of complexity K, and each new column reduces the residuals by one projection. All fits cost about as
+    much as the largest one.
+
+    :param coordinates: position coordinates (dim x N)
+    :param times: list of corresponding times
+    :param traj: Trajectory instance, of the model to be fitted (polynomial, bandlimited or full_bandlimited).
+    :param max_complexity: largest complexity to fit, traj.n_complexity by default. At most N.
+
+    :return: dictionary with the following lists, one element per fitted complexity:
+        - complexities: fitted complexities K.
+        - coeffs: fitted trajectory coefficients (dim x K).
+        - rss: residual sum of squares.
+        - loocv: leave-one-out cross-validation error (mean squared distance of each position to its prediction
+          from all other positions).
+        - aic, bic: Akaike and Bayesian information criteria, assuming i.i.d. gaussian noise.
+    """
+    if traj.model not in ['polynomial', 'bandlimited', 'full_bandlimited']:
+        raise ValueError('the basis of model {} is not nested in the complexity.'.format(traj.model))
+    max_complexity = traj.n_complexity if max_complexity is None else max_complexity
+    dim, n_positions = coordinates.shape
+    assert dim == traj.dim, coordinates.shape
+    assert len(times) == n_positions, f'{len(times), coordinates.shape}'
+    assert max_complexity <= n_positions, 'need at least as many positions as the complexity.'
+
+    traj_max = traj.copy()
+    traj_max.set_n_complexity(max_complexity)
+    basis = traj_max.get_basis(times=times)
+
+    Q, R = np.linalg.qr(basis.T)
+    projections = Q.T @ coordinates.T
+    residuals = np.array(coordinates.T, dtype=float)
+    leverages = np.zeros(n_positions)
+
+    n_observations = dim * n_positions
+    fits = {'complexities': [], 'coeffs': [], 'rss': [], 'loocv': [], 'aic': [], 'bic': []}
+    for k in range(max_complexity):
+        residuals -= np.outer(Q[:, k], projections[k])
+        leverages += Q[:, k]**2
+        K = k + 1
+        if traj.model == 'full_bandlimited' and K % 2 == 0:
+            continue
+
+        coeffs = solve_triangular(R[:K, :K], projections[:K]).T
+        rss = np.sum(residuals**2)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            loo_residuals = residuals / (1 - leverages[:, None])
+            log_likelihood = n_observations * np.log(rss / n_observations)
+        fits['complexities'].append(K)
+        fits['coeffs'].append(np.array(coeffs, dtype=np.float32))
+        fits['rss'].append(rss)
+        fits['loocv'].append(np.sum(loo_residuals**2) / n_positions)
+        fits['aic'].append(log_likelihood + 2 * dim * K)
+        fits['bic'].append(log_likelihood + np.log(n_observations) * dim * K)
+    return fits
+
+
+def choose_complexity(fits, criterion='bic'):
+    """ Choose the complexity minimizing the given criterion.
+
+    :param fits: output of :func:`fit_trajectory_orders`.
+    :param criterion: criterion to minimize: 'aic', 'bic' or 'loocv'.
+
+    :return: chosen complexity and corresponding coefficients.
+    """
+    index = int(np.nanargmin(fits[criterion]))
+    return fits['complexities'][index], fits['coeffs'][index]
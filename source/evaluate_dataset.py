@@ -11,7 +11,6 @@ import datetime
 import numpy as np
 import pandas as pd
 import matplotlib.pylab as plt
-import scipy as sp
 
 # These system_ids are used by the python measurement pipeline,
 # but will be changed to better-readable "GT" and "Range", respectively.
@@ -131,37 +130,137 @@ def match_reference(reference, points):
     """ Rotate and shift points to mach reference positions as closely as possible.
     Note that the order of points matters, not only their position.
 
+    The inputs are not modified. See :func:`match_reference_batch` for many point sets and for scaling.
+
     :param reference: 2D array of size (dimension, number of points), that does not change
     :param points: 2D array of points to rotate, the same size as reference
     :return:
-        a pair (rotated points, (rotation matrix, rotation center, reference center of mass)))
+        a pair (rotated points, (rotation matrix, rotation center, reference center of mass))), such that
+        rotated points = rotation matrix @ (points - rotation center) + reference center of mass.
     """
     assert reference.shape == points.shape
-    reference_center = np.mean(reference, axis=1)
-    reference -= reference_center[:, None]
-    rotation_center = np.mean(points, axis=1)
-    points -= rotation_center[:, None]
-    rotation, e = sp.linalg.orthogonal_procrustes(points.T, reference.T)
-    points = rotation @ points
-    points += reference_center[:, None]
-    return points, (rotation, rotation_center, reference_center)
+    aligned, (rotations, _, rotation_centers, reference_centers) = match_reference_batch(reference[None], points[None])
+    return aligned[0], (rotations[0], rotation_centers[0], reference_centers[0])
+
+
+def match_reference_batch(references, points, scale=False, reflection=True):
+    """ Rotate, shift (and optionally scale) each point set to match its reference as closely as possible.
+
+    All point sets are aligned at once, with stacked SVDs (orthogonal Procrustes problem). The inputs are not
+    modified.
+
+    :param references: 3D array of size (batch size, dimension, number of points).
+    :param points: 3D array of points to align, the same size as references.
+    :param scale: if True, also find the optimal scaling of each point set.
+    :param reflection: if False, only proper rotations (determinant 1) are allowed.
+
+    :return:
+        a pair (aligned points, (rotations, scales, rotation centers, reference centers)), of sizes (B, D, N),
+        ((B, D, D), (B, ), (B, D), (B, D)), such that aligned points[b] = scales[b] * rotations[b] @ (points[b] -
+        rotation centers[b][:, None]) + reference centers[b][:, None].
+    """
+    references = np.asarray(references, dtype=np.float64)
+    points = np.asarray(points, dtype=np.float64)
+    assert references.shape == points.shape
+    assert references.ndim == 3
+
+    reference_centers = np.mean(references, axis=2)
+    rotation_centers = np.mean(points, axis=2)
+    references_centered = references - reference_centers[:, :, None]
+    points_centered = points - rotation_centers[:, :, None]
+
+    # the rotation minimizing |R @ points - references| is V @ U^T, where U S V^T = points @ references^T.
+    U, S, Vh = np.linalg.svd(points_centered @ references_centered.transpose((0, 2, 1)))
+    V = Vh.transpose((0, 2, 1))
+    signs = np.ones(S.shape)
+    if not reflection:
+        signs[:, -1] = np.where(np.linalg.det(V @ U.transpose((0, 2, 1))) < 0, -1.0, 1.0)
+    rotations = (V * signs[:, None, :]) @ U.transpose((0, 2, 1))
+
+    scales = np.ones(len(points))
+    if scale:
+        norms = np.sum(points_centered**2, axis=(1, 2))
+        scales = np.sum(S * signs, axis=1) / np.where(norms > 0, norms, 1.0)
+
+    aligned = scales[:, None, None] * (rotations @ points_centered) + reference_centers[:, :, None]
+    return aligned, (rotations, scales, rotation_centers, reference_centers)
 
 
 #### Dataset processing.
 
 
-def calibrate(original_df, gt_anchor_id='GT'):
-    """ Calibrate for offset and slope. """
-    assert 'distance_gt' in original_df.columns
-    assert 'distance' in original_df.columns
-    for anchor_id, anchor_df in original_df.groupby('anchor_id'):
-        if anchor_id == gt_anchor_id:
-            continue
-        d_gt = anchor_df.distance_gt.values.astype(np.float32)
-        d = anchor_df.distance.values.astype(np.float32)
-        slope, offset = np.polyfit(x=d[~np.isnan(d)], y=d_gt[~np.isnan(d)], deg=1)
-        original_df.loc[original_df.anchor_id == anchor_id, 'distance_calib'] = d * slope + offset
+def get_calibration(data_df, gt_anchor_id='GT', filename=None):
+    """ Fit slope and offset of the distances of each anchor, such that distance_gt = slope * distance + offset.
+
+    The least-squares fits of all anchors are computed at once, from the grouped means and (co)variances.
+
+    :param data_df: dataset with columns anchor_id, distance and distance_gt.
+    :param gt_anchor_id: anchor_id of the ground truth measurements, which are ignored.
+    :param filename: if given, the calibration table is saved to this file (as pickle).
+
+    :return: calibration table, with anchor ids as index and columns slope, offset and n_samples.
+    """
+    assert 'distance_gt' in data_df.columns
+    assert 'distance' in data_df.columns
+    valid = (data_df.anchor_id != gt_anchor_id).values
+    valid &= ~np.isnan(data_df.distance.values.astype(np.float64))
+    valid &= ~np.isnan(data_df.distance_gt.values.astype(np.float64))
+
+    fit_df = pd.DataFrame({
+        'anchor_id': data_df.anchor_id.values[valid],
+        'd': data_df.distance.values[valid].astype(np.float64),
+        'd_gt': data_df.distance_gt.values[valid].astype(np.float64),
+    })
+    groups = fit_df.groupby('anchor_id', sort=True)
+    means = groups[['d', 'd_gt']].transform('mean')
+    fit_df['cov'] = (fit_df.d - means.d) * (fit_df.d_gt - means.d_gt)
+    fit_df['var'] = (fit_df.d - means.d)**2
+    sums = fit_df.groupby('anchor_id', sort=True).agg(n_samples=('d', 'size'),
+                                                      d=('d', 'mean'),
+                                                      d_gt=('d_gt', 'mean'),
+                                                      cov=('cov', 'sum'),
+                                                      var=('var', 'sum'))
+
+    calibration = pd.DataFrame(index=sums.index)
+    calibration['slope'] = sums['cov'] / sums['var']
+    calibration['offset'] = sums.d_gt - calibration.slope * sums.d
+    calibration['n_samples'] = sums.n_samples
+    if filename is not None:
+        calibration.to_pickle(filename)
+    return calibration
+
+
+def apply_calibration(data_df, calibration, label='distance_calib'):
+    """ Add the calibrated distances to data_df, for anchors in the calibration table (nan for others).
+
+    :param data_df: dataset with columns anchor_id and distance.
+    :param calibration: calibration table, see :func:`get_calibration`.
+    :param label: name of the new column.
+    """
+    # look up the row of each measurement in the calibration table, -1 for unknown anchors.
+    codes = pd.Categorical(data_df.anchor_id.values, categories=calibration.index).codes
+    known = codes >= 0
+    slopes = np.where(known, calibration.slope.values[codes], np.nan)
+    offsets = np.where(known, calibration.offset.values[codes], np.nan)
+    data_df.loc[:, label] = data_df.distance.values.astype(np.float64) * slopes + offsets
+
+
+def calibrate(original_df, gt_anchor_id='GT', calibration=None):
+    """ Calibrate for offset and slope.
+
+    :param original_df: dataset, to which the column distance_calib is added.
+    :param calibration: calibration table or name of the file it was saved to. If None, the calibration is fitted
+        on original_df. See :func:`get_calibration`.
+
+    :return: the calibration table.
+    """
+    if calibration is None:
+        calibration = get_calibration(original_df, gt_anchor_id)
+    elif isinstance(calibration, str):
+        calibration = pd.read_pickle(calibration)
+    apply_calibration(original_df, calibration)
     print('added distance_calib column.')
+    return calibration
 
 
 def compute_distance_matrix(data_df,
@@ -409,30 +508,23 @@ def apply_calibrate(row, calib_dict, calib_type):
 
 
 def get_length(pos_df, plot=False):
-    def diff(rolling):
-        if len(rolling) > 1:
-            return rolling[1] - rolling[0]
-        else:
-            return 0.0
+    """ Compute the length travelled between successive position estimates.
 
-    # To turn off annoying pandas warning. I did not figure out where it came from.
-    pd.options.mode.chained_assignment = None
+    :param pos_df: dataset with position estimates (columns px, py and timestamp).
 
-    # create new index so that we can use rolling function.
-    new_index = [datetime.datetime.fromtimestamp(t) for t in pos_df.timestamp]
-    pos_df.index = new_index
-    v_x = pos_df.px.rolling(min_periods=1, window=2, center=False).apply(func=diff, raw=True)
-    v_y = pos_df.py.rolling(min_periods=1, window=2, center=False).apply(func=diff, raw=True)
-    d_t = pos_df.timestamp.rolling(min_periods=1, window=2, center=False).apply(func=diff, raw=True)
-    pos_df.reset_index(inplace=True, drop=True)
-
-    v = np.vstack((v_x.values.astype(np.float32), v_y.values.astype(np.float32))).T
+    :return: array of travelled lengths, the first one is zero.
+    """
+    # prepending the first value gives a zero first difference (or nan if the first value is nan).
+    v_x = np.diff(pos_df.px.values.astype(np.float64), prepend=pos_df.px.values[:1])
+    v_y = np.diff(pos_df.py.values.astype(np.float64), prepend=pos_df.py.values[:1])
+    v = np.vstack((v_x.astype(np.float32), v_y.astype(np.float32))).T
     lengths = np.linalg.norm(v, axis=1)
 
     if plot:
         # Below is numerically bad, velocities are extremely noisy...
         # That's why we are not using velocities but lengths.
-        d_times = d_t.values.astype(np.float32).reshape((-1, ))
+        d_times = np.diff(pos_df.timestamp.values.astype(np.float64),
+                          prepend=pos_df.timestamp.values[:1]).astype(np.float32)
         velocities = lengths / d_times
         median = np.median(velocities[d_times >= np.median(d_times)])
         velocities[d_times < np.median(d_times)] = median
@@ -445,6 +537,33 @@ def get_length(pos_df, plot=False):
     return lengths
 
 
+def get_edge_response(values, pattern):
+    """ Compute the inner product of the pattern with the window of values ending at each index.
+
+    For the first len(pattern) - 1 indices, where the window is not full, only the overlapping parts of the window
+    and of the reduced pattern pattern[:-len(window)] are used.
+
+    :param values: array of length N.
+    :param pattern: list of length L.
+
+    :return: array of length N with the filter output.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    pattern = np.asarray(pattern, dtype=np.float64)
+    L = len(pattern)
+    response = np.empty(len(values))
+
+    # full windows: values[i-L+1:i+1] @ pattern.
+    if len(values) >= L:
+        response[L - 1:] = np.correlate(values, pattern, mode='valid')
+
+    # incomplete windows at the beginning.
+    for i in range(min(L - 1, len(values))):
+        n_overlap = min(L - (i + 1), i + 1)
+        response[i] = np.sum(values[:n_overlap] * pattern[:n_overlap])
+    return response
+
+
 def find_start_times(tango_df, thresh_filter=-0.5, pattern=[1, 1, 1, 1, -1, -1], plot=False):
     """ Find the times at which the trajectory started. Can be multiple in one dataset.
 
@@ -460,43 +579,38 @@ def find_start_times(tango_df, thresh_filter=-0.5, pattern=[1, 1, 1, 1, -1, -1],
         - start_indices:  indices at which movement starts.
 
     """
-    def find_edge(window, pattern):
-        """ Calculate the inner product of the pattern with the given window. """
-        if len(window) < len(pattern):
-            pattern = pattern[:-len(window)]
-        sum_ = np.sum([a * b for (a, b) in zip(pattern, window)])
-        return sum_
-
     if "length" not in tango_df.columns:
         tango_df.loc[:, "length"] = get_length(tango_df)
 
-    # compute the rolling inner product between pattern and the length in tango_df.
-    tango_df.index = [datetime.datetime.fromtimestamp(t) for t in tango_df.timestamp]
-    normalized_series = tango_df.loc[:, "length"] / tango_df.length.max()
-    df = normalized_series.rolling(window=len(pattern), center=False, min_periods=1).apply(find_edge,
-                                                                                           raw=True,
-                                                                                           kwargs={'pattern': pattern})
-    tango_df.reset_index(inplace=True, drop=True)
+    # compute the inner product between pattern and the (normalized) length in tango_df.
+    normalized = tango_df.length.values / tango_df.length.max()
+    response = get_edge_response(normalized, pattern)
 
     if plot:
         plt.figure()
-        plt.plot(df.values, label='filter output')
-        plt.plot([thresh_filter] * len(df), label='thresh_filterold')
+        plt.plot(response, label='filter output')
+        plt.plot([thresh_filter] * len(response), label='thresh_filterold')
 
     # find start indices
-    all_indices = np.where(df.values < thresh_filter)[0]
-    all_times = [tango_df.timestamp[i] for i in all_indices]
+    all_indices = np.where(response < thresh_filter)[0]
+    all_times = tango_df.timestamp.values[all_indices]
 
     # there were no calibration periods in this dataset.
     if len(all_indices) == 0:
         return [], []
 
-    start_times = [all_times[0]]
-    start_indices = [all_indices[0]]
-    for s, i in zip(all_times, all_indices):
-        if s > start_times[-1] + 10:  # assume that start indices cannot be closer than 10 seconds.
-            start_times.append(s)
-            start_indices.append(i)
+    # assume that start indices cannot be closer than 10 seconds: jump to the first candidate after the previous
+    # start plus 10 seconds.
+    start_times = []
+    start_indices = []
+    k = 0
+    while k < len(all_indices):
+        start_times.append(all_times[k])
+        start_indices.append(all_indices[k])
+        later = all_times[k + 1:] > all_times[k] + 10
+        if not np.any(later):
+            break
+        k += 1 + np.argmax(later)
     return start_times, start_indices
 
 
@@ -521,18 +635,25 @@ def find_calibration_data(tango_df, start_move_times, start_move_indices, max_le
     """
     calibration_data = {'calibration': [], 'trajectory': []}
 
+    # index of the last movement (length above max_length) up to each index, -1 if there was none.
+    moving = tango_df.length.values > max_length
+    last_moving = np.maximum.accumulate(np.where(moving, np.arange(len(moving)), -1))
+    timestamps = tango_df.timestamp.values
+
     # Find calibration data
-    # valid indices are close-to-zero length indices before the start times.
+    # valid indices are close-to-zero length indices before the start times, at least 3 samples before the start
+    # and at most until index 1.
+    num_min = 3  # min number of calibration samples
     for start_move_time, start_move_index in zip(start_move_times, start_move_indices):
-        num_min = 3  # min number of calibration samples
-        num_max = start_move_index  # max number of calibration samples.
-        num_indices = 0
-        for num_indices in range(num_min, num_max):
-            if tango_df.iloc[start_move_index - num_indices].length > max_length:
-                break
+        if start_move_index <= num_min:
+            num_indices = 0
+        elif last_moving[start_move_index - num_min] >= 1:
+            num_indices = start_move_index - last_moving[start_move_index - num_min]
+        else:
+            num_indices = start_move_index - 1
 
         start_calib_index = start_move_index - num_indices
-        start_calib_time = tango_df.iloc[start_calib_index].timestamp
+        start_calib_time = timestamps[start_calib_index]
 
         # make previous trajectory and at the next calibration start.
         if len(calibration_data['trajectory']) > 0:
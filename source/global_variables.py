@@ -9,6 +9,7 @@ TAU = 2.0  #: for bandlimited trajectories: default period in seconds.
 MM = 1e-3  #: millimeters
 ROBOT_WIDTH = 245.08 * MM  #: current estimate of the robot width
 EPSILON = 1e-10  #: a small number used to avoid division by zero whenever needed
+BSPLINE_DEGREE = 3  #: degree of the piecewise polynomials of bspline trajectories.
 ROBOT_HEIGHT = 0.25  #: robot height in meters.
 
 TANGO_SYSTEM_ID = 7585
@@ -3,12 +3,101 @@
 measurements.py: Functions to generate measurements from setup. 
 """
 
+from functools import lru_cache
 import math
 import numpy as np
+from scipy.special import gammaln
 
 EPS = 1e-10
 
 
+class Measurements(object):
+    """ Compact representation of the observed squared distances.
+
+    Instead of the dense matrix D_topright (n_positions x n_anchors) with zeros for missing measurements, we only
+    store the observed measurements in parallel arrays, sorted by time index and then anchor index (the same order
+    as np.where(D_topright > 0)). Memory and scan costs therefore scale with the number of measurements.
+
+    All functions in constraints, solvers and other_algorithms accept either a dense matrix or a Measurements
+    instance.
+
+    :member time_indices: index of the position (column of the basis) of each measurement.
+    :member anchor_indices: index of the anchor of each measurement.
+    :member squared_distances: measured squared distances.
+    :member weights: optional weight of each measurement (None means all weights are one).
+    :member shape: shape (n_positions, n_anchors) of the equivalent dense matrix.
+    """
+    __slots__ = ['time_indices', 'anchor_indices', 'squared_distances', 'weights', 'shape']
+
+    def __init__(self, time_indices, anchor_indices, squared_distances, n_positions, n_anchors, weights=None):
+        """
+        The arrays are used as is (no copy) if they are already sorted by time and anchor index.
+
+        :param time_indices: index of the position of each measurement.
+        :param anchor_indices: index of the anchor of each measurement.
+        :param squared_distances: measured squared distances.
+        :param n_positions: total number of positions (times).
+        :param n_anchors: total number of anchors.
+        :param weights: optional weights of each measurement.
+        """
+        time_indices = np.asarray(time_indices, dtype=np.intp)
+        anchor_indices = np.asarray(anchor_indices, dtype=np.intp)
+        squared_distances = np.asarray(squared_distances, dtype=float)
+        assert len(time_indices) == len(anchor_indices) == len(squared_distances)
+        if weights is not None:
+            weights = np.asarray(weights, dtype=float)
+            assert len(weights) == len(time_indices)
+
+        keys = time_indices * n_anchors + anchor_indices
+        if np.any(keys[1:] < keys[:-1]):
+            order = np.argsort(keys, kind='stable')
+            time_indices = time_indices[order]
+            anchor_indices = anchor_indices[order]
+            squared_distances = squared_distances[order]
+            if weights is not None:
+                weights = weights[order]
+
+        self.time_indices = time_indices
+        self.anchor_indices = anchor_indices
+        self.squared_distances = squared_distances
+        self.weights = weights
+        self.shape = (n_positions, n_anchors)
+
+    @classmethod
+    def from_dense(cls, D_topright, weights=None):
+        """ Create from dense matrix of squared distances, where non-positive entries are missing.
+
+        :param D_topright: squared distances (n_positions x n_anchors).
+        :param weights: optional matrix of weights of the same shape.
+        """
+        time_indices, anchor_indices = np.where(D_topright > 0)
+        if weights is not None:
+            weights = weights[time_indices, anchor_indices]
+        return cls(time_indices, anchor_indices, D_topright[time_indices, anchor_indices], *D_topright.shape, weights)
+
+    def to_dense(self):
+        """ Return the dense matrix of squared distances (n_positions x n_anchors), zero for missing measurements. """
+        D_topright = np.zeros(self.shape)
+        D_topright[self.time_indices, self.anchor_indices] = self.squared_distances
+        return D_topright
+
+    def get_mask(self):
+        """ Return the dense mask (n_positions x n_anchors), one for observed measurements. """
+        mask = np.zeros(self.shape)
+        mask[self.time_indices, self.anchor_indices] = 1.0
+        return mask
+
+    def __len__(self):
+        return len(self.squared_distances)
+
+
+def as_measurements(D_topright):
+    """ Return D_topright as Measurements instance, converting it if it is a dense matrix. """
+    if isinstance(D_topright, Measurements):
+        return D_topright
+    return Measurements.from_dense(D_topright)
+
+
 def add_noise(D, noise_sigma, noise_to_square=False):
     """ Add noise to distances (not squared), leaving out zero distances. """
     D_noisy = np.copy(D)
@@ -45,15 +134,161 @@ def create_anchors(dim, n_anchors, check=False):
     return anchors
 
 
+#: number of random draws tried before sampling exactly with :func:`_get_count_table`.
+MAX_REJECTIONS = 20
+
+
+def _satisfies_condition(counts, bins, per_bin):
+    """ Limit condition of :func:`hypothesis.limit_condition` for the counts per anchor, in a form that does not
+    require sorting: sum_m min(p_m, per_bin) >= bins * per_bin. """
+    return np.sum(np.minimum(counts, per_bin)) >= bins * per_bin
+
+
+@lru_cache(maxsize=32)
+def _get_count_table(n_available, bins, per_bin, r_max, multinomial=False):
+    """ Count the configurations of measurement counts per anchor that satisfy the limit condition.
+
+    The counts are weighted by the (unnormalized) probability of anchor m having exactly p measurements:
+    binom(n_available[m], p) for uniform subsets of the candidates, or 1/p! for measurements assigned independently
+    and uniformly to the anchors (multinomial). The table is indexed by the number of remaining measurements, so one
+    table serves all numbers of measurements up to r_max. It is cached, so it is only computed once for each setup.
+
+    :param n_available: tuple of the number of candidates of each anchor.
+    :param bins: minimum number of bins that should be possible to fill (D+1).
+    :param per_bin: minimum number of measurements per bin (K).
+    :param r_max: maximum total number of measurements.
+    :param multinomial: if True, use the multinomial weights.
+
+    :return: log_weights, values, where log_weights[m, p] is the logarithm of the weight of anchor m having p
+    measurements, and values[m, r, c] is the log of the total weight of the choices for anchors m, ..., M-1 with r
+    measurements left and left-hand side c (clipped at bins * per_bin) so far.
+    """
+    n_anchors = len(n_available)
+    if multinomial:
+        ps = np.arange(r_max + 1)
+        log_weights = np.tile(-gammaln(ps + 1), (n_anchors, 1))
+    else:
+        ps = np.arange(min(max(n_available), r_max) + 1)
+        n = np.array(n_available)[:, None]
+        log_weights = gammaln(n + 1) - gammaln(ps[None, :] + 1) - gammaln(np.maximum(n - ps[None, :], 0) + 1)
+        log_weights[ps[None, :] > n] = -np.inf
+
+    target = bins * per_bin
+    states = np.arange(target + 1)
+    values = np.full((n_anchors + 1, r_max + 1, target + 1), -np.inf)
+    values[n_anchors, 0, target] = 0.0
+    max_remaining = 0
+    for m in range(n_anchors - 1, -1, -1):
+        # values[m + 1] is -inf for more remaining measurements than anchors m+1, ... can take.
+        n_next = max_remaining + 1
+        max_remaining = min(max_remaining + np.max(np.where(np.isinf(log_weights[m]), 0, ps)), r_max)
+        # all counts of at least per_bin lead to the same next state.
+        shifted_high = values[m + 1, :n_next][:, np.minimum(states + per_bin, target)]
+        for p in ps:
+            if np.isinf(log_weights[m, p]):
+                continue
+            if p < per_bin:
+                shifted = values[m + 1, :n_next][:, np.minimum(states + p, target)]
+            else:
+                shifted = shifted_high
+            n_rows = min(n_next, r_max + 1 - p)
+            values[m, p:p + n_rows] = np.logaddexp(values[m, p:p + n_rows], log_weights[m, p] + shifted[:n_rows])
+    values.setflags(write=False)
+    log_weights.setflags(write=False)
+    return log_weights, values
+
+
+def _sample_counts(n_available, n_measurements, bins, per_bin, multinomial=False):
+    """ Sample the number of measurements of each anchor, such that the limit condition is satisfied.
+
+    The counts are first drawn without the condition, up to :data:`MAX_REJECTIONS` times, and accepted if they
+    satisfy it. This is fast when most configurations are admissible. Otherwise, the counts are sampled exactly, anchor
+    by anchor, from the table of :func:`_get_count_table`. Both steps draw from the same (conditioned)
+    distribution.
+
+    :param n_available: number of candidates of each anchor. For multinomial, the maximum total number of
+    measurements, repeated for each anchor.
+    :param n_measurements: total number of measurements.
+    :param bins: minimum number of bins that should be possible to fill (D+1).
+    :param per_bin: minimum number of measurements per bin (K).
+    :param multinomial: see :func:`_get_count_table`.
+
+    :return: vector of counts of length n_anchors.
+    """
+    n_available = tuple(int(n) for n in n_available)
+    n_anchors = len(n_available)
+    labels = None if multinomial else np.repeat(np.arange(n_anchors), n_available)
+    if n_measurements <= (n_available[0] if multinomial else len(labels)):
+        for _ in range(MAX_REJECTIONS):
+            if multinomial:
+                counts = np.random.multinomial(n_measurements, np.full(n_anchors, 1.0 / n_anchors))
+            else:
+                chosen = np.random.choice(len(labels), n_measurements, replace=False)
+                counts = np.bincount(labels[chosen], minlength=n_anchors)
+            if _satisfies_condition(counts, bins, per_bin):
+                return counts
+
+    # the cost of the table grows quadratically with r_max, so it is only computed up to the next power of two. The
+    # tables are small in the cases where the rejection fails, close to the minimum number of measurements.
+    r_total = n_available[0] if multinomial else sum(n_available)
+    r_max = min(r_total, 2**int(np.ceil(np.log2(max(n_measurements, 1)))))
+    log_weights, values = _get_count_table(n_available, bins, per_bin, r_max, multinomial)
+    target = bins * per_bin
+    if n_measurements > r_max or np.isinf(values[0, n_measurements, 0]):
+        raise ValueError('no configuration of {} measurements satisfies the limit condition.'.format(n_measurements))
+
+    result = np.zeros(n_anchors, dtype=int)
+    remaining = n_measurements
+    state = 0
+    for m in range(n_anchors):
+        ps = np.arange(min(remaining, log_weights.shape[1] - 1) + 1)
+        next_states = np.minimum(state + np.minimum(ps, per_bin), target)
+        log_probs = log_weights[m, ps] + values[m + 1, remaining - ps, next_states] - values[m, remaining, state]
+        probs = np.exp(log_probs)
+        result[m] = np.random.choice(ps, p=probs / np.sum(probs))
+        remaining -= result[m]
+        state = next_states[result[m]]
+    return result
+
+
+def choose_suitable_measurements(anchor_indices, n_measurements, dim, n_complexity, n_anchors=None):
+    """ Choose measurements such that the limit condition (Theorem 1) is satisfied.
+
+    All subsets of n_measurements measurements satisfying the condition are equally likely.
+
+    :param anchor_indices: anchor index of each candidate measurement.
+    :param n_measurements: number of measurements to choose.
+    :param dim: dimension D.
+    :param n_complexity: trajectory complexity K.
+    :param n_anchors: total number of anchors. Default is max(anchor_indices) + 1.
+
+    :return: sorted indices of the chosen candidates.
+    """
+    anchor_indices = np.asarray(anchor_indices)
+    if n_anchors is None:
+        n_anchors = np.max(anchor_indices) + 1
+    n_available = np.bincount(anchor_indices, minlength=n_anchors)
+
+    # uniform subsets: anchor m with p measurements appears in binom(n_available[m], p) subsets.
+    counts = _sample_counts(n_available, n_measurements, dim + 1, n_complexity)
+
+    indices = [
+        np.random.choice(np.where(anchor_indices == m)[0], size=count, replace=False) for m, count in enumerate(counts)
+    ]
+    return np.sort(np.concatenate(indices))
+
+
 def create_mask(n_samples, n_anchors, strategy, seed=None, verbose=False, **kwargs):
     """ 
-    NOT CURRENTLY USED (but can be useful at some point).
-    
     Create a mask of shape n_anchors x n_measurements.
     
     :param strategy: strategy to use. Currently implemented:
     - 'uniform': Choose uniformly the n_missing (passed via **kwargs) missing measurements
     - 'single_time': At each time/position there is at most one measurement
+    - 'limit_condition': Choose the n_missing missing measurements such that the limit condition is satisfied for
+      given dim and n_complexity (passed via **kwargs). The masks are distributed like 'uniform' (default) or
+      'single_time' masks conditioned on the limit condition, depending on the kwarg distribution.
+      Raises ValueError if the condition cannot be satisfied.
     """
     if seed is not None:
         np.random.seed(seed)
@@ -84,6 +319,28 @@ def create_mask(n_samples, n_anchors, strategy, seed=None, verbose=False, **kwar
         idx_f = np.random.choice(n_samples, n_samples - n_missing, replace=False)
         idx_a = np.random.choice(n_anchors, n_samples - n_missing, replace=True)
         mask[idx_f, idx_a] = 1.0
+    elif strategy == 'limit_condition':
+        n_missing = kwargs.get('n_missing', 0)
+        distribution = kwargs.get('distribution', 'uniform')
+        dim = kwargs['dim']
+        n_complexity = kwargs['n_complexity']
+        mask[:, :] = 0.0
+        if distribution == 'uniform':
+            anchor_indices = np.tile(np.arange(n_anchors), n_samples)
+            indices = choose_suitable_measurements(anchor_indices, n_samples * n_anchors - n_missing, dim, n_complexity,
+                                                   n_anchors)
+            mask.flat[indices] = 1.0
+        elif distribution == 'single_time':
+            n_measurements = n_samples - n_missing
+            if n_measurements < 0:
+                raise ValueError("too many measurements {}<{} requested".format(n_samples, n_missing))
+            # the anchors are chosen independently, so their counts are multinomial.
+            counts = _sample_counts([n_samples] * n_anchors, n_measurements, dim + 1, n_complexity, multinomial=True)
+            idx_f = np.random.choice(n_samples, n_measurements, replace=False)
+            idx_a = np.repeat(np.arange(n_anchors), counts)
+            mask[idx_f, idx_a] = 1.0
+        else:
+            raise NotImplementedError(distribution)
     else:
         raise NotImplementedError(strategy)
 
@@ -104,10 +361,42 @@ def get_D(anchors, samples):
     return D
 
 
-def get_D_topright(anchors, samples):
+def get_anchors_norm(anchors):
+    """ Squared norms of the anchors, to be reused by :func:`get_D_topright`.
+
+    :param anchors: dim x n_anchors anchor points.
+
+    :return: vector of length n_anchors.
+    """
+    return np.sum(anchors**2, axis=0)
+
+
+def get_D_topright(anchors, samples, chunk_size=None, dtype=np.float64, anchors_norm=None):
+    """ Create matrix of squared distances between samples and anchors.
+
+    This is the top-right block of :func:`get_D`, computed without creating the full matrix.
+
+    :param anchors: dim x n_anchors anchor points.
+    :param samples: dim x n_positions trajectory points.
+    :param chunk_size: number of positions treated at once. If None, all positions are treated at once.
+    :param dtype: type of the output, for instance np.float32 to halve the memory.
+    :param anchors_norm: squared norms of the anchors, see :func:`get_anchors_norm`. Computed if not given.
+
+    :return D_topright: matrix of squared distances n_positions x n_anchors.
+    """
+    if anchors_norm is None:
+        anchors_norm = get_anchors_norm(anchors)
     n_positions = samples.shape[1]
-    D = get_D(anchors, samples)
-    return D[:n_positions, n_positions:]
+    if chunk_size is None:
+        chunk_size = max(n_positions, 1)
+
+    D_topright = np.empty((n_positions, anchors.shape[1]), dtype=dtype)
+    for start in range(0, n_positions, chunk_size):
+        chunk = samples[:, start:start + chunk_size]
+        D_chunk = anchors_norm[None, :] - 2 * chunk.T @ anchors
+        D_chunk += np.sum(chunk**2, axis=0)[:, None]
+        D_topright[start:start + chunk_size] = D_chunk
+    return D_topright
 
 
 def get_measurements(traj, anchors, seed=None, n_samples=20, times=None):
@@ -3,14 +3,15 @@
 other_algorithms.py: Baseline algorithms to compare against. 
 """
 
-import pdb
-
 import numpy as np
 from scipy.optimize import least_squares
 
 from pylocus.lateration import SRLS
 
+from constraints import get_C_constraints
 from coordinate_fitting import fit_trajectory
+from measurements import as_measurements
+from profiling import stage, count
 from solvers import trajectory_recovery
 
 EPS = 1e-10
@@ -40,21 +41,21 @@ def get_anchors_and_distances(D_sq, idx, dim=2):
     Given squared distance matrix D and time index idx, 
     find all latest distance measurements up to this time index.
 
-    :param D_sq: squared distance matrix (N x M)
+    :param D_sq: squared distance matrix (N x M), or :class:`measurements.Measurements` instance.
     :param idx: time index for which we want measurements.
 
     :return: ndarray of distances squared (nx1) , 
              list (len n) of corresponding anchor indices.
     """
     assert idx >= 0 and idx < D_sq.shape[0]
-    r2 = []
-    anchors = []
-    for a_id in range(D_sq.shape[1]):
-        indices = np.where(D_sq[:idx + 1, a_id] > 0)[0]
-        if len(indices) > 0:
-            latest_idx = indices[-1]
-            r2.append(D_sq[latest_idx, a_id])
-            anchors.append(a_id)
+    measurements = as_measurements(D_sq)
+
+    # measurements are sorted by time, so the ones up to idx are a prefix.
+    end = np.searchsorted(measurements.time_indices, idx, side='right')
+    # the latest measurement of each anchor is its first occurence in the reversed prefix.
+    anchors, first_reversed = np.unique(measurements.anchor_indices[:end][::-1], return_index=True)
+    latest = end - 1 - first_reversed
+    r2 = measurements.squared_distances[latest]
     return np.array(r2).reshape((-1, 1)), np.array(anchors)
 
 
@@ -92,31 +93,27 @@ def cost_function(C_vec, D_sq, A, F, squared=False):
     """ Return residuals of least squares distance error.
 
     :param C_vec: trajectory coefficients (length dim*K)
-    :param D_sq: squared distance matrix (N x M)
+    :param D_sq: squared distance matrix (N x M), or :class:`measurements.Measurements` instance.
     :param A: anchor coordinates (dim x M)
     :param F: trajectory basis functions (K x N)
     :param squared: if True, the distances in the cost function are squared. 
 
-    :return: vector of residuals (length N)
+    :return: vector of residuals (one per measurement, ordered by time and anchor index)
     """
+    measurements = as_measurements(D_sq)
     dim = A.shape[0]
     C_k = C_vec.reshape((dim, -1))
-    R = C_k.dot(F)
-    diff = R[:, :, None] - A[:, None, :]  # dim x N x M
-    D_est = np.linalg.norm(diff, axis=0)  # N x M
 
-    # set the missing elements to zero.
-    D_est[D_sq == 0.0] = 0.0
+    # only evaluate the distances that were measured.
+    R = C_k.dot(F[:, measurements.time_indices])  # dim x n_measurements
+    D_est = np.linalg.norm(R - A[:, measurements.anchor_indices], axis=0)
     if np.any(np.isnan(D_est)):
         raise ValueError('some nans in D_est')
 
-    D = D_sq.copy()
-    D[D > 0] = np.sqrt(D[D > 0])
-
     if squared:
-        nonzero = (D**2 - D_est**2)[D > 0]
+        nonzero = measurements.squared_distances - D_est**2
     else:
-        nonzero = (D - D_est)[D > 0]
+        nonzero = np.sqrt(measurements.squared_distances) - D_est
     cost = np.power(nonzero, 2).reshape((-1, ))
     return cost
 
@@ -125,7 +122,7 @@ def split_cost_function(X_vec, D_sq, A, F, squared=True):
     """ Return cost of distance squared, but with cost function split into coeffs and coeffs'coeffs:=L. Therefore the optimization variable is bigger but we only care about the first K*dim elements.
 
     :param X_vec: vector of trajectory coefficients and its squares, of length (dim*K+K*K)
-    :param D_sq: squared distance matrix (N x M)
+    :param D_sq: squared distance matrix (N x M), or :class:`measurements.Measurements` instance.
     :param A: anchor coordinates (dim x M)
     :param F: trajectory basis functions (K x N)
     :param squared: only here for constistency with cost_function. Has to be set to True or an error is raised.
@@ -142,19 +139,9 @@ def split_cost_function(X_vec, D_sq, A, F, squared=True):
     assert A.shape[1] == M
     assert len(X_vec) == dim * K + K * K
 
-    ns, ms = np.where(D_sq > 0)
-    res = []
-
-    # TODO(FD): below could be written without for loop,
-    # but it is only used for testing so performance does not
-    # matter.
-    for n, m in zip(ns, ms):
-        cost_n = 0.5 * (np.linalg.norm(A[:, m])**2 - D_sq[n, m])
-        t_n = np.r_[np.outer(A[:, m], F[:, n]).reshape((-1, )), np.outer(F[:, n], F[:, n]).reshape((-1, ))]
-        assert len(t_n) == len(X_vec)
-        cost_n = cost_n - np.inner(t_n, X_vec)
-        res.append(cost_n)
-    return res
+    # row n of [T_A, T_B] is [vec(a_m f_n^T), vec(f_n f_n^T)], and b_n = 0.5 * (|a_m|^2 - d_mn^2).
+    T_A, T_B, b = get_C_constraints(D_sq, A, F)
+    return b - np.c_[T_A, T_B].dot(X_vec)
 
 
 # TODO(FD) fix this function to pass unit tests.
@@ -164,7 +151,7 @@ def cost_jacobian(C_vec, D_sq, A, F, squared=True):
     WARNING: this function does not pass its unit tests.
 
     :param C_vec: trajectory coefficients (dim x K)
-    :param D_sq: squared distance matrix (N x M)
+    :param D_sq: squared distance matrix (N x M), or :class:`measurements.Measurements` instance.
     :param A: anchor coordinates (dim x M)
     :param F: trajectory basis functions (K x N)
     :param squared: if True, the distances in the cost function are squared. Non-squared Jacobian not implemented yet.
@@ -174,8 +161,9 @@ def cost_jacobian(C_vec, D_sq, A, F, squared=True):
     if not squared:
         raise NotImplementedError('cost_jacobian for non-squared distances')
 
-    l = cost_function(C_vec, D_sq, A, F, squared=True)  # cost vector (N)
-    ns, ms = np.where(D_sq > 0)
+    measurements = as_measurements(D_sq)
+    l = cost_function(C_vec, measurements, A, F, squared=True)  # cost vector (N)
+    ns, ms = measurements.time_indices, measurements.anchor_indices
 
     N = len(l)
     Kd = len(C_vec)
@@ -199,6 +187,7 @@ def cost_jacobian(C_vec, D_sq, A, F, squared=True):
         jacobian[j, :] = jacobian_mat.reshape((-1, ))
     if np.any(np.isnan(jacobian)):
         print('Problems in cost_jacobian. Going in debugging mode.')
+        import pdb
         pdb.set_trace()
     return jacobian
 
@@ -210,6 +199,8 @@ def least_squares_lm(D, anchors, basis, x0, verbose=False, cost='simple', jacobi
         - 'squared': squared distances
         - 'simple': non-squared distances
         - 'split': split the cost in coeffs'coeffs=L and coeffs, optimize for whole thing at once.
+
+    :param D: squared distance matrix (N x M), or :class:`measurements.Measurements` instance.
     """
     dim = anchors.shape[0]
     M = anchors.shape[1]
@@ -226,42 +217,47 @@ def least_squares_lm(D, anchors, basis, x0, verbose=False, cost='simple', jacobi
     if np.any(np.isnan(x0)):
         raise ValueError(f'invalid x0 {x0}')
 
+    # extract the measured entries only once instead of at each cost evaluation.
+    D = as_measurements(D)
+
     scipy_verbose = 2 if verbose else 0
 
-    if (cost == 'squared') and jacobian:
-        res = least_squares(cost_function,
-                            jac=cost_jacobian,
-                            x0=x0,
-                            method='lm',
-                            args=(D, anchors, basis),
-                            kwargs={'squared': True},
-                            verbose=scipy_verbose)  # xtol=1e-20, ftol=1e-10,
-    elif (cost == 'squared') and (not jacobian):
-        res = least_squares(cost_function,
-                            x0=x0,
-                            method='lm',
-                            args=(D, anchors, basis),
-                            kwargs={'squared': True},
-                            verbose=scipy_verbose)  # xtol=1e-20, ftol=1e-10,
-
-    elif (cost == 'simple') and (not jacobian):
-        res = least_squares(cost_function,
-                            x0=x0,
-                            method='lm',
-                            args=(D, anchors, basis),
-                            kwargs={'squared': False},
-                            verbose=scipy_verbose)  # xtol=1e-20, ftol=1e-10,
-    elif (cost == 'simple') and jacobian:
-        raise NotImplementedError('Cannot do Jacobian without squares.')
-    elif cost == 'split':
-        C = x0.reshape((dim, K))
-        L = C.T.dot(C)
-        x0_extended = np.r_[x0, L.reshape((-1, ))]
-        res = least_squares(split_cost_function,
-                            x0=x0_extended,
-                            method='lm',
-                            args=(D, anchors, basis),
-                            verbose=scipy_verbose)  # xtol=1e-20, ftol=1e-10,
+    with stage('lm'):
+        if (cost == 'squared') and jacobian:
+            res = least_squares(cost_function,
+                                jac=cost_jacobian,
+                                x0=x0,
+                                method='lm',
+                                args=(D, anchors, basis),
+                                kwargs={'squared': True},
+                                verbose=scipy_verbose)  # xtol=1e-20, ftol=1e-10,
+        elif (cost == 'squared') and (not jacobian):
+            res = least_squares(cost_function,
+                                x0=x0,
+                                method='lm',
+                                args=(D, anchors, basis),
+                                kwargs={'squared': True},
+                                verbose=scipy_verbose)  # xtol=1e-20, ftol=1e-10,
+
+        elif (cost == 'simple') and (not jacobian):
+            res = least_squares(cost_function,
+                                x0=x0,
+                                method='lm',
+                                args=(D, anchors, basis),
+                                kwargs={'squared': False},
+                                verbose=scipy_verbose)  # xtol=1e-20, ftol=1e-10,
+        elif (cost == 'simple') and jacobian:
+            raise NotImplementedError('Cannot do Jacobian without squares.')
+        elif cost == 'split':
+            C = x0.reshape((dim, K))
+            L = C.T.dot(C)
+            x0_extended = np.r_[x0, L.reshape((-1, ))]
+            res = least_squares(split_cost_function,
+                                x0=x0_extended,
+                                method='lm',
+                                args=(D, anchors, basis),
+                                verbose=scipy_verbose)  # xtol=1e-20, ftol=1e-10,
+    count('cost_evaluations', res.nfev)
 
     if not res.success:
         if verbose:
@@ -311,6 +307,7 @@ def RLS(anchors, r2, grid, interpolation='nearest'):
 def pointwise_lateration(D, anchors, traj, indices, method='srls', grid=None):
     """ Solve using point-wise lateration. 
 
+    :param D: squared distance matrix (N x M), or :class:`measurements.Measurements` instance.
     :param indices: points at which we want to compute SRLS.
     :param method: Method to use. Currently supported:
         - 'rls': Range Least-Squares (need to give grid)
@@ -325,6 +322,7 @@ def pointwise_lateration(D, anchors, traj, indices, method='srls', grid=None):
     assert anchors.shape[0] == traj.dim
     assert anchors.shape[1] == D.shape[1], f'{anchors.shape}, {D.shape}'
 
+    D = as_measurements(D)
     points = []
     valid_indices = []
     for idx in indices:
@@ -347,12 +345,13 @@ def pointwise_lateration(D, anchors, traj, indices, method='srls', grid=None):
         anchors_here = anchors[:2, a_indices].T  #N x d
         weights = np.ones(r2.shape)
 
-        if method == 'srls':
-            estimate = SRLS(anchors_here, weights, r2)
-        elif method == 'rls':
-            estimate = RLS(anchors_here, r2, grid=grid)
-        else:
-            raise ValueError(method)
+        with stage('lateration'):
+            if method == 'srls':
+                estimate = SRLS(anchors_here, weights, r2)
+            elif method == 'rls':
+                estimate = RLS(anchors_here, r2, grid=grid)
+            else:
+                raise ValueError(method)
 
         points.append(estimate)
         valid_indices.append(idx)
@@ -367,14 +366,23 @@ def pointwise_rls(D, anchors, traj, indices, grid):
     return pointwise_lateration(D, anchors, traj, indices, method='rls', grid=grid)
 
 
+def _try_trajectory_recovery(D, anchors, basis, weighted, model):
+    """ Call :func:`solvers.trajectory_recovery`, returning None if T_B does not have the expected rank. """
+    try:
+        return trajectory_recovery(D, anchors, basis, weighted=weighted, model=model)
+    except np.linalg.LinAlgError as e:
+        print(f'Warning in apply_algorithm: {e}')
+        return None
+
+
 def apply_algorithm(traj, D, times, anchors, method='ours'):
     if method == 'ours-weighted':
-        basis = traj.get_basis(times=times)
-        Chat = trajectory_recovery(D, anchors, basis, weighted=True)
+        basis = traj.get_basis(times=times, sparse=(traj.model == 'bspline'))
+        Chat = _try_trajectory_recovery(D, anchors, basis, weighted=True, model=traj.model)
         return Chat, None, None
     elif method == 'ours':
-        basis = traj.get_basis(times=times)
-        Chat = trajectory_recovery(D, anchors, basis, weighted=False)
+        basis = traj.get_basis(times=times, sparse=(traj.model == 'bspline'))
+        Chat = _try_trajectory_recovery(D, anchors, basis, weighted=False, model=traj.model)
         return Chat, None, None
     elif method == 'srls':
         indices = range(D.shape[0])[traj.dim + 2::3]
@@ -409,7 +417,7 @@ def apply_algorithm(traj, D, times, anchors, method='ours'):
         return Chat, None, None
     elif method == 'lm-ours-weighted':
         basis = traj.get_basis(times=times)
-        c0 = trajectory_recovery(D, anchors, basis, weighted=True)
+        c0 = _try_trajectory_recovery(D, anchors, basis, weighted=True, model=traj.model)
         Chat = None
         if c0 is not None:
             c0 = c0.flatten()
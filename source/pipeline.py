@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+pipeline.py: Memoized pipeline stages, cached on disk.
+
+The output of each stage is saved in the cache folder, under a key computed from the stage name, the inputs and the
+code version (the source of the stage function and of the modules or functions it depends on). Input file names
+are keyed with the size and modification time of the file. Calling a stage again with the same inputs and
+unchanged code loads the saved output instead of recomputing it.
+
+Outputs of stages are tracked: when they are passed to another stage, their key is used instead of hashing their
+content again, so a stage is recomputed exactly when one of its upstream stages was. Typical usage:
+
+.. code-block:: python
+
+    pipeline = Pipeline('results/cache/')
+
+    @pipeline.stage(depends=['public_data_utils'])
+    def read(filename):
+        return read_dataset(filename)
+
+    @pipeline.stage()
+    def process(data, parameter=1):
+        ...
+
+    result = process(read('datasets/Plaza1.mat'), parameter=2)
+
+"""
+
+import functools
+import hashlib
+import importlib.util
+import inspect
+import os
+import pickle
+import sys
+
+import numpy as np
+
+
+class Pipeline(object):
+    """ Collection of stages sharing one cache folder.
+
+    :member folder: cache folder, with one subfolder per stage.
+    :member verbose: if True, print which stages are loaded and which are computed.
+    :member history: list of (stage name, 'loaded' or 'computed') of all stage calls, in order.
+
+    To recognize the stage outputs, the pipeline keeps a reference to all of them (most outputs, such as tuples and
+    dicts, do not support weak references). They are therefore not freed before the pipeline is; use separate
+    pipelines, or :meth:`forget`, for long sessions with large outputs.
+    """
+    def __init__(self, folder, verbose=False):
+        self.folder = folder
+        self.verbose = verbose
+        self.history = []
+        # keys of the stage outputs, by id, together with the output to make sure the id is not reused.
+        self._keys = {}
+
+    def forget(self):
+        """ Release the references to the stage outputs. Outputs computed so far are hashed again if they are passed to
+        another stage. """
+        self._keys = {}
+
+    def stage(self, name=None, depends=(), ignore=()):
+        """ Decorator turning a function into a cached stage.
+
+        :param name: name of the stage, the name of the function by default.
+        :param depends: names of the modules, or functions, the stage depends on. Changing their source invalidates
+        the cache. The source of the function itself is always included, but not the rest of the module defining it
+        (often the script running the pipeline), so helper functions of that module have to be listed here.
+        :param ignore: names of arguments that do not change the output (number of processes, verbosity, ...).
+        """
+        def decorator(function):
+            stage_name = function.__name__ if name is None else name
+            dependencies = list(depends)
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                bound = inspect.signature(function).bind(*args, **kwargs)
+                bound.apply_defaults()
+                inputs = {key: self.get_key(value) for key, value in bound.arguments.items() if key not in ignore}
+                key = hash_object([stage_name, get_code_version(function, dependencies), inputs])
+                filename = os.path.join(self.folder, stage_name, key + '.pkl')
+
+                if os.path.exists(filename):
+                    with open(filename, 'rb') as fp:
+                        output = pickle.load(fp)
+                    self._log(stage_name, 'loaded')
+                else:
+                    output = function(*args, **kwargs)
+                    save_pickle(output, filename)
+                    self._log(stage_name, 'computed')
+
+                # scalars are cheap to hash, and may be shared with unrelated values (None, small ints).
+                if not isinstance(output, (type(None), bool, int, float, complex, str, bytes)):
+                    self._keys[id(output)] = (key, output)
+                return output
+
+            wrapper.stage_name = stage_name
+            return wrapper
+
+        return decorator
+
+    def get_key(self, value):
+        """ Return the key of a stage output, or the hash of any other value. Lists, tuples and dicts of stage
+        outputs are supported. Strings naming existing files are hashed with the size and modification time of the
+        file, so that changing the file invalidates the cache. """
+        if id(value) in self._keys and self._keys[id(value)][1] is value:
+            return 'stage:' + self._keys[id(value)][0]
+        if isinstance(value, str) and os.path.isfile(value):
+            stat = os.stat(value)
+            return hash_object(['file', value, stat.st_size, stat.st_mtime_ns])
+        if isinstance(value, (list, tuple)):
+            return hash_object([type(value).__name__] + [self.get_key(element) for element in value])
+        if isinstance(value, dict):
+            return hash_object({key: self.get_key(element) for key, element in value.items()})
+        return hash_object(value)
+
+    def _log(self, stage_name, status):
+        self.history.append((stage_name, status))
+        if self.verbose:
+            print('{}: {}'.format(stage_name, status))
+
+
+def save_pickle(obj, filename):
+    """ Pickle obj, writing to a temporary file first so that no partial file is left on errors. """
+    dirname = os.path.dirname(filename)
+    if dirname != '' and not os.path.exists(dirname):
+        os.makedirs(dirname)
+    tmpfile = filename + '.tmp'
+    with open(tmpfile, 'wb') as fp:
+        pickle.dump(obj, fp)
+    os.replace(tmpfile, filename)
+
+
+@functools.lru_cache(maxsize=None)
+def get_module_hash(module_name):
+    """ Hash the source file of a module (computed once per session). """
+    filename = getattr(sys.modules.get(module_name), '__file__', None)
+    if filename is None:
+        try:
+            filename = importlib.util.find_spec(module_name).origin
+        except (AttributeError, ImportError, ValueError):
+            pass
+    if filename is None or not os.path.isfile(filename):
+        return module_name
+    with open(filename, 'rb') as fp:
+        return hashlib.sha1(fp.read()).hexdigest()
+
+
+def get_function_source(function):
+    """ Source of function, or its qualified name if the source is not available. """
+    try:
+        return inspect.getsource(function)
+    except (OSError, TypeError):
+        return function.__qualname__
+
+
+def get_code_version(function, dependencies=()):
+    """ Hash the source of function and of the given dependencies (module names or functions). """
+    sources = [
+        get_module_hash(dependency) if isinstance(dependency, str) else get_function_source(dependency)
+        for dependency in dependencies
+    ]
+    return hash_object([get_function_source(function)] + sources)
+
+
+def hash_object(obj):
+    """ Compute a hash of obj that does not change from session to session.
+
+    Supports numpy arrays, pandas objects, (nested) containers, and objects whose attributes are supported.
+    """
+    hasher = hashlib.sha1()
+    _update_hash(hasher, obj)
+    return hasher.hexdigest()
+
+
+def _update_hash(hasher, obj):
+    # the type is hashed as well, to distinguish for instance 1 from '1' or (1, ) from [1].
+    hasher.update(type(obj).__name__.encode())
+    if obj is None or isinstance(obj, (bool, int, float, complex, str, np.generic)):
+        hasher.update(repr(obj).encode())
+    elif isinstance(obj, bytes):
+        hasher.update(obj)
+    elif isinstance(obj, np.ndarray):
+        if obj.dtype == object:
+            _update_hash(hasher, obj.tolist())
+        else:
+            hasher.update('{}{}'.format(obj.dtype.str, obj.shape).encode())
+            hasher.update(np.ascontiguousarray(obj).tobytes())
+    elif isinstance(obj, (list, tuple)):
+        hasher.update(str(len(obj)).encode())
+        for element in obj:
+            _update_hash(hasher, element)
+    elif isinstance(obj, (set, frozenset)):
+        _update_hash(hasher, sorted(hash_object(element) for element in obj))
+    elif isinstance(obj, dict):
+        _update_hash(hasher, sorted((str(key), hash_object(value)) for key, value in obj.items()))
+    elif type(obj).__module__.startswith('pandas'):
+        import pandas as pd
+        if isinstance(obj, pd.DataFrame):
+            _update_hash(hasher, [list(map(str, obj.columns)), list(map(str, obj.dtypes))])
+        try:
+            hasher.update(pd.util.hash_pandas_object(obj, index=True).values.tobytes())
+        except TypeError:
+            # columns with unhashable elements, such as arrays.
+            _update_hash(hasher, [list(map(str, obj.index)), obj.values])
+    elif hasattr(obj, '__dict__'):
+        _update_hash(hasher, vars(obj))
+    else:
+        raise TypeError('cannot hash object of type {}'.format(type(obj)))
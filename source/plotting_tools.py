@@ -9,6 +9,7 @@ import seaborn as sns
 
 import simulation  # to avoid circular imports
 from global_variables import DIM, RTT_SYSTEM_ID
+from result_store import ResultStore
 
 
 def make_dirs_safe(path):
@@ -110,7 +111,12 @@ def plot_noise(key,
     linecycler = cycle(lines)
 
     resultfolder = 'results/{}/'.format(key)
-    results = simulation.read_results(resultfolder + 'result_')
+    store = ResultStore(resultfolder)
+    if len(store):
+        get_mean_error = store.get_mean
+    else:
+        results = simulation.read_results(resultfolder + 'result_')
+        get_mean_error = lambda error_type: np.mean(results[error_type], axis=-1)
     parameters = simulation.read_params(resultfolder + 'parameters.json')
 
     min_measurements = (DIM + 2) * parameters["complexities"][0] - 1
@@ -126,7 +132,7 @@ def plot_noise(key,
             max_measurements = np.min(parameters["positions"])
 
     for error_type in error_types:
-        error = np.mean(results[error_type], axis=-1)
+        error = get_mean_error(error_type)
         error = error.squeeze()
         measurements = np.arange(min_measurements, max_measurements + 1)[::-1]
         if len(second_dim) == 1:
@@ -348,10 +354,8 @@ def plot_complexities(traj, times, results, points_gt=None, ax=None, verbose=Fal
                 err = error_measure(points_gt, points_est, measure=measure)
                 print(f'{label} {measure} from coeffs: {err:.2e}')
 
-        if points is not None:
-            for x in points:
-                ax.scatter(*x, color=color, label=label, s=4.0)
-                label = None
+        if points is not None and len(points) > 0:
+            ax.scatter(*np.asarray(points).T, color=color, label=label, s=4.0)
     remove_ticks(ax)
     return ax
 
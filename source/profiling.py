@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+profiling.py: Timer registry to see where time goes in the different algorithms.
+
+The algorithms report their stages (constraint build, SVD, solve, LM, fitting, ...) to the default profiler:
+
+.. code-block:: python
+
+    with stage('svd'):
+        u, s, vh = np.linalg.svd(T_B)
+
+When profiling is not enabled, stages only cost a function call, so they can stay in the code. Typical usage:
+
+.. code-block:: python
+
+    PROFILER.enable(memory=True)
+    PROFILER.reset()
+    with stage('total'):
+        apply_algorithm(...)
+    print(PROFILER.get_results())
+
+"""
+
+from contextlib import contextmanager
+import functools
+import time
+import tracemalloc
+
+#: stages for which results are always returned (set to 0 if not visited).
+STAGES = ['total', 'constraints', 'svd', 'reduction', 'solve', 'lm', 'lateration', 'fitting']
+
+#: counters for which results are always returned.
+COUNTERS = ['cost_evaluations']
+
+
+class Profiler(object):
+    """ Registry of wall times, counters and peak memory per stage.
+
+    :member enabled: if False, stages and counters are ignored.
+    :member memory: if True, peak memory (in bytes) is tracked using tracemalloc.
+    :member times: dict of total wall time per stage (in seconds).
+    :member calls: dict of number of visits per stage.
+    :member counts: dict of counters (for example number of cost function evaluations).
+    :member peak_memory: dict of maximum memory allocated during each stage.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.memory = False
+        self._stack = []
+        self.reset()
+
+    def enable(self, memory=False):
+        """ Enable profiling.
+
+        :param memory: if True, also track peak memory. This slows down the code considerably.
+        """
+        self.enabled = True
+        self.memory = memory
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def disable(self):
+        if self.memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.enabled = False
+        self.memory = False
+
+    def reset(self):
+        """ Remove all previous measurements. """
+        self.times = {}
+        self.calls = {}
+        self.counts = {}
+        self.peak_memory = {}
+
+    @contextmanager
+    def stage(self, name):
+        """ Context manager measuring the time (and memory) spent inside. Stages can be nested. """
+        if not self.enabled:
+            yield
+            return
+
+        if self.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            # remember the peak reached so far by the enclosing stage before resetting it.
+            if len(self._stack):
+                self._stack[-1][2] = max(self._stack[-1][2], peak)
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+        else:
+            current = 0
+        entry = [name, current, current]
+        self._stack.append(entry)
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.times[name] = self.times.get(name, 0.0) + time.perf_counter() - start
+            self.calls[name] = self.calls.get(name, 0) + 1
+            self._stack.pop()
+
+            if self.memory:
+                __, peak = tracemalloc.get_traced_memory()
+                entry[2] = max(entry[2], peak)
+                self.peak_memory[name] = max(self.peak_memory.get(name, 0), entry[2] - entry[1])
+                if len(self._stack):
+                    self._stack[-1][2] = max(self._stack[-1][2], entry[2])
+
+    def count(self, name, increment=1):
+        """ Increment the counter of given name. """
+        if self.enabled:
+            self.counts[name] = self.counts.get(name, 0) + increment
+
+    def profiled(self, name):
+        """ Decorator to measure each call of a function as a stage. """
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.stage(name):
+                    return function(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def get_results(self):
+        """ Return flat dict of measurements, that can directly be used as columns of a results table.
+
+        The keys are time_<stage> (in seconds), n_<counter> and, if memory is tracked, memory_<stage> (in bytes).
+        """
+        stages = STAGES + [s for s in self.times.keys() if s not in STAGES]
+        results = {'time_' + s: self.times.get(s, 0.0) for s in stages}
+        counters = COUNTERS + [c for c in self.counts.keys() if c not in COUNTERS]
+        results.update({'n_' + c: self.counts.get(c, 0) for c in counters})
+        if self.memory:
+            results.update({'memory_' + s: self.peak_memory.get(s, 0) for s in stages})
+        return results
+
+
+#: default profiler, used by all algorithms.
+PROFILER = Profiler()
+
+
+def stage(name):
+    """ Measure a stage using the default profiler. See :meth:`Profiler.stage`. """
+    return PROFILER.stage(name)
+
+
+def count(name, increment=1):
+    """ Increment a counter of the default profiler. See :meth:`Profiler.count`. """
+    PROFILER.count(name, increment)
+
+
+def profiled(name):
+    """ Decorator measuring a function using the default profiler. See :meth:`Profiler.profiled`. """
+    return PROFILER.profiled(name)
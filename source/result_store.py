@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+result_store.py: Append-only storage of simulation results, one data file and one index per experiment folder.
+
+The arrays of all runs are stored uncompressed in a single npz file (results.npz), as members run<i>/<key>.npy, so
+that np.load can still be used to inspect it. The index (results.json) contains the parameters of each run and
+the byte offset, dtype and shape of each array, so that arrays can be memory-mapped without reading the rest of
+the file. Typical usage:
+
+.. code-block:: python
+
+    store = ResultStore('results/noise/')
+    store.append(results, parameters)
+    mean_errors = store.get_mean('errors')
+
+"""
+
+import json
+import os
+import time
+import zipfile
+
+import numpy as np
+
+
+class ResultStore(object):
+    """ Result store of one experiment folder.
+
+    :member datafile: path of the npz file containing all arrays.
+    :member indexfile: path of the json index.
+    :member runs: list of dicts with the time, the parameters and the arrays of each run.
+    """
+    def __init__(self, folder, name='results'):
+        self.datafile = os.path.join(folder, name + '.npz')
+        self.indexfile = os.path.join(folder, name + '.json')
+        self.runs = []
+        if os.path.exists(self.indexfile):
+            with open(self.indexfile, 'r') as fp:
+                self.runs = json.load(fp)['runs']
+
+    def __len__(self):
+        return len(self.runs)
+
+    def keys(self, run=-1):
+        """ Return the keys of given run. """
+        return list(self.runs[run]['arrays'].keys())
+
+    def append(self, results, parameters=None):
+        """ Add a new run.
+
+        :param results: dict of arrays (or objects convertible to arrays).
+        :param parameters: dict of parameters, saved in the index. Has to be json serializable.
+
+        :return: index of the new run.
+        """
+        run = len(self.runs)
+        dirname = os.path.dirname(self.datafile)
+        if dirname != '' and not os.path.exists(dirname):
+            os.makedirs(dirname)
+
+        members = {}
+        with zipfile.ZipFile(self.datafile, mode='a', compression=zipfile.ZIP_STORED) as zf:
+            for key, array in results.items():
+                array = np.asarray(array)
+                member = 'run{}/{}.npy'.format(run, key)
+                with zf.open(member, mode='w', force_zip64=True) as fp:
+                    np.lib.format.write_array(fp, array, allow_pickle=False)
+                members[key] = member
+
+        with open(self.datafile, 'rb') as fp, zipfile.ZipFile(self.datafile, mode='r') as zf:
+            arrays = {key: _get_array_info(fp, zf.getinfo(member)) for key, member in members.items()}
+
+        self.runs.append(dict(time=time.time(), parameters=parameters, arrays=arrays))
+        self._save_index()
+        return run
+
+    def load(self, key, run=-1, index=Ellipsis, mmap=True):
+        """ Load an array (or a slice of it) of a given run.
+
+        :param key: name of the array.
+        :param run: index of the run.
+        :param index: slice to load, for instance np.s_[0, :, 2].
+        :param mmap: if True, the array is memory-mapped and only the slice is read from disk.
+
+        :return: array of given slice.
+        """
+        info = self.runs[run]['arrays'][key]
+        shape = tuple(info['shape'])
+        order = 'F' if info['fortran_order'] else 'C'
+        if mmap and np.prod(shape) > 0:
+            array = np.memmap(self.datafile,
+                              dtype=np.dtype(info['dtype']),
+                              mode='r',
+                              offset=info['offset'],
+                              shape=shape,
+                              order=order)
+            return np.array(array[index])
+        with zipfile.ZipFile(self.datafile, mode='r') as zf, zf.open(info['member']) as fp:
+            return np.lib.format.read_array(fp, allow_pickle=False)[index]
+
+    def iterate(self, key, index=Ellipsis, runs=None):
+        """ Iterate over the given slice of an array of all (or given) runs, loading one run at a time. """
+        if runs is None:
+            runs = range(len(self.runs))
+        for run in runs:
+            if key in self.runs[run]['arrays']:
+                yield self.load(key, run, index)
+
+    def load_all(self, key, index=Ellipsis, runs=None):
+        """ Load the given slice of an array of all (or given) runs, stacked along a new last axis. """
+        return np.stack(list(self.iterate(key, index, runs)), axis=-1)
+
+    def get_mean(self, key, index=Ellipsis, runs=None):
+        """ Average the given slice of an array over all (or given) runs, loading one run at a time. """
+        total = None
+        n_runs = 0
+        for array in self.iterate(key, index, runs):
+            total = array.astype(float) if total is None else total + array
+            n_runs += 1
+        if n_runs == 0:
+            raise KeyError(key)
+        return total / n_runs
+
+    def _save_index(self):
+        # write to a temporary file first, so that the index is never left half-written.
+        tmpfile = self.indexfile + '.tmp'
+        with open(tmpfile, 'w') as fp:
+            json.dump(dict(datafile=os.path.basename(self.datafile), runs=self.runs), fp, indent=4, default=_to_json)
+        os.replace(tmpfile, self.indexfile)
+
+
+def _to_json(obj):
+    """ Convert numpy arrays and scalars in the parameters. """
+    try:
+        return obj.tolist()
+    except AttributeError:
+        raise TypeError('cannot save {} in index.'.format(type(obj)))
+
+
+def _get_array_info(fp, zipinfo):
+    """ Find the position and format of the data of an uncompressed .npy member in the zip file fp. """
+    # the local header has a fixed size of 30 bytes, followed by the filename and the extra field.
+    fp.seek(zipinfo.header_offset + 26)
+    filename_length, extra_length = np.frombuffer(fp.read(4), dtype='<u2')
+    fp.seek(zipinfo.header_offset + 30 + int(filename_length) + int(extra_length))
+    version = np.lib.format.read_magic(fp)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(fp)
+    else:
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(fp)
+    return dict(member=zipinfo.filename,
+                offset=fp.tell(),
+                shape=list(shape),
+                dtype=dtype.str,
+                fortran_order=bool(fortran_order))
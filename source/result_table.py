@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+result_table.py: Columnar accumulation of experiment results.
+
+Appending rows to a pandas DataFrame (with .loc or pd.concat) copies the whole table each time. ResultTable instead
+collects each column in a list, and arrays (estimated coefficients, points, ...) in a side store, referenced from the
+table by an integer id. The DataFrame is only created when needed. Typical usage:
+
+.. code-block:: python
+
+    table = ResultTable()
+    for ...:
+        array_id = table.add_arrays(coeffs=C_hat, points=p_hat)
+        table.append(dict(method=method, mse=mse, plotting=array_id))
+        table.flush('results/experiment.chunks')
+    result_df = table.to_dataframe()
+
+"""
+
+import pickle
+
+import pandas as pd
+
+
+class ResultTable(object):
+    """ Table of results, stored by column.
+
+    :member columns: dict of lists, one per column.
+    :member arrays: dict of dicts of arrays, with the array ids as keys.
+    :member n_rows: number of rows.
+    """
+    def __init__(self):
+        self.columns = {}
+        self.arrays = {}
+        self.n_rows = 0
+        self._flushed_rows = 0
+        self._flushed_arrays = 0
+
+    def __len__(self):
+        return self.n_rows
+
+    def append(self, record):
+        """ Add a row. Columns that are missing in the record are set to None. New columns are filled with None
+        for all previous rows. """
+        for name in record.keys():
+            if name not in self.columns:
+                self.columns[name] = [None] * self.n_rows
+        for name, column in self.columns.items():
+            column.append(record.get(name, None))
+        self.n_rows += 1
+
+    def extend(self, other, id_columns=('plotting', ), **constants):
+        """ Add all rows and arrays of other table.
+
+        :param other: ResultTable to add.
+        :param id_columns: columns containing array ids, which are renumbered.
+        :param constants: columns set to a constant value for all added rows, for instance dataset='Plaza1'.
+        """
+        offset = len(self.arrays)
+        for array_id, arrays in other.arrays.items():
+            self.arrays[array_id + offset] = arrays
+        for i in range(other.n_rows):
+            record = {name: column[i] for name, column in other.columns.items()}
+            for name in id_columns:
+                if record.get(name, None) is not None:
+                    record[name] += offset
+            record.update(constants)
+            self.append(record)
+
+    def add_arrays(self, **arrays):
+        """ Store the given arrays (None is allowed) and return their id. """
+        array_id = len(self.arrays)
+        self.arrays[array_id] = arrays
+        return array_id
+
+    def get_arrays(self, array_id):
+        """ Return the dict of arrays of given id. """
+        return self.arrays[array_id]
+
+    def to_dataframe(self, start=0, plotting=False):
+        """ Create a DataFrame of the rows from start on.
+
+        :param plotting: if True, replace the array ids of column 'plotting' by the tuple (coeffs, points) of
+        the stored arrays.
+        """
+        data = {name: column[start:] for name, column in self.columns.items()}
+        if plotting and 'plotting' in data:
+            data['plotting'] = [
+                None if array_id is None else tuple(self.arrays[array_id].values()) for array_id in data['plotting']
+            ]
+        return pd.DataFrame(data, index=pd.RangeIndex(start, self.n_rows))
+
+    def flush(self, filename):
+        """ Append the rows and arrays added since the last flush to filename. See :func:`read_table`. """
+        # the array ids are consecutive, so the new arrays are the last ones.
+        new_ids = range(self._flushed_arrays, len(self.arrays))
+        chunk = dict(columns={name: column[self._flushed_rows:]
+                              for name, column in self.columns.items()},
+                     arrays={array_id: self.arrays[array_id]
+                             for array_id in new_ids})
+        with open(filename, 'ab') as fp:
+            pickle.dump(chunk, fp)
+        self._flushed_rows = self.n_rows
+        self._flushed_arrays = len(self.arrays)
+
+
+def read_table(filename):
+    """ Read a table written (possibly in many chunks) by :meth:`ResultTable.flush`. """
+    table = ResultTable()
+    with open(filename, 'rb') as fp:
+        while True:
+            try:
+                chunk = pickle.load(fp)
+            except EOFError:
+                break
+            n_rows = len(next(iter(chunk['columns'].values()), []))
+            for name in chunk['columns'].keys():
+                if name not in table.columns:
+                    table.columns[name] = [None] * table.n_rows
+            for name, column in table.columns.items():
+                column.extend(chunk['columns'].get(name, [None] * n_rows))
+            table.n_rows += n_rows
+            table.arrays.update(chunk['arrays'])
+    table._flushed_rows = table.n_rows
+    table._flushed_arrays = len(table.arrays)
+    return table
@@ -4,40 +4,157 @@ simulation.py: Generate random trajectories and noisy distance estimates, recons
 """
 
 import numpy as np
-import matplotlib.pyplot as plt
 import cvxpy
 import json
 import os
 import time
 import logging
 
+from accumulators import Histogram, ReservoirSample, RunningStatistics
 from global_variables import DIM
 from measurements import get_measurements, create_mask, add_noise, create_anchors
-from solvers import OPTIONS, semidef_relaxation_noiseless, trajectory_recovery
+from result_store import ResultStore
+from solvers import OPTIONS, SemidefSolver, trajectory_recovery
 from trajectory import Trajectory
 import hypothesis as h
 
+COUNT_KEYS = ['successes', 'num-not-solved', 'num-not-accurate']
+ERROR_KEYS = ['errors', 'relative-errors', 'absolute-errors']
 
-def robust_increment(arr, idx):
-    """ increment value of array if inside bound, and set to 1 if previously nan. """
-    if idx < arr.shape:
-        if np.isnan(arr[idx]):
-            arr[idx] = 1
-        else:
-            arr[idx] += 1
+#: default bin edges for the histogram of squared distances.
+DISTANCE_BINS = np.linspace(0, 500, 101)
 
+#: default number of squared distances kept to estimate their quantiles.
+DISTANCE_SAMPLE_SIZE = 10000
 
-def robust_add(arr, idx, value):
-    if idx < arr.shape:
-        if np.isnan(arr[idx]):
-            arr[idx] = 0
-        arr[idx] += value
+#: default seed of the sample of squared distances.
+DISTANCE_SEED = 1
+
+
+def get_max_missing(dim, n_complexity, n_anchors, n_positions, n_measurements):
+    """ Largest number of missing measurements for which the trajectory can possibly be recovered.
+
+    We need at least (dim + 2) * n_complexity - 1 measurements, and the limit condition has to be satisfiable, which
+    is the case if and only if it holds for the measurements spread as evenly as possible over the anchors.
+
+    :return: maximum number of missing measurements, -1 if the trajectory can never be recovered.
+    """
+    n_min = (dim + 2) * n_complexity - 1
+    for n in range(n_min, n_measurements + 1):
+        partition = [n // n_anchors + 1] * (n % n_anchors) + [n // n_anchors] * (n_anchors - n % n_anchors)
+        if h.limit_condition(partition, dim + 1, n_complexity):
+            return n_measurements - n
+    return -1
+
+
+def get_wilson_interval(rate, n_its, z=1.96):
+    """ Wilson score interval of a success rate estimated from n_its independent iterations.
+
+    :param z: quantile of the normal distribution, 1.96 for a 95% confidence interval.
+
+    :return: lower and upper bound of the interval.
+    """
+    denominator = 1 + z**2 / n_its
+    center = (rate + z**2 / (2 * n_its)) / denominator
+    half_width = z * np.sqrt(rate * (1 - rate) / n_its + z**2 / (4 * n_its**2)) / denominator
+    return max(center - half_width, 0.0), min(center + half_width, 1.0)
+
+
+def adaptive_sweep(evaluate, n_last, n_its, tolerance=0.1, z=1.96):
+    """ Evaluate a success rate, decreasing with the number of missing measurements, at few points.
+
+    The interval [0, n_last] is bisected until, for each sub-interval, the confidence intervals of the success rates
+    at both ends (see :func:`get_wilson_interval`) lie within tolerance of each other, or no point is left in between.
+    Since the rate is decreasing, the rates inside the sub-interval are then known to within tolerance (with the
+    given confidence), and can be interpolated with :func:`fill_sweep`. With few iterations the confidence intervals
+    are wide, so more points are evaluated; with tolerance 0, all points between 0 and n_last are evaluated.
+
+    :param evaluate: function returning the success rate for a given number of missing measurements.
+    :param n_last: last number of missing measurements to consider.
+    :param n_its: number of iterations of each evaluation.
+    :param tolerance: maximum width of the range of success rates between neighboring evaluations.
+    :param z: quantile of the confidence intervals, see :func:`get_wilson_interval`.
+
+    :return: dict of the evaluated success rates, with the numbers of missing measurements as keys.
+    """
+    rates = {}
+    if n_last < 0:
+        return rates
+    rates[0] = evaluate(0)
+    if n_last == 0:
+        return rates
+    rates[n_last] = evaluate(n_last)
+    intervals = [(0, n_last)]
+    while len(intervals):
+        start, end = intervals.pop()
+        if end - start <= 1:
+            continue
+        bounds = get_wilson_interval(rates[start], n_its, z) + get_wilson_interval(rates[end], n_its, z)
+        if max(bounds) - min(bounds) <= tolerance:
+            continue
+        middle = (start + end) // 2
+        rates[middle] = evaluate(middle)
+        intervals += [(start, middle), (middle, end)]
+    return rates
+
+
+def fill_sweep(arrays, evaluated):
+    """ Linearly interpolate the arrays (along the last axis) between evaluated indices. """
+    if len(evaluated) == 0:
+        return
+    missing = np.setdiff1d(np.arange(evaluated[0], evaluated[-1] + 1), evaluated)
+    for array in arrays:
+        array[..., missing] = np.interp(missing, evaluated, array[..., evaluated])
+
+
+def new_configuration(n_measurements):
+    """ Create the results of one configuration, for all numbers of missing measurements.
+
+    The counts are nan until visited. The errors are accumulated online, see :class:`accumulators.RunningStatistics`.
+    """
+    configuration = {key: np.full(n_measurements, np.nan) for key in COUNT_KEYS}
+    configuration.update({key: RunningStatistics(n_measurements) for key in ERROR_KEYS})
+    return configuration
+
+
+def get_dense_results(configurations, shape):
+    """ Gather the results of all configurations in arrays of given shape, padded with nan.
+
+    The 'errors' and 'relative-errors' are averaged over the solved iterations, the 'absolute-errors' are summed.
+    'errors-std' is the standard deviation of the 'errors'.
+    """
+    results = {key: np.full(shape, np.nan) for key in COUNT_KEYS + ERROR_KEYS + ['errors-std']}
+    for index, configuration in configurations.items():
+        n_measurements = len(configuration['successes'])
+        for key in COUNT_KEYS:
+            results[key][index][:n_measurements] = configuration[key]
+        for key in ERROR_KEYS:
+            statistics = configuration[key]
+            solved = statistics.count > 0
+            value = statistics.mean * statistics.count if key == 'absolute-errors' else statistics.mean
+            results[key][index][:n_measurements][solved] = value[solved]
+        results['errors-std'][index][:n_measurements] = configuration['errors'].get_std()
+    return results
 
 
 def run_simulation(parameters, outfolder=None, solver=None, verbose=False):
     """ Run simulation. 
 
     :param parameters: Can be either the name of the folder where parameters.json is stored, or a new dict of parameters.
+    With sampling_strategy 'limit_condition', only masks satisfying the limit condition are drawn (see
+    :func:`measurements.create_mask`), and configurations for which no such mask exists count as not solved without
+    being solved.
+    With sweep 'adaptive', the numbers of missing measurements are not all evaluated; instead, the transition from
+    success to failure is located by bisection (see :func:`adaptive_sweep`), starting from the largest number of
+    missing measurements allowed by the limit condition. The bisection stops when the confidence intervals of the
+    success rates (estimated from n_its iterations) at neighboring points are within adaptive_tolerance (0.1 by
+    default) of each other. The counts in between evaluated points are interpolated and the errors are left at nan.
+    With measure_distances, the squared distances are summarized online: 'distances' is a random sample of at most
+    distance_sample_size values (drawn with the seed distance_seed), 'distances-histogram' the counts in the bins
+    distance_bins (plus underflow and overflow) and 'distances-statistics' the count, mean and variance.
+    The parameter sdp_solver sets the cvxpy solver of the semidefinite relaxation, CVXOPT by default. With 'SCS', the
+    iterations with the same number of measurements are warm-started (see :class:`solvers.SemidefSolver`), but the
+    results differ from CVXOPT for the same success_thresholds, since SCS is less accurate.
 
     """
     if type(parameters) == str:
@@ -72,6 +189,12 @@ def run_simulation(parameters, outfolder=None, solver=None, verbose=False):
     if 'sampling_strategy' not in parameters:
         parameters['sampling_strategy'] = 'uniform'
 
+    if 'sweep' not in parameters:
+        parameters['sweep'] = 'full'
+
+    if 'adaptive_tolerance' not in parameters:
+        parameters['adaptive_tolerance'] = 0.1
+
     complexities = parameters['complexities']
     anchors = parameters['anchors']
     positions = parameters['positions']
@@ -85,13 +208,100 @@ def run_simulation(parameters, outfolder=None, solver=None, verbose=False):
     else:
         max_measurements = max(positions) * max(anchors)
 
-    successes = np.full((len(complexities), len(anchors), len(positions), len(noise_sigmas), max_measurements), np.nan)
-    errors = np.full(successes.shape, np.nan)
-    relative_errors = np.full(successes.shape, np.nan)
-    absolute_errors = np.full(successes.shape, np.nan)
-    num_not_solved = np.full(successes.shape, np.nan)
-    num_not_accurate = np.full(successes.shape, np.nan)
-    squared_distances = []
+    # results of each configuration (c_idx, a_idx, p_idx, noise_idx), see new_configuration.
+    configurations = {}
+    distance_statistics = RunningStatistics()
+    distance_histogram = Histogram(parameters.get('distance_bins', DISTANCE_BINS))
+    # separate seed, so that measuring the distances does not change the random draws of the simulation.
+    distance_sample = ReservoirSample(parameters.get('distance_sample_size', DISTANCE_SAMPLE_SIZE),
+                                      seed=parameters.get('distance_seed', DISTANCE_SEED))
+
+    def run_iterations(configuration, m_idx, noise_idx, n_complexity, n_anchors, n_positions, n_missing, sdp_solver):
+        """ Run all iterations of one configuration and return the success rate. """
+        noise_sigma = noise_sigmas[noise_idx]
+        successes = configuration['successes']
+        num_not_solved = configuration['num-not-solved']
+        num_not_accurate = configuration['num-not-accurate']
+
+        # set all values to 0 since we have visited them.
+        if np.isnan(successes[m_idx]):
+            successes[m_idx] = 0.0
+        if np.isnan(num_not_solved[m_idx]):
+            num_not_solved[m_idx] = 0.0
+        if np.isnan(num_not_accurate[m_idx]):
+            num_not_accurate[m_idx] = 0.0
+
+        for _ in range(n_its):
+
+            trajectory = Trajectory(n_complexity, dim=DIM)
+            anchors_coord = create_anchors(DIM, n_anchors)
+            trajectory.set_coeffs(seed=None)
+
+            basis, D_topright = get_measurements(trajectory, anchors_coord, n_samples=n_positions)
+            distances = np.sqrt(D_topright)
+            D_topright = add_noise(D_topright, noise_sigma, parameters["noise_to_square"])
+            try:
+                mask = create_mask(n_positions,
+                                   n_anchors,
+                                   strategy=parameters['sampling_strategy'],
+                                   n_missing=n_missing,
+                                   dim=DIM,
+                                   n_complexity=n_complexity)
+            except ValueError:
+                # no mask satisfies the limit condition, so there is nothing to solve.
+                num_not_solved[m_idx] += n_its
+                break
+            if parameters['measure_distances']:
+                distance_statistics.update(D_topright.flatten())
+                distance_histogram.update(D_topright)
+                distance_sample.update(D_topright)
+            D_topright = np.multiply(D_topright, mask)
+
+            try:
+                assert h.limit_condition(np.sort(np.sum(mask, axis=0))[::-1], DIM + 1,
+                                         n_complexity), "insufficient rank"
+                if (solver is None) or (solver == "semidef_relaxation_noiseless"):
+                    X = sdp_solver.solve(D_topright, anchors_coord, basis)
+                    P_hat = X[:DIM, DIM:]
+                elif solver == 'trajectory_recovery':
+                    P_hat = trajectory_recovery(D_topright, anchors_coord, basis, model=trajectory.model)
+                elif solver == 'weighted_trajectory_recovery':
+                    P_hat = trajectory_recovery(D_topright, anchors_coord, basis, weighted=True, model=trajectory.model)
+                else:
+                    raise ValueError(solver)
+
+                # calculate reconstruction error with respect to distances
+                trajectory_estimated = Trajectory(coeffs=P_hat)
+                _, D_estimated = get_measurements(trajectory_estimated, anchors_coord, n_samples=n_positions)
+                estimated_distances = np.sqrt(D_estimated)
+
+                configuration['errors'].add(np.linalg.norm(P_hat - trajectory.coeffs), m_idx)
+                configuration['relative-errors'].add(
+                    np.linalg.norm((distances - estimated_distances) / (distances + 1e-10)), m_idx)
+                configuration['absolute-errors'].add(np.linalg.norm(distances - estimated_distances), m_idx)
+
+                assert not np.linalg.norm(P_hat - trajectory.coeffs) > success_thresholds[noise_idx]
+
+                successes[m_idx] += 1
+
+            except cvxpy.SolverError:
+                logging.info("could not solve n_positions={}, n_missing={}".format(n_positions, n_missing))
+                num_not_solved[m_idx] += 1
+
+            except ZeroDivisionError:
+                logging.info("could not solve n_positions={}, n_missing={}".format(n_positions, n_missing))
+                num_not_solved[m_idx] += 1
+
+            except np.linalg.LinAlgError:
+                num_not_solved[m_idx] += 1
+
+            except AssertionError as e:
+                if str(e) == "insufficient rank":
+                    num_not_solved[m_idx] += 1
+                else:
+                    logging.info("result not accurate n_positions={}, n_missing={}".format(n_positions, n_missing))
+                    num_not_accurate[m_idx] += 1
+        return successes[m_idx] / n_its
 
     for c_idx, n_complexity in enumerate(complexities):
         print('n_complexity', n_complexity)
@@ -106,105 +316,54 @@ def run_simulation(parameters, outfolder=None, solver=None, verbose=False):
                     n_measurements = n_positions
                 else:
                     n_measurements = n_positions * n_anchors
+
+                # the semidefinite problems only depend on the sizes, so they are reused for all iterations.
+                sdp_solver = None
+                if (solver is None) or (solver == "semidef_relaxation_noiseless"):
+                    sdp_solver = SemidefSolver(DIM,
+                                               n_complexity,
+                                               n_positions,
+                                               n_anchors,
+                                               chosen_solver=parameters.get('sdp_solver', cvxpy.CVXOPT))
+
+                for noise_idx in range(len(noise_sigmas)):
+                    configurations[c_idx, a_idx, p_idx, noise_idx] = new_configuration(n_measurements)
+
+                if parameters['sweep'] == 'adaptive':
+                    n_missing_max = get_max_missing(DIM, n_complexity, n_anchors, n_positions, n_measurements)
+                    for noise_idx, noise_sigma in enumerate(noise_sigmas):
+                        if verbose:
+                            print("noise", noise_sigma)
+                        configuration = configurations[c_idx, a_idx, p_idx, noise_idx]
+                        evaluated = adaptive_sweep(
+                            lambda m_idx: run_iterations(configuration, m_idx, noise_idx, n_complexity, n_anchors,
+                                                         n_positions, m_idx, sdp_solver), n_missing_max, n_its,
+                            parameters['adaptive_tolerance'])
+                        fill_sweep([configuration[key] for key in COUNT_KEYS], sorted(evaluated.keys()))
+                        # the remaining configurations can not be solved.
+                        configuration['successes'][n_missing_max + 1:] = 0.0
+                        configuration['num-not-solved'][n_missing_max + 1:] = n_its
+                        configuration['num-not-accurate'][n_missing_max + 1:] = 0.0
+                    continue
+
                 for m_idx, n_missing in enumerate(range(n_measurements)):
                     if verbose:
                         print('measurements idx', m_idx)
 
                     for noise_idx, noise_sigma in enumerate(noise_sigmas):
-                        indexes = np.s_[c_idx, a_idx, p_idx, noise_idx, m_idx]
                         if verbose:
                             print("noise", noise_sigma)
-
-                        # set all values to 0 since we have visited them.
-                        if np.isnan(successes[indexes]):
-                            successes[indexes] = 0.0
-                        if np.isnan(num_not_solved[indexes]):
-                            num_not_solved[indexes] = 0.0
-                        if np.isnan(num_not_accurate[indexes]):
-                            num_not_accurate[indexes] = 0.0
-
-                        for _ in range(n_its):
-
-                            trajectory = Trajectory(n_complexity, dim=DIM)
-                            anchors_coord = create_anchors(DIM, n_anchors)
-                            trajectory.set_coeffs(seed=None)
-
-                            basis, D_topright = get_measurements(trajectory, anchors_coord, n_samples=n_positions)
-                            distances = np.sqrt(D_topright)
-                            D_topright = add_noise(D_topright, noise_sigma, parameters["noise_to_square"])
-                            mask = create_mask(n_positions,
-                                               n_anchors,
-                                               strategy=parameters['sampling_strategy'],
-                                               n_missing=n_missing)
-                            if parameters['measure_distances']:
-                                squared_distances.extend(D_topright.flatten().tolist())
-                            D_topright = np.multiply(D_topright, mask)
-
-                            try:
-                                assert h.limit_condition(np.sort(np.sum(mask, axis=0))[::-1], DIM + 1,
-                                                         n_complexity), "insufficient rank"
-                                if (solver is None) or (solver == "semidef_relaxation_noiseless"):
-                                    X = semidef_relaxation_noiseless(D_topright,
-                                                                     anchors_coord,
-                                                                     basis,
-                                                                     chosen_solver=cvxpy.CVXOPT)
-                                    P_hat = X[:DIM, DIM:]
-                                elif solver == 'trajectory_recovery':
-                                    P_hat = trajectory_recovery(D_topright, anchors_coord, basis)
-                                elif solver == 'weighted_trajectory_recovery':
-                                    P_hat = trajectory_recovery(D_topright, anchors_coord, basis, weighted=True)
-                                else:
-                                    raise ValueError(solver)
-
-                                # calculate reconstruction error with respect to distances
-                                trajectory_estimated = Trajectory(coeffs=P_hat)
-                                _, D_estimated = get_measurements(trajectory_estimated,
-                                                                  anchors_coord,
-                                                                  n_samples=n_positions)
-                                estimated_distances = np.sqrt(D_estimated)
-
-                                robust_add(errors, indexes, np.linalg.norm(P_hat - trajectory.coeffs))
-                                robust_add(relative_errors, indexes,
-                                           np.linalg.norm((distances - estimated_distances) / (distances + 1e-10)))
-                                robust_add(absolute_errors, indexes, np.linalg.norm(distances - estimated_distances))
-
-                                assert not np.linalg.norm(P_hat - trajectory.coeffs) > success_thresholds[noise_idx]
-
-                                robust_increment(successes, indexes)
-
-                            except cvxpy.SolverError:
-                                logging.info("could not solve n_positions={}, n_missing={}".format(
-                                    n_positions, n_missing))
-                                robust_increment(num_not_solved, indexes)
-
-                            except ZeroDivisionError:
-                                logging.info("could not solve n_positions={}, n_missing={}".format(
-                                    n_positions, n_missing))
-                                robust_increment(num_not_solved, indexes)
-
-                            except np.linalg.LinAlgError:
-                                robust_increment(num_not_solved, indexes)
-
-                            except AssertionError as e:
-                                if str(e) == "insufficient rank":
-                                    robust_increment(num_not_solved, indexes)
-                                else:
-                                    logging.info("result not accurate n_positions={}, n_missing={}".format(
-                                        n_positions, n_missing))
-                                    robust_increment(num_not_accurate, indexes)
-
-                            errors[indexes] = errors[indexes] / (n_its - num_not_solved[indexes])
-                            relative_errors[indexes] = relative_errors[indexes] / (n_its - num_not_solved[indexes])
-
-    results = {
-        'successes': successes,
-        'num-not-solved': num_not_solved,
-        'num-not-accurate': num_not_accurate,
-        'errors': errors,
-        'relative-errors': relative_errors,
-        'absolute-errors': absolute_errors,
-        'distances': squared_distances
-    }
+                        run_iterations(configurations[c_idx, a_idx, p_idx, noise_idx], m_idx, noise_idx, n_complexity,
+                                       n_anchors, n_positions, n_missing, sdp_solver)
+
+    shape = (len(complexities), len(anchors), len(positions), len(noise_sigmas), max_measurements)
+    results = get_dense_results(configurations, shape)
+    results['distances'] = distance_sample.get_sample()
+    if parameters['measure_distances']:
+        results['distances-histogram'] = distance_histogram.counts
+        results['distances-statistics'] = np.array(
+            [distance_statistics.count, distance_statistics.mean,
+             distance_statistics.get_variance()])
 
     if outfolder is not None:
         print('Done with simulation. Saving results...')
@@ -215,27 +374,17 @@ def run_simulation(parameters, outfolder=None, solver=None, verbose=False):
             os.makedirs(outfolder)
 
         save_params(outfolder + 'parameters.json', **parameters)
-        save_results(outfolder + 'result_{}_{}', results)
+        run = ResultStore(outfolder).append(results, parameters)
+        print('saved run {} in {}'.format(run, outfolder))
     else:
         return results
 
 
-def save_results(filename, results):
-    """ Save results in with increasing number in filename. """
-    for key, array in results.items():
-        for i in range(100):
-            try_name = filename.format(key, i)
-            if not os.path.exists(try_name + '.npy'):
-                try_name = filename.format(key, i)
-                np.save(try_name, array, allow_pickle=False)
-                print('saved as', try_name)
-                break
-            else:
-                print('exists:', try_name)
-
-
 def read_results(filestart):
-    """ Read all results saved with above save_results function. """
+    """ Read results saved in the legacy format, with one .npy file per key and run. 
+
+    New results are saved in a :class:`result_store.ResultStore`.
+    """
     results = {}
     dirname = os.path.dirname(filestart)
     for filename in os.listdir(dirname):
@@ -5,21 +5,23 @@ solvers.py: Algorithms used to estimate coefficients from distance measurements.
 """
 
 import numpy as np
-import cvxpy as cp
+import scipy.sparse as sp
+from scipy.sparse.linalg import spsolve
 
 from constraints import *
+from measurements import as_measurements
+from profiling import stage
 
 OPTIONS = {
-    cp.SCS: {
+    'SCS': {
         "verbose": False,
         "max_iters": 2500,
         "eps": 1e-3,  # convergence tolerance
         "alpha": 1.8,  # relaxation parameer
         "scale": 5.0,  # balance between primal and dual residual
         "normalize": True,  # precondition data matrices
-        "use_indirect": True,  # use indirect solver for KKT system
     },
-    cp.CVXOPT: {
+    'CVXOPT': {
         "verbose": False,
         "max_iters": 100,
         "abstol": 1e-7,
@@ -37,7 +39,7 @@ OPTIONS = {
 """
 
 
-def semidef_relaxation_noiseless(D_topright, anchors, basis, chosen_solver=cp.SCS, **kwargs):
+def semidef_relaxation_noiseless(D_topright, anchors, basis, chosen_solver='SCS', **kwargs):
     """ Solve semidefinite feasibility problem of sensor localization problem. 
 
     .. centered::
@@ -53,12 +55,14 @@ def semidef_relaxation_noiseless(D_topright, anchors, basis, chosen_solver=cp.SC
     parameters are same as for semidef_relaxation. 
     """
 
+    import cvxpy as cp
+
     # overwrite predefined options with kwargs.
-    options = OPTIONS[chosen_solver]
+    options = dict(OPTIONS[chosen_solver])
     options.update(kwargs)
 
     if options["verbose"]:
-        print("Running with options:", OPTIONS[chosen_solver])
+        print("Running with options:", options)
 
     dim, M = anchors.shape
     K = basis.shape[0]
@@ -66,26 +70,28 @@ def semidef_relaxation_noiseless(D_topright, anchors, basis, chosen_solver=cp.SC
 
     Z = cp.Variable((dim + K, dim + K), PSD=True)
 
-    e_ds, e_dprimes, deltas = get_constraints_identity(K)
-    t_mns, D_mns = get_constraints_D(D_topright, anchors, basis)
+    with stage('constraints'):
+        e_ds, e_dprimes, deltas = get_constraints_identity(K)
+        t_mns, D_mns = get_constraints_D(D_topright, anchors, basis)
 
-    constraints = []
+        constraints = []
 
-    for e_d, e_dprime, delta in zip(e_ds, e_dprimes, deltas):
-        constraints.append(e_d.T * Z * e_dprime == delta)
+        for e_d, e_dprime, delta in zip(e_ds, e_dprimes, deltas):
+            constraints.append(e_d.T * Z * e_dprime == delta)
 
-    for t_mn, D_topright_mn in zip(t_mns, D_mns):
-        t_mn = np.array(t_mn)
-        constraints.append(t_mn.T * Z * t_mn == D_topright_mn)
+        for t_mn, D_topright_mn in zip(t_mns, D_mns):
+            t_mn = np.array(t_mn)
+            constraints.append(t_mn.T * Z * t_mn == D_topright_mn)
 
     obj = cp.Minimize(cp.sum(Z))
     prob = cp.Problem(obj, constraints)
 
-    prob.solve(solver=chosen_solver, **options)
+    with stage('solve'):
+        prob.solve(solver=chosen_solver, **options)
     return Z.value
 
 
-def semidef_relaxation(D_topright, anchors, basis, chosen_solver=cp.SCS, **kwargs):
+def semidef_relaxation(D_topright, anchors, basis, chosen_solver='SCS', **kwargs):
     """ Solve semidefinite feasibility problem of sensor localization problem. 
 
     .. centered::
@@ -102,19 +108,21 @@ def semidef_relaxation(D_topright, anchors, basis, chosen_solver=cp.SCS, **kwarg
     In following, N is number of measurements, M is nmber of anchors, dim is dimension 
     and K is trajectory complexity. 
 
-    :param D_topright: squared distance measurements N x M
+    :param D_topright: squared distance measurements N x M (or :class:`measurements.Measurements` instance)
     :param anchors: anchor coordinates dim x M
     :param basis: basis functions K x N
 
     :return: trajectory coefficients dim x K
     """
 
+    import cvxpy as cp
+
     # overwrite predefined options with kwargs.
-    options = OPTIONS[chosen_solver]
+    options = dict(OPTIONS[chosen_solver])
     options.update(kwargs)
 
     if options["verbose"]:
-        print("Running with options:", OPTIONS[chosen_solver])
+        print("Running with options:", options)
 
     dim, M = anchors.shape
     K = basis.shape[0]
@@ -123,32 +131,137 @@ def semidef_relaxation(D_topright, anchors, basis, chosen_solver=cp.SCS, **kwarg
     Z = cp.Variable((dim + K, dim + K), PSD=True)
     eps = cp.Variable((1))
 
-    e_ds, e_dprimes, deltas = get_constraints_identity(K)
-    t_mns, D_mns = get_constraints_D(D_topright, anchors, basis)
+    with stage('constraints'):
+        e_ds, e_dprimes, deltas = get_constraints_identity(K)
+        t_mns, D_mns = get_constraints_D(D_topright, anchors, basis)
 
-    constraints = []
+        constraints = []
 
-    for e_d, e_dprime, delta in zip(e_ds, e_dprimes, deltas):
-        constraints.append(e_d.T * Z * e_dprime == delta)
+        for e_d, e_dprime, delta in zip(e_ds, e_dprimes, deltas):
+            constraints.append(e_d.T * Z * e_dprime == delta)
 
-    for t_mn, D_topright_mn in zip(t_mns, D_mns):
-        t_mn = np.array(t_mn)
-        constraints.append(t_mn.T * Z * t_mn <= D_topright_mn + eps)
-        constraints.append(t_mn.T * Z * t_mn >= D_topright_mn - eps)
+        for t_mn, D_topright_mn in zip(t_mns, D_mns):
+            t_mn = np.array(t_mn)
+            constraints.append(t_mn.T * Z * t_mn <= D_topright_mn + eps)
+            constraints.append(t_mn.T * Z * t_mn >= D_topright_mn - eps)
 
-    constraints.append(eps >= 0)
+        constraints.append(eps >= 0)
 
     obj = cp.Minimize(eps)
     prob = cp.Problem(obj, constraints)
 
     #options['reltol'] = 1e-5
     #options['feastol'] = 1e-5
-    prob.solve(solver=chosen_solver, **options)
+    with stage('solve'):
+        prob.solve(solver=chosen_solver, **options)
     print('final tolerance', prob.value)
     return Z.value
 
 
-def trajectory_recovery(D_topright, anchors, basis, average_with_Q=False, weighted=False):
+class SemidefSolver(object):
+    """ Reusable solver for the semidefinite relaxations, for a fixed problem size.
+
+    The cvxpy problem is built with the anchors, basis functions and measurements as parameters, and with one
+    constraint per measurement. One problem is kept per number of measurements, so successive calls to :meth:`solve`
+    with the same number of measurements, for instance for different random masks, skip the problem construction and
+    compilation. Solvers supporting it (SCS, not CVXOPT) are also warm-started from the previous solution.
+
+    Nothing is reused between different numbers of measurements: in a sweep over the number of missing measurements,
+    each new number builds and compiles a new problem, so only the iterations with the same number are faster.
+
+    Usage:
+
+    .. code-block:: python
+
+        sdp_solver = SemidefSolver(dim, n_complexity, n_positions, n_anchors, chosen_solver='SCS')
+        for D_topright in all_measurements:
+            X = sdp_solver.solve(D_topright, anchors, basis)
+
+    :member options: solver options used by this instance (copy of :data:`OPTIONS` updated with kwargs).
+    :member problems: dict of (T, d, Z, problem) by number of measurements, see :meth:`get_problem`.
+    """
+    def __init__(self, dim, n_complexity, n_positions, n_anchors, chosen_solver='SCS', noiseless=True, **kwargs):
+        """
+        :param dim: dimension of the trajectory.
+        :param n_complexity: trajectory complexity K.
+        :param n_positions: number of positions N.
+        :param n_anchors: number of anchors M.
+        :param chosen_solver: cvxpy solver.
+        :param noiseless: if True, solve the problem of :func:`.semidef_relaxation_noiseless`, otherwise the one of
+                          :func:`.semidef_relaxation`.
+        :param kwargs: solver options, overwriting the defaults from :data:`OPTIONS` for this instance only.
+        """
+        self.dim = dim
+        self.n_complexity = n_complexity
+        self.shape = (n_positions, n_anchors)
+        self.chosen_solver = chosen_solver
+        self.noiseless = noiseless
+        self.options = dict(OPTIONS[chosen_solver])
+        self.options.update(kwargs)
+        self.problems = {}
+
+    def get_problem(self, n_measurements):
+        """ Get the problem for the given number of measurements, built on the first call.
+
+        :return: T, d, Z, problem, where T and d are the parameters of the constraints T vec(Z) = d (row i of T is
+        vec(t_i t_i^T) for measurement i), and Z is the variable.
+        """
+        if n_measurements in self.problems:
+            return self.problems[n_measurements]
+
+        import cvxpy as cp
+
+        size = self.dim + self.n_complexity
+        T = cp.Parameter((n_measurements, size * size))
+        d = cp.Parameter(n_measurements)
+        Z = cp.Variable((size, size), PSD=True)
+
+        constraints = [Z[:self.dim, :self.dim] == np.eye(self.dim)]
+        if self.noiseless:
+            constraints.append(T @ cp.vec(Z) == d)
+            obj = cp.Minimize(cp.sum(Z))
+        else:
+            eps = cp.Variable((1))
+            constraints.append(T @ cp.vec(Z) <= d + eps)
+            constraints.append(T @ cp.vec(Z) >= d - eps)
+            constraints.append(eps >= 0)
+            obj = cp.Minimize(eps)
+        self.problems[n_measurements] = T, d, Z, cp.Problem(obj, constraints)
+        return self.problems[n_measurements]
+
+    def set_parameters(self, D_topright, anchors, basis):
+        """ Set the parameters of the problem. Parameters are as for :func:`.semidef_relaxation`.
+
+        :return: the problem and its variable Z, see :meth:`get_problem`.
+        """
+        measurements = as_measurements(D_topright)
+        assert measurements.shape == self.shape, measurements.shape
+        assert anchors.shape == (self.dim, self.shape[1]), anchors.shape
+        assert basis.shape == (self.n_complexity, self.shape[0]), basis.shape
+
+        T, d, Z, problem = self.get_problem(len(measurements))
+        t_mns = np.r_[anchors[:, measurements.anchor_indices], -basis[:, measurements.time_indices]]
+        T.value = np.einsum('in,jn->nij', t_mns, t_mns).reshape((len(measurements), -1))
+        d.value = measurements.squared_distances
+        return problem, Z
+
+    def solve(self, D_topright, anchors, basis):
+        """ Solve the semidefinite relaxation. Parameters are as for :func:`.semidef_relaxation`.
+
+        :return: the matrix Z of shape (dim + K) x (dim + K). The coefficients are given by Z[:dim, dim:].
+        """
+        with stage('constraints'):
+            problem, Z = self.set_parameters(D_topright, anchors, basis)
+
+        if self.options["verbose"]:
+            print("Running with options:", self.options)
+
+        with stage('solve'):
+            problem.solve(solver=self.chosen_solver, warm_start=True, **self.options)
+        return Z.value
+
+
+def trajectory_recovery(D_topright, anchors, basis, average_with_Q=False, weighted=False, model=None):
     """ Solve linearised sensor localization problem. 
 
     First parameters are same as for :func:`.semidef_relaxation`. 
@@ -157,35 +270,71 @@ def trajectory_recovery(D_topright, anchors, basis, average_with_Q=False, weight
                            estimate of P with the knowledge we have for Q=P^TP
     :param weighted: bool, if true use an equivalent of weighted least squares
                     (assuming gaussian noise added to distances)
+    :param model: model of the trajectory basis (see :class:`trajectory.Trajectory`). If given, T_B is reduced to its
+                  rank using the precomputed matrix from :func:`constraints.get_reduction_matrix`, and the normal
+                  equations are assembled directly with :func:`constraints.get_C_normal_equations`. Otherwise, or if
+                  less than 2K-1 positions have measurements, an SVD of T_B is used. The bspline model requires
+                  the model to be given, and its basis can be sparse (see :meth:`trajectory.Trajectory.get_basis`).
+
+    :raises np.linalg.LinAlgError: (a ValueError) if T_B does not have the expected rank, for instance for a bspline
+    basis without model.
     """
 
     dim, M = anchors.shape
     K = basis.shape[0]
 
-    #get constraints
-    T_A, T_B, b = get_C_constraints(D_topright, anchors, basis, weighted=weighted)
-
-    Ns, Ms = np.where(D_topright > 0)
-    Ns_that_see_an_anchor = len(np.unique(Ns))
+    measurements = as_measurements(D_topright)
+    Ns = measurements.time_indices  # sorted
+    Ns_that_see_an_anchor = np.count_nonzero(np.diff(Ns)) + 1 if len(Ns) else 0
 
     #reduce dimension T_B to its rank
-    rankT_B = min(2 * K - 1, Ns_that_see_an_anchor)
-    u, s, vh = np.linalg.svd(T_B, full_matrices=False)
-    num_zero_SVs = len(np.where(s < 1e-10)[0])
-    if len(s) - num_zero_SVs != rankT_B:  #This if can be cut, it was just useful for debugging
-        print('LOGIC ERROR: T_B not of expected rank!!')
-        return None
-
-    T_B_fullrank = u[:, :rankT_B] @ np.diag(s[:rankT_B])
-
-    T = np.hstack((T_A, -T_B_fullrank / 2))
-    #solve with a left-inverse (requires enough measurements - see Thm)
-    if T.shape[0] >= T.shape[1]:
-        C_hat = np.linalg.inv(T.T @ T) @ T.T @ b
-    #solve with a right-inverse if we do not have enough measurements
+    if model is not None:
+        reduction = get_reduction_matrix(model, K)
+        rankT_B = min(reduction.shape[1], Ns_that_see_an_anchor)
+        use_reduction = (rankT_B == reduction.shape[1]) and (not average_with_Q)
+    else:
+        rankT_B = min(2 * K - 1, Ns_that_see_an_anchor)
+        use_reduction = False
+
+    if use_reduction and len(measurements) >= K * dim + rankT_B:
+        # the span of the rows of T_B is known in advance for our models, so we can directly build the
+        # normal equations, without ever creating T.
+        with stage('constraints'):
+            TT, Tb = get_C_normal_equations(measurements, anchors, basis, reduction, weighted=weighted)
+        with stage('solve'):
+            # for the bspline model with sparse basis, TT is sparse and (up to a permutation) banded.
+            C_hat = spsolve(TT, Tb) if sp.issparse(TT) else np.linalg.solve(TT, Tb)
     else:
-        right_inv = T.T @ np.linalg.inv(T @ T.T)
-        C_hat = right_inv @ b
+        if sp.issparse(basis):
+            basis = basis.toarray()
+
+        #get constraints
+        with stage('constraints'):
+            T_A, T_B, b = get_C_constraints(measurements, anchors, basis, weighted=weighted)
+
+        if use_reduction:
+            with stage('reduction'):
+                T_B_fullrank = reduction.T.dot(T_B.T).T if sp.issparse(reduction) else T_B @ reduction
+        else:
+            with stage('svd'):
+                u, s, vh = np.linalg.svd(T_B, full_matrices=False)
+            num_zero_SVs = len(np.where(s < 1e-10)[0])
+            if len(s) - num_zero_SVs != rankT_B:
+                raise np.linalg.LinAlgError(
+                    'T_B has rank {} instead of the expected {}. For the bspline model, model has to be given.'.format(
+                        len(s) - num_zero_SVs, rankT_B))
+
+            T_B_fullrank = u[:, :rankT_B] @ np.diag(s[:rankT_B])
+
+        T = np.hstack((T_A, -T_B_fullrank / 2))
+        with stage('solve'):
+            #solve with a left-inverse (requires enough measurements - see Thm)
+            if T.shape[0] >= T.shape[1]:
+                C_hat = np.linalg.inv(T.T @ T) @ T.T @ b
+            #solve with a right-inverse if we do not have enough measurements
+            else:
+                right_inv = T.T @ np.linalg.inv(T @ T.T)
+                C_hat = right_inv @ b
 
     assert len(C_hat) == K * dim + rankT_B
 
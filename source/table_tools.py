@@ -20,15 +20,22 @@ METHOD_DICT = {
 }
 
 
-def pretty_print_table(print_table, methods=None, value='mse'):
-    print_table.rename(columns={'n_measurements': 'N', 'n_complexity': 'K'}, inplace=True)
+def get_pivot_table(print_table, methods=None, value='mse'):
+    """ Compute mean and std of value for each method (rows) and each N and K (columns). """
+    print_table = print_table.rename(columns={'n_measurements': 'N', 'n_complexity': 'K'})
     pt = pd.pivot_table(print_table, values=value, index='method', columns=['N', 'K'], aggfunc=['mean', 'std'])
     if methods is not None:
         pt = pt.reindex(methods)
+    return pt
+
+
+def pretty_print_table(print_table, methods=None, value='mse'):
+    print_table.rename(columns={'n_measurements': 'N', 'n_complexity': 'K'}, inplace=True)
+    pt = get_pivot_table(print_table, methods, value)
     #styler = pt.style.apply(highlight_min, axis=0)
     styler = pt.style.apply(highlight_both, axis=0)
-    pd.set_option('precision', 2)
-    pd.set_option('max_columns', 100)
+    pd.set_option('display.precision', 2)
+    pd.set_option('display.max_columns', 100)
     return styler, pt
 
 
@@ -110,3 +117,4 @@ def latex_print(pt, methods, fname='', index_names=True, **kwargs):
         with open(fname, 'w+') as f:
             f.write(latex)
         print('wrote as', fname)
+    return latex
@@ -9,11 +9,71 @@ The units can be interpreted as 1m.
 import copy
 import math
 
-from matplotlib.patches import Circle
-import matplotlib.pyplot as plt
 import numpy as np
+from scipy.interpolate import BSpline
+import scipy.sparse as sp
 
-from global_variables import DIM, TMAX, TAU, ROBOT_WIDTH, EPSILON
+from global_variables import DIM, TMAX, TAU, ROBOT_WIDTH, EPSILON, BSPLINE_DEGREE
+
+
+def get_bspline_knots(n_complexity, period, degree=BSPLINE_DEGREE):
+    """ Get the knots of the clamped uniform B-spline basis with n_complexity elements on [0, period].
+
+    Each basis function is non-zero on at most degree + 1 of the n_complexity - degree intervals.
+    """
+    assert n_complexity > degree, f'bspline model requires more than {degree} coefficients'
+    return np.r_[np.zeros(degree), np.linspace(0, period, n_complexity - degree + 1), np.full(degree, period)]
+
+
+def _get_next_colors(ax, n_colors):
+    """ Take the next n_colors colors from the color cycle of ax, as n_colors calls to ax.plot would.
+
+    The color cycle of ax is private in matplotlib, so if it is not available, the colors are taken from the default
+    color cycle, after the colors of the lines already in ax (this does not advance the cycle of ax).
+    """
+    try:
+        return [ax._get_lines.get_next_color() for _ in range(n_colors)]
+    except AttributeError:
+        import matplotlib.pyplot as plt
+        cycle_colors = plt.rcParams['axes.prop_cycle'].by_key()['color']
+        return [cycle_colors[(len(ax.lines) + i) % len(cycle_colors)] for i in range(n_colors)]
+
+
+def plot_segments(ax, starts, ends, marker=None, **kwargs):
+    """ Plot line segments from starts[:, i] to ends[:, i] with one LineCollection, in the first two dimensions.
+
+    The result looks like one ax.plot call per segment: unless a color is given, successive segments use the next
+    colors of the color cycle of ax, and markers (if any) are drawn at both ends of each segment, with one scatter call.
+
+    :param starts, ends: arrays of shape (dim, number of segments).
+    :param marker: marker to draw at the ends of the segments.
+    :param kwargs: line options, such as color, linestyle, linewidth or label.
+
+    :return: the LineCollection.
+    """
+    from matplotlib.collections import LineCollection
+    import matplotlib.pyplot as plt
+
+    segments = np.stack((np.asarray(starts)[:2].T, np.asarray(ends)[:2].T), axis=1)
+    if 'c' in kwargs:
+        kwargs['color'] = kwargs.pop('c')
+    if not any(key in kwargs for key in ['color', 'colors']):
+        kwargs['colors'] = _get_next_colors(ax, len(segments))
+
+    lines = LineCollection(segments, **kwargs)
+    ax.add_collection(lines)
+    if marker is not None and len(segments) > 0:
+        colors = lines.get_colors()
+        if len(colors) == len(segments):
+            colors = np.repeat(colors, 2, axis=0)
+        ax.scatter(segments[:, :, 0].ravel(),
+                   segments[:, :, 1].ravel(),
+                   marker=marker,
+                   color=colors,
+                   s=plt.rcParams['lines.markersize']**2,
+                   zorder=lines.get_zorder())
+    ax.autoscale_view()
+    return lines
 
 
 class Trajectory(object):
@@ -22,7 +82,8 @@ class Trajectory(object):
     :member dim: dimension (2 or 3)
     :member n_complexity: complexity of trajectory
     :member coeffs: coefficients of trajectory (dim x n_complexity)
-    :member model: trajectory model either bandlimited, full_bandlimited (both sines and cosines) or polynomial.
+    :member model: trajectory model either bandlimited, full_bandlimited (both sines and cosines), polynomial or
+                   bspline (piecewise polynomials with local support, see :func:`get_bspline_knots`).
 
     """
     def __init__(self,
@@ -38,9 +99,9 @@ class Trajectory(object):
 
         :param n_complexity: complexity of trajectory.
         :param dim: dimension of the trajectory.
-        :param model: trajectory model type (either bandlimited, full_bandlimited (both sines and cosines) or
-        polynomial).
-        :param period: period in second for bandlimited trajectories.
+        :param model: trajectory model type (either bandlimited, full_bandlimited (both sines and cosines), polynomial or
+        bspline).
+        :param period: period in second for bandlimited trajectories, duration for bspline trajectories.
         :param full_period: if true, the default time of trajectory is 0 to period, else it is only a 0 to 0.5 of period
         :param seed: random seed to generate coefficients
         :param coeffs: array of coefficients of shape (dim x n_complexity). If it is given, the dimensions and
@@ -85,7 +146,7 @@ class Trajectory(object):
 
     def get_times(self, n_samples):
         """ Get times appropriate for this trajectory model. """
-        if self.model == 'polynomial':
+        if self.model == 'polynomial' or self.model == 'bspline':
             times = np.linspace(0, self.period, n_samples)
         elif self.model == 'bandlimited' or self.model == 'full_bandlimited':
             part = 1.0 if self.params['full_period'] else 0.5
@@ -95,11 +156,13 @@ class Trajectory(object):
 
         return times
 
-    def get_basis(self, n_samples=None, times=None):
+    def get_basis(self, n_samples=None, times=None, sparse=False):
         """ Get basis vectors evaluated at specific times. 
 
         :param n_samples: number of samples. 
         :param times: vector of times of length n_samples
+        :param sparse: if True, return a scipy.sparse matrix. Only the bspline model has a sparse basis, with at most
+                       BSPLINE_DEGREE + 1 non-zero elements per sample.
 
         :return: basis vector matrix (n_complexity x n_samples)
         """
@@ -114,6 +177,13 @@ class Trajectory(object):
         else:
             raise ValueError('case not treated:', n_samples, times)
 
+        if self.model == 'bspline':
+            knots = get_bspline_knots(self.n_complexity, self.period)
+            basis = BSpline.design_matrix(np.asarray(times, dtype=float), knots, BSPLINE_DEGREE, extrapolate=True).T
+            return basis.tocsc() if sparse else basis.toarray()
+        elif sparse:
+            return sp.csc_matrix(self.get_basis(times=times))
+
         k = np.reshape(range(self.n_complexity), [self.n_complexity, 1])
         n = np.reshape(times, [1, n_samples])
         if self.model == 'bandlimited':
@@ -143,7 +213,9 @@ n_samples)
         """
         n_samples = len(times)
         n = np.reshape(times, [1, n_samples])
-        if self.model == 'bandlimited':
+        if self.model == 'bspline':
+            return self._get_bspline_derivative(times, 1)
+        elif self.model == 'bandlimited':
             k = np.reshape(range(self.n_complexity), [self.n_complexity, 1])
             return -4 * np.pi * k / self.period * np.sin(2 * np.pi * k * n / self.period)
         elif self.model == 'polynomial':
@@ -171,7 +243,9 @@ n_samples)
         """
         n_samples = len(times)
         n = np.reshape(times, [1, n_samples])
-        if self.model == 'bandlimited':
+        if self.model == 'bspline':
+            return self._get_bspline_derivative(times, 2)
+        elif self.model == 'bandlimited':
             k = np.reshape(range(self.n_complexity), [self.n_complexity, 1])
             return -2 * (2 * np.pi * k / self.period)**2 * np.cos(2 * np.pi * k * n / self.period)
         elif self.model == 'polynomial':
@@ -188,6 +262,12 @@ n_samples)
         else:
             raise ValueError(self.model)
 
+    def _get_bspline_derivative(self, times, order):
+        """ Get derivative of given order of the bspline basis (n_complexity x n_samples). """
+        knots = get_bspline_knots(self.n_complexity, self.period)
+        spline = BSpline(knots, np.eye(self.n_complexity), BSPLINE_DEGREE).derivative(order)
+        return spline(np.asarray(times, dtype=float)).T
+
     def set_coeffs(self, seed=None, coeffs=None, dimension=5):
         if seed is not None:
             np.random.seed(seed)
@@ -257,6 +337,7 @@ n_samples)
             ax = kwargs["ax"]
             kwargs.pop("ax")
         else:
+            import matplotlib.pyplot as plt
             fig, ax = plt.subplots()
 
         cont_kwargs = {k: val for k, val in kwargs.items() if (k != 'marker')}
@@ -285,65 +366,56 @@ n_samples)
             ax = kwargs["ax"]
             kwargs.pop("ax")
         else:
+            import matplotlib.pyplot as plt
             fig, ax = plt.subplots()
         cont_kwargs = {k: val for k, val in kwargs.items() if (k != 'marker')}
         ax.plot(*trajectory_cont[:2], **cont_kwargs)
         return ax
 
     def plot_connections(self, basis, anchors, mask, ax=None, **kwargs):
+        """ Plot measurements as lines between trajectory points and anchors. See :func:`.plot_segments` for kwargs.
+        """
+        if ax is None:
+            import matplotlib.pyplot as plt
+            ax = plt.gca()
         trajectory = self.get_sampling_points(basis=basis)
         ns, ms = np.where(mask)
-        for n, m in zip(ns, ms):
-            p1 = trajectory[:, n]
-            p2 = anchors[:, m]
-            if ax is None:
-                plt.plot([p1[0], p2[0]], [p1[1], p2[1]], **kwargs)
-            else:
-                ax.plot([p1[0], p2[0]], [p1[1], p2[1]], **kwargs)
+        plot_segments(ax, trajectory[:, ns], anchors[:, ms], **kwargs)
 
     def plot_noisy_connections(self, basis, anchors, mask, D_noisy, ax=None, **kwargs):
         """ Plot measurements between trajectory points and anchors 
         with the noisy distances as connection lengths. 
         """
+        if ax is None:
+            import matplotlib.pyplot as plt
+            ax = plt.gca()
         trajectory = self.get_sampling_points(basis=basis)
         ns, ms = np.where(mask)
-        for n, m in zip(ns, ms):
-            d = np.sqrt(D_noisy[n, m])
-            p1 = trajectory[:, n]
-            p2 = anchors[:, m]
-            v = p1 - p2
-            alpha = np.arctan2(v[1], v[0])
-            p3 = p2 + d * np.array((np.cos(alpha), np.sin(alpha)))
-            if ax is None:
-                plt.plot([p1[0], p2[0]], [p1[1], p2[1]], marker='o', **kwargs)
-                plt.plot([p3[0], p2[0]], [p3[1], p2[1]], marker='o', **kwargs)
-            else:
-                ax.plot([p1[0], p2[0]], [p1[1], p2[1]], marker='o', **kwargs)
-                ax.plot([p3[0], p2[0]], [p3[1], p2[1]], marker='o', **kwargs)
+        d = np.sqrt(D_noisy[ns, ms])
+        p1 = trajectory[:2, ns]
+        p2 = anchors[:2, ms]
+        v = p1 - p2
+        alpha = np.arctan2(v[1], v[0])
+        p3 = p2 + d * np.array((np.cos(alpha), np.sin(alpha)))
+
+        # interleave the two segments of each measurement, as they were plotted one after the other.
+        starts = np.stack((p1, p3), axis=2).reshape((2, -1))
+        ends = np.repeat(p2, 2, axis=1)
+        plot_segments(ax, starts, ends, marker='o', **kwargs)
 
     def plot_number_measurements(self, basis, mask=None, legend=False, ax=None):
         #  mask is n_samples x n_anchors.
         trajectory = self.get_sampling_points(basis=basis)
         if ax is None:
+            import matplotlib.pyplot as plt
             ax = plt.gca()
 
-        if legend:
-            label1 = '1'
-            label2 = '2'
-            label3 = '>2'
-        else:
-            label1 = label2 = label3 = None
-        for i in range(trajectory.shape[1]):
-            point = trajectory[:, i]
-            if np.sum(mask[i, :]) == 1:
-                ax.scatter(*point, color='orange', label=label1)
-                label1 = None
-            elif np.sum(mask[i, :]) == 2:
-                ax.scatter(*point, color='red', label=label2)
-                label2 = None
-            elif np.sum(mask[i, :]) > 2:
-                ax.scatter(*point, color='green', label=label3)
-                label3 = None
+        n_measurements = np.sum(mask, axis=1)
+        categories = [(n_measurements == 1, 'orange', '1'), (n_measurements == 2, 'red', '2'),
+                      (n_measurements > 2, 'green', '>2')]
+        for indices, color, label in categories:
+            if np.any(indices):
+                ax.scatter(*trajectory[:, indices], color=color, label=label if legend else None)
         if legend:
             ax.legend(title='# measurements')
 
@@ -374,23 +446,40 @@ n_samples)
         points = self.get_continuous_points()
         self.coeffs[:, 0] -= np.mean(points, axis=1)
 
+    def get_arc_lengths(self, times, n_nodes=5):
+        """ Get the distance travelled from times[0] to each of the given times.
+
+        The speed is integrated with Gauss-Legendre quadrature on each interval between consecutive times, which is
+        exact for polynomial speeds of degree up to 2*n_nodes-1.
+
+        :param times: sorted vector of times.
+        :param n_nodes: number of quadrature nodes per interval.
+
+        :return: cumulative distances, of same length as times.
+        """
+        times = np.asarray(times, dtype=float)
+        return np.r_[0, np.cumsum(self._get_interval_lengths(times[:-1], times[1:], n_nodes=n_nodes))]
+
     def get_times_from_distances(self,
                                  n_samples=None,
                                  step_distance=None,
                                  time_steps=10000,
                                  plot=False,
-                                 arbitrary_distances=None):
+                                 arbitrary_distances=None,
+                                 n_newton=3):
         """Calculate numerically times equivalent to given distances travelled.
-        
-        It calculates the cumulative integral over small steps, and picks
-        as a sample time the first time after the integral reaches expected
-        distance at this step.
+
+        It builds a table of cumulative distances on a grid of time_steps times (see :meth:`get_arc_lengths`),
+        finds the interval of each requested distance with a binary search, interpolates linearly inside it
+        and refines the time with Newton steps. For bandlimited models the table is computed over one period and
+        extended periodically, for other models it is extended until it covers all requested distances.
 
         :param arbitrary_distances: if provided, returns times for those distances
         :param n_samples: if provided, n_samples distances are generated uniformly along the trajectory
         :param plot: if true, plot the distance against the (in model) time
-        :param time_steps: number of steps for numerical integration
+        :param time_steps: number of steps of the distance table
         :param step_distance: if provided, samples are generated step_distance apart through trajectory
+        :param n_newton: number of Newton refinement steps.
 
         :return:
             triple:
@@ -398,15 +487,9 @@ n_samples)
             distances at travelled in those times
             and approximation errors
         """
-        times = self.get_times(n_samples=time_steps)
-        basis_prime = self.get_basis_prime(times=times)
-        velocities = self.coeffs.dot(basis_prime)
-
-        time_differences = times[1:] - times[:-1]
-        speeds = np.linalg.norm(velocities, axis=0)
         # generate distances only in the "natural" time of the trajectory
-        # longer distances are generated on the fly
-        cumulative_distances = np.concatenate([[0], np.cumsum((speeds[1:] + speeds[:-1]) / 2 * time_differences)])
+        times = self.get_times(n_samples=time_steps)
+        cumulative_distances = self.get_arc_lengths(times)
 
         if arbitrary_distances is not None:
             if any(d < 0 for d in arbitrary_distances):
@@ -419,30 +502,48 @@ n_samples)
         else:
             raise ValueError("Either n_samples or step_distance or arbitrary distances has to be provided")
 
-        new_times = []
-        errors = []
-        i = 0
-        extra_distance = 0
-        extra_time = 0
-
-        for next_distance in distances:
-            while cumulative_distances[i] < next_distance:
-                i += 1
-                # if we run out of precomputed distances, generate new ones
-                # this requires basis at new times (starting where the previous times ended)
-                # and the new distances have to be added on top of the distance traveled so far
-                if i == len(cumulative_distances):
-                    extra_time += times[-1]
-                    extra_distance += cumulative_distances[-1]
-                    basis_prime = self.get_basis_prime(times=times + extra_time)
-                    velocities = self.coeffs.dot(basis_prime)
-                    speeds = np.linalg.norm(velocities, axis=0)
-                    cumulative_distances = np.cumsum((speeds[1:] + speeds[:-1]) / 2 * time_differences) + extra_distance
-                    i = 0
-            errors.append(cumulative_distances[i] - next_distance)
-            new_times.append(extra_time + times[i])
+        requested = np.asarray(distances, dtype=float)
+        max_distance = np.max(requested) if len(requested) else 0.0
+        if self.model == 'bandlimited' or self.model == 'full_bandlimited':
+            # the speed is periodic, so we only need the table over one period.
+            if times[-1] < self.period:
+                times = np.linspace(0, self.period, 2 * time_steps - 1)
+                cumulative_distances = self.get_arc_lengths(times)
+            n_periods = np.floor(requested / cumulative_distances[-1])
+            offsets = n_periods * self.period
+            remainders = requested - n_periods * cumulative_distances[-1]
+        else:
+            # longer distances require the table at new times, added on top of the distance travelled so far.
+            table_times, table_distances = [times], [cumulative_distances]
+            chunk_times = times
+            while table_distances[-1][-1] < max_distance:
+                chunk_times = chunk_times + (times[-1] - times[0])
+                table_times.append(chunk_times[1:])
+                table_distances.append(table_distances[-1][-1] + self.get_arc_lengths(chunk_times)[1:])
+            times = np.concatenate(table_times)
+            cumulative_distances = np.concatenate(table_distances)
+            offsets = 0.0
+            remainders = requested
+
+        # find first tabulated time after each distance, and interpolate in the interval before.
+        indices = np.clip(np.searchsorted(cumulative_distances, remainders, side='left'), 1, len(times) - 1)
+        t0 = times[indices - 1]
+        d0 = cumulative_distances[indices - 1]
+        interval_lengths = cumulative_distances[indices] - d0
+        ratios = np.divide(remainders - d0, interval_lengths, out=np.zeros_like(d0), where=interval_lengths > 0)
+        new_times = t0 + np.clip(ratios, 0, 1) * (times[indices] - t0)
+
+        errors = np.zeros_like(new_times)
+        for i in range(n_newton + 1):
+            errors = d0 + self._get_interval_lengths(t0, new_times) - remainders
+            if i == n_newton:
+                break
+            speeds = np.linalg.norm(self.coeffs.dot(self.get_basis_prime(times=new_times)), axis=0)
+            new_times = new_times - np.divide(errors, speeds, out=np.zeros_like(errors), where=speeds > EPSILON)
+        new_times = new_times + offsets
 
         if plot:
+            import matplotlib.pyplot as plt
             plt.figure()
             plt.plot(times, cumulative_distances, label="smooth")
             plt.plot(new_times, distances, "*", label="requested distances")
@@ -455,6 +556,15 @@ n_samples)
 
         return np.array(new_times), distances, np.array(errors)
 
+    def _get_interval_lengths(self, times_start, times_end, n_nodes=5):
+        """ Get the distances travelled between each pair of start and end times, with Gauss-Legendre quadrature. """
+        nodes, weights = np.polynomial.legendre.leggauss(n_nodes)
+        half_widths = (times_end - times_start) / 2
+        centers = (times_end + times_start) / 2
+        node_times = (centers[:, None] + half_widths[:, None] * nodes[None, :]).reshape(-1)
+        speeds = np.linalg.norm(self.coeffs.dot(self.get_basis_prime(times=node_times)), axis=0)
+        return half_widths * speeds.reshape((-1, n_nodes)).dot(weights)
+
     def get_local_frame(self, times):
         """Calculate the local frame and the speeds.
 
@@ -496,6 +606,8 @@ n_samples)
 
         # plot
         if ax is not None:
+            from matplotlib.patches import Circle
+            import matplotlib.pyplot as plt
             basis = self.get_basis(times=times)
             sample_points = self.get_sampling_points(basis=basis)
             for i in range(0, sample_points.shape[1]):
@@ -525,6 +637,7 @@ n_samples)
 
         label = 'left and right wheel'
         if ax is not None:
+            import matplotlib.pyplot as plt
             for cl, cr in zip(points_left.T, points_right.T):
                 if all(np.isnan(cl)):
                     continue
@@ -559,27 +672,42 @@ n_samples)
         ds_right = np.linalg.norm(points_right[:, 1:] - points_right[:, :-1], axis=0)
         curvature = np.round((ds_right - ds_left) / (ds_right + ds_left) / width, decimals=curvature_decimals)
 
+        # Merge intervals that have similar curvature, and intervals that are too short: a new segment starts at
+        # the first index j where the curvature differs from the segment's first curvature and the segment is
+        # long enough. We jump from segment to segment using cumulative distances and run-length encoding of the
+        # curvature, instead of looping over all time steps.
+        cumulative_left = np.r_[0, np.cumsum(ds_left)]
+        cumulative_right = np.r_[0, np.cumsum(ds_right)]
+        next_curvature = curvature[1:]  # curvature tested at index j.
+        run_ends = np.r_[np.where(next_curvature[1:] != next_curvature[:-1])[0] + 1, len(next_curvature)]
+
+        # the first segment starts with ds[0] counted twice, for consistency with previous versions.
+        base_left, base_right = -ds_left[0], -ds_right[0]
         previous_c = curvature[0]
-        current_left = ds_left[0]
-        current_right = ds_right[0]
+        first_index = 0
         distances_left = []
         distances_right = []
         new_times = []
-        # Merge intervals that have similar curvature
-        for idx, c in enumerate(curvature[1:]):
-            # Merge intervals that are to short
-            if c == previous_c or max(current_left, current_right) < min_max_distance:
-                current_left += ds_left[idx]
-                current_right += ds_right[idx]
-            else:
-                previous_c = c
-                distances_left.append(current_left)
-                distances_right.append(current_right)
-                new_times.append(times[idx])
-                current_left = ds_left[idx]
-                current_right = ds_right[idx]
-        distances_right.append(current_right)
-        distances_left.append(current_left)
+        while True:
+            # first index where the segment is long enough.
+            long_left = np.searchsorted(cumulative_left, base_left + min_max_distance, side='left')
+            long_right = np.searchsorted(cumulative_right, base_right + min_max_distance, side='left')
+            j = max(first_index, min(long_left, long_right))
+            # first index from there where the curvature changes.
+            if j < len(next_curvature) and next_curvature[j] == previous_c:
+                j = run_ends[np.searchsorted(run_ends, j, side='right')]
+            if j >= len(next_curvature):
+                break
+
+            distances_left.append(cumulative_left[j] - base_left)
+            distances_right.append(cumulative_right[j] - base_right)
+            new_times.append(times[j])
+            previous_c = next_curvature[j]
+            base_left, base_right = cumulative_left[j], cumulative_right[j]
+            first_index = j + 1
+
+        distances_left.append(cumulative_left[len(curvature) - 1] - base_left)
+        distances_right.append(cumulative_right[len(curvature) - 1] - base_right)
         new_times.append(times[len(curvature) - 1])
 
         distances_left = np.array(distances_left)
@@ -587,6 +715,7 @@ n_samples)
         new_times = np.array(new_times)
 
         if plot:
+            import matplotlib.pyplot as plt
             plt.figure()
             plt.plot(np.cumsum(ds_left), np.cumsum(ds_right), label="continous")
             plt.scatter(np.cumsum(distances_left),
@@ -10,3 +10,4 @@ from os.path import abspath, dirname
 
 sys.path.append(dirname(abspath(__file__)) + '/../')
 sys.path.append(dirname(abspath(__file__)) + '/../source/')
+sys.path.append(dirname(abspath(__file__)) + '/../scripts/')
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+import common
+
+import unittest
+
+import numpy as np
+
+from accumulators import *
+
+
+class TestAccumulators(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(1)
+        self.values = np.random.normal(loc=2.0, scale=3.0, size=1000)
+
+    def test_running_statistics(self):
+        statistics = RunningStatistics()
+        for value in self.values[:100]:
+            statistics.add(value)
+        statistics.update(self.values[100:600])
+
+        other = RunningStatistics()
+        other.update(self.values[600:])
+        statistics.merge(other)
+
+        self.assertEqual(statistics.count, len(self.values))
+        self.assertAlmostEqual(statistics.mean, np.mean(self.values))
+        self.assertAlmostEqual(statistics.get_variance(), np.var(self.values))
+
+    def test_running_statistics_array(self):
+        statistics = RunningStatistics(3)
+        statistics.add(1.0, 0)
+        statistics.add(3.0, 0)
+        statistics.add(2.0, 2)
+        np.testing.assert_equal(statistics.count, [2, 0, 1])
+        np.testing.assert_equal(statistics.mean, [2.0, 0.0, 2.0])
+        np.testing.assert_equal(statistics.get_variance(), [1.0, np.nan, 0.0])
+
+    def test_histogram(self):
+        edges = np.linspace(-5, 5, 11)
+        histogram = Histogram(edges)
+        histogram.update(self.values[:500])
+        histogram.update(self.values[500:])
+        counts, __ = np.histogram(self.values, bins=edges)
+        # np.histogram includes the last edge in the last bin.
+        counts[-1] -= np.sum(self.values == edges[-1])
+        np.testing.assert_equal(histogram.counts[1:-1], counts)
+        self.assertEqual(histogram.counts[0], np.sum(self.values < edges[0]))
+        self.assertEqual(histogram.counts[-1], np.sum(self.values >= edges[-1]))
+
+    def test_reservoir_sample(self):
+        sample = ReservoirSample(size=100, seed=1)
+        sample.update(self.values[:50])
+        np.testing.assert_equal(sample.get_sample(), self.values[:50])
+
+        values = np.random.uniform(size=100000)
+        sample = ReservoirSample(size=2000, seed=1)
+        for chunk in np.split(values, 10):
+            sample.update(chunk)
+        self.assertEqual(sample.n_seen, len(values))
+        self.assertEqual(len(sample.get_sample()), 2000)
+        self.assertTrue(np.all(np.isin(sample.get_sample(), values)))
+        np.testing.assert_allclose(sample.get_quantiles([0.1, 0.5, 0.9]), [0.1, 0.5, 0.9], atol=0.05)
+
+        # without seed, the sample is reproducible with the global random state.
+        samples = []
+        for _ in range(2):
+            np.random.seed(2)
+            sample = ReservoirSample(size=100)
+            sample.update(values[:1000])
+            samples.append(sample.get_sample())
+        np.testing.assert_equal(samples[0], samples[1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -21,7 +21,7 @@ class TestLM(unittest.TestCase):
         np.random.seed(1)
 
     def test_fit_trajectory(self):
-        for model in ['bandlimited', 'full_bandlimited', 'polynomial']:
+        for model in ['bandlimited', 'full_bandlimited', 'polynomial', 'bspline']:
             # precision problems for polynomial trajectory
             K = 3 if model == 'polynomial' else 5
             n_samples = 10
@@ -39,6 +39,29 @@ class TestLM(unittest.TestCase):
                 # optimization variable
                 np.testing.assert_allclose(coeffs, traj.coeffs, **KWARGS)
 
+    def test_dct(self):
+        for full_period in [False, True]:
+            for K, n_samples in [(3, 10), (5, 12), (11, 100)]:
+                traj = Trajectory(n_complexity=K, dim=2, model='bandlimited', full_period=full_period)
+                traj.set_coeffs(seed=1)
+                times = traj.get_times(n_samples=n_samples)
+                points = traj.get_sampling_points(times=times) + np.random.normal(size=(2, n_samples))
+
+                frequencies = get_dct_frequencies(times, traj)
+                self.assertIsNotNone(frequencies)
+                coeffs_dct = solve_for_coeffs_dct(points, frequencies)
+                coeffs = solve_for_coeffs(points, traj.get_basis(times=times))
+                np.testing.assert_allclose(coeffs_dct, coeffs, **KWARGS)
+
+                if K >= DCT_MIN_COMPLEXITY:
+                    np.testing.assert_allclose(fit_trajectory(points, times, traj), coeffs, **KWARGS)
+
+        # non-uniform times or other models are not a DCT.
+        self.assertIsNone(get_dct_frequencies(np.sort(np.random.rand(10)), traj))
+        self.assertIsNone(get_dct_frequencies(np.linspace(0.1, 1, 10), traj))
+        traj = Trajectory(n_complexity=3, dim=2, model='polynomial')
+        self.assertIsNone(get_dct_frequencies(traj.get_times(n_samples=10), traj))
+
     def test_fit_trajectory_and_times(self):
         for model in ['bandlimited', 'full_bandlimited', 'polynomial']:
             K = 3 if model == 'polynomial' else 5
@@ -61,6 +84,55 @@ class TestLM(unittest.TestCase):
                 np.testing.assert_allclose(times, traj_times, **KWARGS)
                 np.testing.assert_allclose(coeffs, traj.coeffs, **KWARGS)
 
+    def test_solve_for_times(self):
+        for model in ['bandlimited', 'full_bandlimited', 'polynomial']:
+            K = 3 if model == 'polynomial' else 5
+            n_samples = 20
+            traj = Trajectory(n_complexity=K, dim=2, model=model, full_period=True)
+            traj.set_coeffs(seed=1)
+            traj_times = traj.get_times(n_samples=n_samples)
+            points = traj.get_sampling_points(times=traj_times)
+
+            # times of each point are recovered independently for fixed coefficients.
+            times0 = traj_times + np.random.uniform(-0.01, 0.01, size=n_samples)
+            times = solve_for_times(times0, points, traj.coeffs, traj)
+            np.testing.assert_allclose(times, traj_times, **KWARGS)
+
+    def test_fit_trajectory_orders(self):
+        n_samples = 30
+        for model, K, max_complexity in [('bandlimited', 5, 9), ('full_bandlimited', 5, 9), ('polynomial', 3, 5)]:
+            traj = Trajectory(n_complexity=K, dim=2, model=model)
+            traj.set_coeffs(seed=1)
+            times = traj.get_times(n_samples=n_samples)
+            points = traj.get_sampling_points(times=times) + 1e-2 * np.random.normal(size=(2, n_samples))
+
+            fits = fit_trajectory_orders(points, times, traj, max_complexity=max_complexity)
+            step = 2 if model == 'full_bandlimited' else 1
+            self.assertEqual(fits['complexities'], list(range(1, max_complexity + 1, step)))
+            for K_fit, coeffs, rss, loocv in zip(fits['complexities'], fits['coeffs'], fits['rss'], fits['loocv']):
+                traj_fit = traj.copy()
+                traj_fit.set_n_complexity(K_fit)
+                basis = traj_fit.get_basis(times=times)
+                coeffs_direct = solve_for_coeffs(points, basis)
+                np.testing.assert_allclose(coeffs, coeffs_direct, rtol=1e-5, atol=1e-5)
+                self.assertAlmostEqual(rss, np.sum((points - coeffs_direct @ basis)**2))
+
+                # leave-one-out cross-validation by refitting.
+                loocv_direct = 0
+                for i in range(n_samples):
+                    others = np.arange(n_samples) != i
+                    coeffs_i = solve_for_coeffs(points[:, others], basis[:, others])
+                    loocv_direct += np.sum((points[:, i] - coeffs_i @ basis[:, i])**2) / n_samples
+                self.assertAlmostEqual(loocv, loocv_direct)
+
+            for criterion in ['aic', 'bic', 'loocv']:
+                K_chosen, coeffs = choose_complexity(fits, criterion)
+                self.assertEqual(K_chosen, K)
+                np.testing.assert_allclose(coeffs, traj.coeffs, atol=1e-1)
+
+        with self.assertRaises(ValueError):
+            fit_trajectory_orders(points, times, Trajectory(n_complexity=5, dim=2, model='bspline'))
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -33,6 +33,87 @@ class TestEvaluate(unittest.TestCase):
         # TODO this is not correct for now. There is a shift by two because of filter length.
         #np.testing.assert_allclose(end_indices, [s + duration  for s in start_index_test])
 
+    def test_edge_response(self):
+        from evaluate_dataset import get_edge_response
+
+        pattern = [1, 1, 1, 1, -1, -1]
+        np.random.seed(1)
+        values = np.random.uniform(size=50)
+        response = get_edge_response(values, pattern)
+        for i in range(len(values)):
+            window = values[max(i - len(pattern) + 1, 0):i + 1]
+            pattern_i = pattern if len(window) == len(pattern) else pattern[:-len(window)]
+            self.assertAlmostEqual(response[i], np.sum([a * b for (a, b) in zip(pattern_i, window)]))
+
+        # shorter input than pattern.
+        self.assertEqual(len(get_edge_response(values[:3], pattern)), 3)
+
+    def test_calibration_data(self):
+        from evaluate_dataset import find_calibration_data
+
+        lengths = np.zeros(40)
+        lengths[[5, 20, 21]] = 1.0
+        test_df = pd.DataFrame({'length': lengths, 'timestamp': np.arange(40) + 0.5})
+        calibration_data = find_calibration_data(test_df, [15.5, 30.5, 38.5], [15, 30, 38])
+        self.assertEqual(calibration_data['calibration'], [[5.5, 15.5], [21.5, 30.5], [21.5, 38.5]])
+        self.assertEqual(calibration_data['trajectory'], [[15.5, 21.5], [30.5, 21.5], [38.5, np.inf]])
+
+    def test_calibrate(self):
+        from evaluate_dataset import get_calibration, apply_calibration
+
+        np.random.seed(1)
+        anchor_ids = np.random.choice([1, 2, 3, 'GT'], size=100)
+        distances_gt = np.random.uniform(1, 10, size=100)
+        slopes = {'1': 1.1, '2': 0.9, '3': 1.0, 'GT': 1.0}
+        offsets = {'1': 0.1, '2': -0.2, '3': 0.5, 'GT': 0.0}
+        distances = [(d - offsets[a]) / slopes[a] for a, d in zip(anchor_ids, distances_gt)]
+        test_df = pd.DataFrame({'anchor_id': anchor_ids, 'distance': distances, 'distance_gt': distances_gt})
+        test_df.loc[0, 'distance'] = np.nan
+
+        calibration = get_calibration(test_df)
+        self.assertEqual(list(calibration.index), ['1', '2', '3'])
+        np.testing.assert_allclose(calibration.slope.values, [slopes[a] for a in calibration.index])
+        np.testing.assert_allclose(calibration.offset.values, [offsets[a] for a in calibration.index], atol=1e-10)
+
+        # apply to new data, with an unknown anchor.
+        new_df = pd.DataFrame({'anchor_id': ['3', '4', 'GT', '1'], 'distance': [1.0, 1.0, 1.0, 1.0]})
+        apply_calibration(new_df, calibration)
+        np.testing.assert_allclose(new_df.distance_calib.values, [1.5, np.nan, np.nan, 1.2])
+
+    def test_match_reference(self):
+        from evaluate_dataset import match_reference, match_reference_batch
+
+        np.random.seed(1)
+        angle = 0.7
+        rotation = np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+        points = np.random.normal(size=(2, 10))
+        reference = rotation @ points + 1.0
+        points_copy, reference_copy = points.copy(), reference.copy()
+
+        aligned, (rotation_hat, rotation_center, reference_center) = match_reference(reference, points)
+        np.testing.assert_allclose(aligned, reference)
+        np.testing.assert_allclose(rotation_hat, rotation)
+        np.testing.assert_allclose(rotation_hat @ (points - rotation_center[:, None]) + reference_center[:, None],
+                                   aligned)
+        np.testing.assert_equal(points, points_copy)
+        np.testing.assert_equal(reference, reference_copy)
+
+        # batch of scaled and shifted 3D point sets.
+        points = np.random.normal(size=(20, 3, 10))
+        rotations = np.linalg.qr(np.random.normal(size=(20, 3, 3)))[0]
+        scales = np.random.uniform(0.5, 2.0, size=20)
+        references = scales[:, None, None] * (rotations @ points) + np.random.normal(size=(20, 3, 1))
+        aligned, (rotations_hat, scales_hat, _, _) = match_reference_batch(references, points, scale=True)
+        np.testing.assert_allclose(aligned, references)
+        np.testing.assert_allclose(rotations_hat, rotations, atol=1e-10)
+        np.testing.assert_allclose(scales_hat, scales)
+
+        # reflections are only allowed if reflection=True.
+        _, (rotations_hat, _, _, _) = match_reference_batch(references * [[[1], [1], [-1]]], points)
+        np.testing.assert_allclose(np.linalg.det(rotations_hat), -1.0)
+        _, (rotations_hat, _, _, _) = match_reference_batch(references * [[[1], [1], [-1]]], points, reflection=False)
+        np.testing.assert_allclose(np.linalg.det(rotations_hat), 1.0)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -8,7 +8,7 @@ import unittest
 
 from trajectory import Trajectory
 from constraints import *
-from measurements import get_measurements, create_anchors
+from measurements import get_measurements, create_anchors, create_mask
 
 
 class TestGeometry(unittest.TestCase):
@@ -69,6 +69,47 @@ class TestGeometry(unittest.TestCase):
 
             np.testing.assert_array_almost_equal(T @ x, b)
 
+    def test_reduction_matrix(self):
+        """ Check that the reduced T_B is the extended basis evaluated at the measurement times. """
+        for model in ['bandlimited', 'full_bandlimited', 'polynomial']:
+            for K in [1, 3, 5]:
+                traj = Trajectory(n_complexity=K, dim=2, model=model, full_period=True)
+                traj_extended = Trajectory(n_complexity=2 * K - 1, dim=2, model=model, full_period=True)
+                times = traj.get_times(n_samples=20)
+                basis = traj.get_basis(times=times)
+
+                T_B = np.array([np.outer(f_n, f_n).flatten() for f_n in basis.T])
+                reduction = get_reduction_matrix(model, K)
+                self.assertEqual(reduction.shape, (K * K, 2 * K - 1))
+                np.testing.assert_allclose(T_B @ reduction, traj_extended.get_basis(times=times).T, atol=1e-8)
+
+    def test_C_normal_equations(self):
+        """ Check that the normal equations are the same as the ones built from the constraints. """
+        for model in ['bandlimited', 'full_bandlimited', 'polynomial']:
+            traj = Trajectory(n_complexity=3, dim=2, model=model)
+            traj.set_coeffs(seed=1)
+            anchors = create_anchors(2, 4)
+            basis, D_topright = get_measurements(traj, anchors, n_samples=30)
+            D_topright *= create_mask(30, 4, strategy='uniform', n_missing=40)
+            reduction = get_reduction_matrix(model, 3)
+            for weighted in [False, True]:
+                T_A, T_B, b = get_C_constraints(D_topright, anchors, basis, weighted=weighted)
+                T = np.hstack((T_A, -T_B @ reduction / 2))
+                TT, Tb = get_C_normal_equations(D_topright, anchors, basis, reduction, weighted=weighted)
+                np.testing.assert_allclose(TT, T.T @ T, atol=1e-8)
+                np.testing.assert_allclose(Tb, T.T @ b, atol=1e-8)
+
+    def test_reduction_matrix_bspline(self):
+        """ Check that the selected columns of T_B span its rows. """
+        for K in [4, 5, 6, 10, 20]:
+            traj = Trajectory(n_complexity=K, dim=2, model='bspline')
+            basis = traj.get_basis(n_samples=20 * K)
+            T_B = np.array([np.outer(f_n, f_n).flatten() for f_n in basis.T])
+            reduction = get_reduction_matrix('bspline', K)
+            self.assertEqual(reduction.shape, (K * K, 4 * K - 9))
+            self.assertEqual(np.linalg.matrix_rank(T_B @ reduction.toarray()), np.linalg.matrix_rank(T_B))
+            self.assertEqual(np.linalg.matrix_rank(T_B), 4 * K - 9)
+
 
 if __name__ == "__main__":
     unittest.main()
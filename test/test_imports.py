@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+import common
+
+import subprocess
+import sys
+import unittest
+
+from os.path import abspath, dirname
+
+SOURCE_DIR = dirname(abspath(__file__)) + '/../source/'
+
+# modules of the numerical core, which should not load any plotting or optimization backend.
+CORE_MODULES = ['trajectory', 'constraints', 'measurements', 'solvers', 'coordinate_fitting']
+HEAVY_MODULES = ['matplotlib', 'cvxpy', 'pandas']
+# modules imported by the core modules anyway, excluded from the import time.
+BASE_MODULES = ['numpy', 'scipy.linalg', 'scipy.sparse', 'scipy.special']
+MAX_IMPORT_TIME = 1.0  # in seconds
+
+
+class TestImports(unittest.TestCase):
+    def test_lazy_imports(self):
+        """ Importing the core modules should not import the heavy dependencies. """
+        code = 'import sys\n'
+        code += ''.join('import {}\n'.format(module) for module in CORE_MODULES)
+        code += 'print(",".join(m for m in {} if m in sys.modules))'.format(HEAVY_MODULES)
+        output = subprocess.check_output([sys.executable, '-c', code], cwd=SOURCE_DIR).decode().strip()
+        self.assertEqual(output, '', 'loaded heavy modules: {}'.format(output))
+
+    def test_import_time(self):
+        """ Importing the core modules should be fast, apart from numpy and scipy. """
+        code = 'import time\n'
+        code += ''.join('import {}\n'.format(module) for module in BASE_MODULES)
+        code += 'start = time.perf_counter()\n'
+        code += ''.join('import {}\n'.format(module) for module in CORE_MODULES + ['other_algorithms'])
+        code += 'print(time.perf_counter() - start)'
+        output = subprocess.check_output([sys.executable, '-c', code], cwd=SOURCE_DIR).decode().strip()
+        self.assertLess(float(output), MAX_IMPORT_TIME)
+
+    def test_lazy_plotting(self):
+        """ The plotting functions should still work once called. """
+        code = 'import trajectory\n'
+        code += 'import matplotlib\n'
+        code += 'matplotlib.use("Agg")\n'
+        code += 'traj = trajectory.Trajectory(n_complexity=3)\n'
+        code += 'traj.set_coeffs(seed=1)\n'
+        code += 'traj.plot()\n'
+        subprocess.check_call([sys.executable, '-c', code], cwd=SOURCE_DIR)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -3,6 +3,8 @@
 import common
 
 import unittest
+
+import numpy as np
 from measurements import *
 
 
@@ -12,3 +14,92 @@ class TestGetAnchors(unittest.TestCase):
         dims = 2
         self.assertEqual((dims, n_anchors), create_anchors(dims, n_anchors).shape)
         self.assertEqual((dims, n_anchors), create_anchors(dims, n_anchors, check=True).shape)
+
+
+class TestDistances(unittest.TestCase):
+    def test_D_topright(self):
+        np.random.seed(1)
+        anchors = create_anchors(2, 4)
+        samples = np.random.uniform(size=(2, 25))
+        D = get_D(anchors, samples)
+        D_topright = get_D_topright(anchors, samples)
+        np.testing.assert_allclose(D_topright, D[:25, 25:])
+
+        anchors_norm = get_anchors_norm(anchors)
+        D_chunked = get_D_topright(anchors, samples, chunk_size=7, anchors_norm=anchors_norm)
+        np.testing.assert_allclose(D_chunked, D_topright)
+
+        D_single = get_D_topright(anchors, samples, chunk_size=10, dtype=np.float32)
+        self.assertEqual(D_single.dtype, np.float32)
+        np.testing.assert_allclose(D_single, D_topright, rtol=1e-6)
+
+
+class TestMask(unittest.TestCase):
+    def test_limit_condition(self):
+        import hypothesis as h
+        np.random.seed(1)
+        dim, n_complexity = 2, 4
+        for distribution, n_samples in zip(['uniform', 'single_time'], [10, 40]):
+            for n_missing in [0, 10, 20, 25]:
+                mask = create_mask(n_samples,
+                                   5,
+                                   strategy='limit_condition',
+                                   n_missing=n_missing,
+                                   dim=dim,
+                                   n_complexity=n_complexity,
+                                   distribution=distribution)
+                n_measurements = mask.size - n_missing if distribution == 'uniform' else n_samples - n_missing
+                self.assertEqual(np.sum(mask), n_measurements)
+                p = np.sort(np.sum(mask, axis=0))[::-1]
+                self.assertTrue(h.limit_condition(p, dim + 1, n_complexity))
+        with self.assertRaises(ValueError):
+            create_mask(10, 5, strategy='limit_condition', n_missing=40, dim=dim, n_complexity=n_complexity)
+
+    def test_limit_condition_large(self):
+        """ Large masks, including close to the minimum number of measurements. The timing of create_mask is in
+        scripts/benchmark.py. """
+        import hypothesis as h
+        np.random.seed(1)
+        n_samples, n_anchors = 500, 8
+        for n_missing in [0, 3000, 3985]:
+            mask = create_mask(n_samples, n_anchors, 'limit_condition', n_missing=n_missing, dim=2, n_complexity=5)
+            self.assertEqual(np.sum(mask), mask.size - n_missing)
+            p = np.sort(np.sum(mask, axis=0))[::-1]
+            self.assertTrue(h.limit_condition(p, 3, 5))
+
+    def test_suitable_measurements(self):
+        np.random.seed(1)
+        anchor_indices = np.random.choice(4, size=50)
+        indices = choose_suitable_measurements(anchor_indices, 12, 2, 4, n_anchors=4)
+        self.assertEqual(len(np.unique(indices)), 12)
+        self.assertTrue(np.all(np.diff(indices) > 0))
+        counts = np.bincount(anchor_indices[indices], minlength=4)
+        self.assertGreaterEqual(np.sum(np.minimum(counts, 4)), 12)
+
+
+class TestMeasurements(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(1)
+        self.D_topright = np.random.uniform(1, 10, size=(20, 4))
+        self.D_topright[create_mask(20, 4, strategy='uniform', n_missing=40) == 0] = 0.0
+
+    def test_dense_conversion(self):
+        measurements = Measurements.from_dense(self.D_topright)
+        self.assertEqual(len(measurements), np.sum(self.D_topright > 0))
+        self.assertEqual(measurements.shape, self.D_topright.shape)
+        np.testing.assert_equal(measurements.to_dense(), self.D_topright)
+        np.testing.assert_equal(measurements.get_mask(), self.D_topright > 0)
+        self.assertIs(as_measurements(measurements), measurements)
+
+    def test_sorting(self):
+        measurements = Measurements.from_dense(self.D_topright)
+        order = np.random.permutation(len(measurements))
+        shuffled = Measurements(measurements.time_indices[order], measurements.anchor_indices[order],
+                                measurements.squared_distances[order], *self.D_topright.shape)
+        np.testing.assert_equal(shuffled.time_indices, measurements.time_indices)
+        np.testing.assert_equal(shuffled.anchor_indices, measurements.anchor_indices)
+        np.testing.assert_equal(shuffled.squared_distances, measurements.squared_distances)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -6,8 +6,8 @@ import common
 import numpy as np
 import unittest
 
-from measurements import get_measurements, create_mask
-from other_algorithms import least_squares_lm, cost_function, error_measure
+from measurements import get_measurements, create_mask, Measurements
+from other_algorithms import least_squares_lm, cost_function, error_measure, get_anchors_and_distances
 from other_algorithms import pointwise_srls, get_grid, pointwise_rls
 from solvers import trajectory_recovery
 from trajectory import Trajectory
@@ -45,6 +45,23 @@ class TestOthers(unittest.TestCase):
         Cref = least_squares_lm(D_sparse, self.anchors, self.basis, x0)
         self.assertLess(error_measure(Cref, self.traj.coeffs), eps)
 
+    def test_measurements(self):
+        mask = create_mask(*self.D_gt.shape, strategy='uniform', n_missing=1000)
+        D_sparse = self.D_gt * mask
+        measurements = Measurements.from_dense(D_sparse)
+
+        C_vec = self.traj.coeffs.reshape((-1, )) + 0.1
+        for squared in [True, False]:
+            np.testing.assert_allclose(cost_function(C_vec, D_sparse, self.anchors, self.basis, squared=squared),
+                                       cost_function(C_vec, measurements, self.anchors, self.basis, squared=squared))
+
+        for idx in [0, 10, 199]:
+            r2, a_indices = get_anchors_and_distances(measurements, idx)
+            for r2_m, m in zip(r2.flatten(), a_indices):
+                latest_idx = np.where(D_sparse[:idx + 1, m] > 0)[0][-1]
+                self.assertEqual(r2_m, D_sparse[latest_idx, m])
+            self.assertEqual(len(a_indices), np.sum(np.any(D_sparse[:idx + 1] > 0, axis=0)))
+
     def test_pointwise_srls(self):
         points, __ = pointwise_srls(self.D_gt, self.anchors, self.traj, self.indices)
         points = np.array(points).T
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+import common
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from pipeline import Pipeline, get_code_version, hash_object
+
+
+class TestPipeline(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.pipeline = Pipeline(self.folder)
+        self.calls = []
+        self.create, self.total = self.get_stages(self.pipeline)
+
+    def get_stages(self, pipeline):
+        @pipeline.stage()
+        def create(n, seed=1):
+            self.calls.append('create')
+            return np.random.RandomState(seed).uniform(size=n)
+
+        @pipeline.stage(ignore=['verbose'])
+        def total(values, scale=1.0, verbose=False):
+            self.calls.append('total')
+            return dict(total=scale * np.sum(values))
+
+        return create, total
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_cache(self):
+        values = self.create(10)
+        result = self.total(values)
+        self.assertEqual(self.calls, ['create', 'total'])
+
+        # same inputs: everything is loaded.
+        values_loaded = self.create(10)
+        result_loaded = self.total(values_loaded, verbose=True)
+        self.assertEqual(self.calls, ['create', 'total'])
+        np.testing.assert_equal(values_loaded, values)
+        self.assertEqual(result_loaded, result)
+        self.assertEqual(self.pipeline.history[-2:], [('create', 'loaded'), ('total', 'loaded')])
+
+        # new pipeline on the same folder, as in a new session.
+        pipeline = Pipeline(self.folder)
+        create, total = self.get_stages(pipeline)
+        total(create(10))
+        self.assertEqual(self.calls, ['create', 'total'])
+        self.assertEqual(pipeline.history, [('create', 'loaded'), ('total', 'loaded')])
+
+    def test_dependencies(self):
+        self.total(self.create(10))
+
+        # changing a downstream parameter only recomputes the downstream stage.
+        self.total(self.create(10), scale=2.0)
+        self.assertEqual(self.calls, ['create', 'total', 'total'])
+
+        # changing an upstream parameter recomputes both, since the output of create changed.
+        self.total(self.create(10, seed=2))
+        self.assertEqual(self.calls, ['create', 'total', 'total', 'create', 'total'])
+
+        # inputs that are not stage outputs are hashed.
+        self.total(np.ones(3))
+        self.total(np.ones(3))
+        self.total(np.ones(4))
+        self.assertEqual(self.calls.count('total'), 5)
+
+        # forgotten outputs are hashed instead, new outputs are tracked again.
+        values = self.create(10)
+        self.pipeline.forget()
+        self.total(values)
+        self.assertEqual(self.calls.count('total'), 6)
+        self.total(self.create(10))
+        self.assertEqual(self.calls.count('total'), 6)
+
+    def test_files(self):
+        """ Changing an input file invalidates the cache. """
+        @self.pipeline.stage()
+        def read(filename):
+            with open(filename) as fp:
+                return fp.read()
+
+        filename = os.path.join(self.folder, 'input.txt')
+        with open(filename, 'w') as fp:
+            fp.write('a')
+        self.assertEqual(read(filename), 'a')
+        self.assertEqual(read(filename), 'a')
+        with open(filename, 'w') as fp:
+            fp.write('bc')
+        self.assertEqual(read(filename), 'bc')
+        self.assertEqual([status for __, status in self.pipeline.history], ['computed', 'loaded', 'computed'])
+
+    def test_function_dependencies(self):
+        """ Functions listed in depends are part of the code version. """
+        def scale(value):
+            return 2 * value
+
+        def scale_changed(value):
+            return 3 * value
+
+        self.assertEqual(get_code_version(self.create, [scale]), get_code_version(self.create, [scale]))
+        self.assertNotEqual(get_code_version(self.create, [scale]), get_code_version(self.create, [scale_changed]))
+
+    def test_hash(self):
+        df = pd.DataFrame({'a': [1, 2], 'b': ['x', 'y']})
+        self.assertEqual(hash_object(df), hash_object(df.copy()))
+        self.assertNotEqual(hash_object(df), hash_object(df.rename(columns={'a': 'c'})))
+        self.assertNotEqual(hash_object(np.zeros(2)), hash_object(np.zeros(2, dtype=int)))
+        self.assertNotEqual(hash_object([1, '1']), hash_object(['1', 1]))
+        self.assertEqual(hash_object({'a': 1, 'b': [np.ones(2)]}), hash_object({'b': [np.ones(2)], 'a': 1}))
+
+
+if __name__ == "__main__":
+    unittest.main()
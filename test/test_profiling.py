@@ -0,0 +1,77 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+test_profiling.py: Test the timer registry.
+"""
+
+import common
+
+import time
+import unittest
+
+import numpy as np
+
+from profiling import Profiler, PROFILER, STAGES
+from measurements import get_measurements, create_anchors
+from solvers import trajectory_recovery
+from trajectory import Trajectory
+
+
+class TestProfiler(unittest.TestCase):
+    def setUp(self):
+        self.profiler = Profiler()
+
+    def test_disabled(self):
+        with self.profiler.stage('solve'):
+            pass
+        self.profiler.count('cost_evaluations')
+        self.assertEqual(self.profiler.times, {})
+        self.assertEqual(self.profiler.counts, {})
+
+    def test_nested(self):
+        self.profiler.enable(memory=True)
+        with self.profiler.stage('total'):
+            with self.profiler.stage('solve'):
+                array = np.ones(100000)
+                time.sleep(0.01)
+            del array
+            with self.profiler.stage('solve'):
+                pass
+        self.profiler.count('cost_evaluations', 3)
+        results = self.profiler.get_results()
+        self.profiler.disable()
+
+        self.assertEqual(self.profiler.calls['solve'], 2)
+        self.assertGreaterEqual(results['time_solve'], 0.01)
+        self.assertGreaterEqual(results['time_total'], results['time_solve'])
+        self.assertEqual(results['n_cost_evaluations'], 3)
+        self.assertGreaterEqual(results['memory_solve'], 100000 * 8)
+        self.assertGreaterEqual(results['memory_total'], results['memory_solve'])
+        for stage in STAGES:
+            self.assertIn('time_' + stage, results)
+
+    def test_decorator(self):
+        @self.profiler.profiled('fitting')
+        def add(a, b):
+            return a + b
+
+        self.profiler.enable()
+        self.assertEqual(add(1, 2), 3)
+        self.assertEqual(self.profiler.calls['fitting'], 1)
+
+    def test_trajectory_recovery(self):
+        traj = Trajectory(n_complexity=3, dim=2)
+        traj.set_coeffs(seed=1)
+        anchors = create_anchors(traj.dim, 4)
+        basis, D_topright = get_measurements(traj, anchors, n_samples=20)
+
+        PROFILER.enable()
+        PROFILER.reset()
+        trajectory_recovery(D_topright, anchors, basis)
+        PROFILER.disable()
+        for stage in ['constraints', 'svd', 'solve']:
+            self.assertEqual(PROFILER.calls[stage], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+
+import common
+
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from result_store import ResultStore
+
+
+class TestResultStore(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(1)
+        self.folder = tempfile.mkdtemp()
+        self.results = [{
+            'errors': np.random.uniform(size=(2, 3, 4)),
+            'successes': np.arange(12).reshape((3, 4)),
+            'fortran': np.asfortranarray(np.random.uniform(size=(3, 2))),
+            'empty': np.array([])
+        } for _ in range(3)]
+        store = ResultStore(self.folder)
+        for i, results in enumerate(self.results):
+            self.assertEqual(store.append(results, parameters={'run': i, 'positions': np.arange(3)}), i)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_load(self):
+        store = ResultStore(self.folder)
+        self.assertEqual(len(store), 3)
+        self.assertEqual(store.runs[1]['parameters'], {'run': 1, 'positions': [0, 1, 2]})
+        self.assertEqual(sorted(store.keys()), sorted(self.results[0].keys()))
+        for run, results in enumerate(self.results):
+            for key, array in results.items():
+                np.testing.assert_equal(store.load(key, run), array)
+                np.testing.assert_equal(store.load(key, run, mmap=False), array)
+        np.testing.assert_equal(store.load('errors', 2, np.s_[1, :, 3]), self.results[2]['errors'][1, :, 3])
+
+    def test_aggregate(self):
+        store = ResultStore(self.folder)
+        all_errors = np.stack([results['errors'] for results in self.results], axis=-1)
+        np.testing.assert_allclose(store.load_all('errors'), all_errors)
+        np.testing.assert_allclose(store.get_mean('errors'), np.mean(all_errors, axis=-1))
+        np.testing.assert_allclose(store.get_mean('errors', np.s_[0], runs=[0, 2]),
+                                   np.mean(all_errors[0][..., [0, 2]], axis=-1))
+
+        # the data file can also be read with numpy directly.
+        with np.load(store.datafile) as data:
+            np.testing.assert_equal(data['run1/successes'], self.results[1]['successes'])
+
+
+if __name__ == "__main__":
+    unittest.main()
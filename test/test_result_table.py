@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+import common
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from result_table import ResultTable, read_table
+
+
+class TestResultTable(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(1)
+        self.table = ResultTable()
+        self.coeffs = [np.random.uniform(size=(2, 3)) for _ in range(4)]
+        for i, coeffs in enumerate(self.coeffs):
+            array_id = self.table.add_arrays(coeffs=coeffs, points=None)
+            self.table.append(dict(n_it=i, method='ours', mse=0.1 * i, plotting=array_id))
+        self.table.append(dict(n_it=4, method='gt', cost=1.0))
+
+    def test_dataframe(self):
+        df = self.table.to_dataframe()
+        self.assertEqual(len(df), 5)
+        self.assertEqual(list(df.columns), ['n_it', 'method', 'mse', 'plotting', 'cost'])
+        np.testing.assert_equal(df.cost.values, [np.nan] * 4 + [1.0])
+        self.assertTrue(np.isnan(df.mse.values[-1]))
+
+        df_plotting = self.table.to_dataframe(start=3, plotting=True)
+        self.assertEqual(list(df_plotting.index), [3, 4])
+        coeffs, points = df_plotting.plotting[3]
+        np.testing.assert_equal(coeffs, self.coeffs[3])
+        self.assertIsNone(points)
+        self.assertIsNone(df_plotting.plotting[4])
+
+    def test_extend(self):
+        table = ResultTable()
+        table.append(dict(n_it=-1, plotting=table.add_arrays(coeffs=None, points=None)))
+        table.extend(self.table, dataset='test')
+        self.assertEqual(len(table), 1 + len(self.table))
+        self.assertEqual(table.columns['dataset'], [None] + ['test'] * len(self.table))
+        for i, coeffs in enumerate(self.coeffs):
+            np.testing.assert_equal(table.get_arrays(table.columns['plotting'][i + 1])['coeffs'], coeffs)
+
+    def test_flush(self):
+        folder = tempfile.mkdtemp()
+        filename = os.path.join(folder, 'table.chunks')
+        table = ResultTable()
+        for i in range(self.table.n_rows):
+            record = {name: column[i] for name, column in self.table.columns.items() if column[i] is not None}
+            if 'plotting' in record:
+                record['plotting'] = table.add_arrays(**self.table.get_arrays(record['plotting']))
+            table.append(record)
+            if i % 2 == 1:
+                table.flush(filename)
+        table.flush(filename)
+
+        read = read_table(filename)
+        shutil.rmtree(folder)
+        self.assertEqual(len(read), len(self.table))
+        self.assertTrue(read.to_dataframe().equals(self.table.to_dataframe()))
+        for array_id, coeffs in enumerate(self.coeffs):
+            np.testing.assert_equal(read.get_arrays(array_id)['coeffs'], coeffs)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+import common
+
+import unittest
+
+import numpy as np
+
+from measurements import create_anchors, create_mask, get_measurements
+from run_experiments import get_tasks, run_experiments
+from trajectory import Trajectory
+
+METHODS = ['ours', 'srls']
+
+
+class TestRunExperiments(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(1)
+        traj = Trajectory(n_complexity=3, dim=2, model='polynomial')
+        traj.set_coeffs(seed=1)
+        anchors = create_anchors(2, 4)
+        times = traj.get_times(n_samples=40)
+        __, D = get_measurements(traj, anchors, times=times)
+        D = np.multiply(D, create_mask(40, 4, strategy='single_time'))
+        self.segments = [
+            dict(dataset='synthetic',
+                 time_range=(0, 1),
+                 traj=traj,
+                 anchors=anchors,
+                 D=D,
+                 times=times,
+                 points_gt=traj.get_sampling_points(times=times).T)
+        ]
+
+    def test_get_tasks(self):
+        """ Combinations with too many or too few measurements are skipped. """
+        tasks = get_tasks(self.segments, [5, 10, 50], [2, 3], n_its=2, methods=METHODS)
+        # the minimum is (D+2)K-1: 7 for K=2 and 11 for K=3, and only 40 measurements are available.
+        self.assertEqual([(task['n_measurements'], task['n_complexity']) for task in tasks], [(10, 2), (10, 2)])
+        self.assertEqual(len(set(task['seed'] for task in tasks)), 2)
+
+    def test_processes(self):
+        """ The results do not depend on the number of processes. """
+        tasks = get_tasks(self.segments, [12, 20], [2, 3], n_its=2, methods=METHODS)
+        results = [
+            run_experiments(self.segments, tasks, n_processes=n_processes).to_dataframe(plotting=True)
+            for n_processes in [1, 2]
+        ]
+        self.assertEqual(len(results[0]), len(results[1]))
+        for column in ['dataset', 'method', 'n_measurements', 'n_complexity', 'n_it', 'mse', 'mae']:
+            np.testing.assert_equal(results[0][column].values, results[1][column].values)
+        for plotting_1, plotting_2 in zip(results[0].plotting, results[1].plotting):
+            for array_1, array_2 in zip(plotting_1, plotting_2):
+                np.testing.assert_equal(array_1, array_2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -6,7 +6,9 @@ import common
 import unittest
 import os
 
-from simulation import run_simulation
+import numpy as np
+
+from simulation import run_simulation, adaptive_sweep, fill_sweep, get_max_missing, get_wilson_interval
 
 
 class TestSimulation(unittest.TestCase):
@@ -34,6 +36,45 @@ class TestSimulation(unittest.TestCase):
         except RuntimeError as e:
             self.fail("run_simulation raised exception: " + str(e))
 
+    def test_adaptive_simulation(self):
+        parameters = dict(self.parameters, sweep='adaptive', success_thresholds=[1e-5])
+        results = run_simulation(parameters, solver="trajectory_recovery")
+        successes = results['successes']
+        n_missing_max = get_max_missing(2, 4, 3, 6, 18)
+        np.testing.assert_equal(successes[0, 0, 0, 0, n_missing_max + 1:18], 0.0)
+        self.assertFalse(np.any(np.isnan(successes[0, 0, 0, 0, :18])))
+
+    def test_adaptive_sweep(self):
+        true_rates = np.r_[np.ones(40), np.linspace(1, 0, 5), np.zeros(55)]
+        evaluated = []
+
+        def evaluate(idx):
+            evaluated.append(idx)
+            return true_rates[idx]
+
+        # exact rates, as with many iterations.
+        rates = adaptive_sweep(evaluate, len(true_rates) - 1, n_its=100000, tolerance=0.05)
+        self.assertLess(len(evaluated), 30)
+        self.assertEqual(sorted(evaluated), sorted(rates.keys()))
+
+        estimated = np.full(len(true_rates), np.nan)
+        estimated[evaluated] = true_rates[evaluated]
+        fill_sweep([estimated], sorted(evaluated))
+        np.testing.assert_allclose(estimated, true_rates)
+
+        # with few iterations, equal rates at both ends do not hide the transition.
+        evaluated = []
+        adaptive_sweep(evaluate, len(true_rates) - 1, n_its=5, tolerance=0.05)
+        self.assertEqual(len(evaluated), len(true_rates))
+
+    def test_wilson_interval(self):
+        lower, upper = get_wilson_interval(1.0, 10)
+        self.assertEqual(upper, 1.0)
+        self.assertAlmostEqual(lower, 0.7225, places=4)
+        lower, upper = get_wilson_interval(0.5, 100)
+        self.assertAlmostEqual(0.5 - lower, upper - 0.5)
+        self.assertLess(upper - lower, 0.2)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -3,13 +3,13 @@
 
 import common
 
-from cvxpy import CVXOPT
+from cvxpy import CVXOPT, SCS
 import numpy as np
 import unittest
 
-from solvers import semidef_relaxation_noiseless
+from solvers import semidef_relaxation_noiseless, trajectory_recovery, SemidefSolver, OPTIONS
 from trajectory import Trajectory
-from measurements import get_measurements, create_anchors
+from measurements import get_measurements, create_anchors, create_mask
 
 DIM = 2
 
@@ -46,6 +46,59 @@ class TestSolvers(unittest.TestCase):
             np.testing.assert_array_almost_equal(X[:DIM:, :DIM], np.eye(DIM), decimal=1)
             np.testing.assert_array_almost_equal(coeffs_est, self.traj.coeffs, decimal=1)
 
+    def test_semidef_solver_options(self):
+        """ Check that solver options are only changed for the given instance. """
+        options = dict(OPTIONS[CVXOPT])
+        sdp_solver = SemidefSolver(DIM, self.traj.n_complexity, 20, self.n_anchors, chosen_solver=CVXOPT, max_iters=50)
+        self.assertEqual(sdp_solver.options['max_iters'], 50)
+        self.assertEqual(OPTIONS[CVXOPT], options)
+
+    def test_semidef_solver(self):
+        """ Check that the reusable solver recovers the coefficients for different masks, reusing the problem (and the
+        SCS warm start) for masks with the same number of measurements. """
+        sdp_solver = SemidefSolver(DIM, self.traj.n_complexity, 20, self.n_anchors, chosen_solver=SCS, eps=1e-6)
+        for i in range(4):
+            self.set_measurements(seed=i)
+            mask = create_mask(20, self.n_anchors, strategy='uniform', n_missing=(i // 2) * 10)
+            X = sdp_solver.solve(self.D_topright * mask, self.anchors, self.basis)
+            np.testing.assert_array_almost_equal(X[:DIM, :DIM], np.eye(DIM), decimal=1)
+            np.testing.assert_array_almost_equal(X[:DIM, DIM:], self.traj.coeffs, decimal=1)
+        self.assertEqual(sorted(sdp_solver.problems.keys()), [20 * self.n_anchors - 10, 20 * self.n_anchors])
+
+    def test_trajectory_recovery_reduction(self):
+        """ Check that the precomputed reduction gives the same result as the SVD. """
+        for model in ['bandlimited', 'full_bandlimited', 'polynomial']:
+            self.traj = Trajectory(n_complexity=3, dim=2, model=model)
+            for i in range(10):
+                self.set_measurements(seed=i)
+                D_noisy = self.D_topright + 1e-3 * np.random.normal(size=self.D_topright.shape)
+                for weighted in [False, True]:
+                    coeffs_svd = trajectory_recovery(D_noisy, self.anchors, self.basis, weighted=weighted)
+                    coeffs_model = trajectory_recovery(D_noisy,
+                                                       self.anchors,
+                                                       self.basis,
+                                                       weighted=weighted,
+                                                       model=model)
+                    np.testing.assert_allclose(coeffs_svd, coeffs_model, atol=1e-6)
+                coeffs_model = trajectory_recovery(self.D_topright, self.anchors, self.basis, model=model)
+                np.testing.assert_allclose(coeffs_model, self.traj.coeffs, atol=1e-6)
+
+    def test_trajectory_recovery_bspline(self):
+        """ Check that the sparse and dense bspline basis give the correct coefficients. """
+        self.traj = Trajectory(n_complexity=10, dim=2, model='bspline')
+        self.set_measurements(seed=1)
+        times = self.traj.get_times(n_samples=200)
+        basis = self.traj.get_basis(times=times, sparse=True)
+        D_topright = get_measurements(self.traj, self.anchors, times=times)[1]
+        D_topright *= create_mask(200, self.n_anchors, strategy='uniform', n_missing=200)
+        for basis in [basis, basis.toarray()]:
+            coeffs = trajectory_recovery(D_topright, self.anchors, basis, model='bspline')
+            np.testing.assert_allclose(coeffs, self.traj.coeffs, atol=1e-6)
+
+        # without the model, the rank of T_B is not the expected one.
+        with self.assertRaises(ValueError):
+            trajectory_recovery(D_topright, self.anchors, basis)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -6,7 +6,45 @@ import common
 import numpy as np
 import unittest
 
-from trajectory import Trajectory
+from trajectory import Trajectory, plot_segments
+
+
+# output of get_left_and_right_arcs(time_steps=1000, min_max_distance=0.3) for ARCS_COEFFS, computed with the
+# previous implementation (loop over all time steps): distances_left, distances_right and times.
+ARCS_COEFFS = [[0.5, 1.0, -0.3], [1.5, 0.2, 0.8]]
+ARCS_FIXTURE = {
+    'bandlimited': [
+        [
+            1.7572222097540289, 1.1208616733654833, 0.3304324741395909, 0.2587272311533859, 0.23063738818287477,
+            0.2079880574842626, 0.20741621652633965, 0.23484299093439195, 0.2650135266718823, 0.28189650210142214,
+            1.1034621418462118, 2.220625914839774
+        ],
+        [
+            1.7816123577738476, 1.168642346933112, 0.3630381894290395, 0.30300378604237765, 0.3007809170827346,
+            0.30742615242651494, 0.30292046448709375, 0.30132489265197576, 0.3071932876931661, 0.3089743172063788,
+            1.1513712141489438, 2.252103731345552
+        ],
+        [
+            0.23223223223223222, 0.33933933933933935, 0.3763763763763764, 0.41041041041041043, 0.44744744744744747,
+            0.4874874874874875, 0.5265265265265265, 0.5625625625625625, 0.5955955955955956, 0.6256256256256256,
+            0.7227227227227228, 0.998998998998999
+        ],
+    ],
+    'polynomial': [
+        [
+            0.32256033813100443, 0.3022434660220856, 0.3015395917868376, 0.30076465435621125, 0.3023116152505757,
+            0.9974503791678156, 1.5438993833332846
+        ],
+        [
+            0.21473435060344903, 0.2233352255592159, 0.2513816054323873, 0.26919752111164386, 0.2811005193831746,
+            0.9600492299126198, 1.519239053777376
+        ],
+        [
+            0.26226226226226224, 0.4964964964964965, 0.7047047047047047, 0.8868868868868869, 1.049049049049049,
+            1.4854854854854855, 1.997997997997998
+        ],
+    ],
+}
 
 
 class TestTrajectory(unittest.TestCase):
@@ -64,6 +102,84 @@ class TestTrajectory(unittest.TestCase):
         np.testing.assert_almost_equal(distances, distances_reconstructed)
         np.testing.assert_almost_equal(times, [0, 1, 2], decimal=5)
 
+    def test_times_and_distances_extension(self):
+        trajectory = Trajectory(n_complexity=2, model='polynomial')
+        trajectory.coeffs = np.zeros_like(trajectory.coeffs)
+        trajectory.coeffs[0, 1] = 1
+        distances = [0.5, 3, 7.5]
+        times, distances_reconstructed, errors = trajectory.get_times_from_distances(arbitrary_distances=distances)
+        np.testing.assert_almost_equal(times, distances)
+        np.testing.assert_almost_equal(errors, 0)
+
+    def test_left_and_right_arcs(self):
+        trajectory = Trajectory(n_complexity=5, model='full_bandlimited')
+        trajectory.set_coeffs(seed=1)
+        min_max_distance = 0.2
+        distances_left, distances_right, times = trajectory.get_left_and_right_arcs(time_steps=10000,
+                                                                                    min_max_distance=min_max_distance)
+        self.assertEqual(len(distances_left), len(times))
+        self.assertEqual(len(distances_right), len(times))
+        self.assertTrue(np.all(np.diff(times) > 0))
+        # all segments except the last one are long enough.
+        self.assertTrue(np.all(np.maximum(distances_left, distances_right)[:-1] >= min_max_distance))
+
+        # same output as the previous implementation, up to rounding of the sums.
+        for model, expected in ARCS_FIXTURE.items():
+            trajectory = Trajectory(n_complexity=3, model=model, coeffs=np.array(ARCS_COEFFS))
+            arcs = trajectory.get_left_and_right_arcs(time_steps=1000, min_max_distance=0.3)
+            for array, expected_array in zip(arcs, expected):
+                np.testing.assert_allclose(array, expected_array, rtol=1e-12)
+
+    def test_bspline(self):
+        trajectory = Trajectory(n_complexity=8, model='bspline')
+        times = trajectory.get_times(n_samples=50)
+        basis = trajectory.get_basis(times=times)
+        basis_sparse = trajectory.get_basis(times=times, sparse=True)
+        np.testing.assert_allclose(basis_sparse.toarray(), basis)
+        self.assertLessEqual(basis_sparse.nnz, 4 * len(times))
+        np.testing.assert_allclose(np.sum(basis, axis=0), 1.0)
+
+        # compare derivatives with finite differences.
+        delta = 1e-6
+        basis_prime = trajectory.get_basis(times=times + delta) - trajectory.get_basis(times=times - delta)
+        basis_prime /= 2 * delta
+        np.testing.assert_allclose(trajectory.get_basis_prime(times), basis_prime, atol=1e-6)
+        basis_twoprime = trajectory.get_basis_prime(times + delta) - trajectory.get_basis_prime(times - delta)
+        basis_twoprime /= 2 * delta
+        np.testing.assert_allclose(trajectory.get_basis_twoprime(times), basis_twoprime, atol=1e-4)
+
+    def test_plot_connections(self):
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+
+        n_samples = 100
+        basis = self.trajectory.get_basis(n_samples=n_samples)
+        anchors = np.random.uniform(-5, 5, size=(2, 4))
+        mask = np.ones((n_samples, 4))
+        mask[::3, 1:] = 0
+
+        # all measurements are drawn with a constant number of artists.
+        fig, ax = plt.subplots()
+        self.trajectory.plot_connections(basis, anchors, mask, ax=ax, color='black')
+        self.trajectory.plot_noisy_connections(basis, anchors, mask, 2 * np.ones(mask.shape), ax=ax)
+        self.trajectory.plot_number_measurements(basis, mask, ax=ax)
+        self.assertEqual(len(ax.collections), 5)
+        self.assertEqual(len(ax.collections[0].get_segments()), np.sum(mask))
+        self.assertEqual(len(ax.collections[1].get_segments()), 2 * np.sum(mask))
+        plt.close(fig)
+
+        # without color, the segments continue the color cycle of the axes, like ax.plot.
+        fig, ax = plt.subplots()
+        line_before, = ax.plot([0, 1], [0, 1])
+        lines = plot_segments(ax, np.zeros((2, 3)), np.ones((2, 3)))
+        line_after, = ax.plot([0, 1], [1, 0])
+        cycle_colors = plt.rcParams['axes.prop_cycle'].by_key()['color']
+        self.assertEqual(line_before.get_color(), cycle_colors[0])
+        np.testing.assert_allclose(lines.get_colors(), matplotlib.colors.to_rgba_array(cycle_colors[1:4]))
+        self.assertEqual(line_after.get_color(), cycle_colors[4])
+        plt.close(fig)
+
 
 if __name__ == "__main__":
     unittest.main()
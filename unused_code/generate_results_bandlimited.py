@@ -8,8 +8,9 @@ import matplotlib.pylab as plt
 import numpy as np
 import pandas as pd
 
-from evaluate_dataset import compute_distance_matrix, compute_anchors
-from generate_results import generate_results, add_gt_fitting, generate_suitable_mask, calibrate
+from evaluate_dataset import compute_distance_matrix, compute_anchors, calibrate
+from generate_results import generate_results, add_gt_fitting, generate_suitable_mask
+from result_table import ResultTable
 from plotting_tools import plot_complexities, add_scalebar
 from public_data_utils import read_dataset, get_ground_truth, get_plotting_params
 
@@ -64,7 +65,7 @@ if __name__ == "__main__":
         fig, axs = plt.subplots(len(list_measurements), len(list_complexities), sharex=True, sharey=True)
         fig_size = [5, 1.2 * len(list_measurements)]
 
-    result_df = pd.DataFrame(columns=['n_it', 'n_complexity', 'n_measurements', 'mae', 'mse', 'method', 'plotting'])
+    result_table = ResultTable()
     for j, n_complexity in enumerate(list_complexities):
         if verbose:
             print(f'K={n_complexity}')
@@ -86,23 +87,24 @@ if __name__ == "__main__":
                 times_small = np.array(times)[indices]
                 points_small = points_gt[indices, :]
 
-                current_results = generate_results(traj,
-                                                   D_small,
-                                                   times_small,
-                                                   anchors,
-                                                   points_small,
-                                                   n_it=n_it,
-                                                   methods=METHODS)
-                points_fitted = add_gt_fitting(traj, times_small, points_small, current_results, n_it=0)
-
-                result_df = pd.concat((result_df, current_results), ignore_index=True, sort=False)
+                last_start = len(result_table)
+                generate_results(traj,
+                                 D_small,
+                                 times_small,
+                                 anchors,
+                                 points_small,
+                                 n_it=n_it,
+                                 methods=METHODS,
+                                 table=result_table)
+                points_fitted = add_gt_fitting(traj, times_small, points_small, result_table, n_it=0)
 
             if resultname != '':
-                result_df.to_pickle(resultname)
+                result_table.to_dataframe(plotting=True).to_pickle(resultname)
                 print('saved as', resultname)
 
             if plotting:
                 results_plotting = {}
+                current_results = result_table.to_dataframe(start=last_start, plotting=True)
                 for m, df in current_results.groupby('method'):
                     results_plotting[m] = df.iloc[-1].loc['plotting']
                 ax = axs[i, j]